@@ -2,14 +2,23 @@
 import argparse
 import logging
 import logging.config
-import pandas as pd
+import logging.handlers
+import multiprocessing
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
 from pathlib import Path
 
+from data.util import schema, store
+from data.util.cache import (CACHE_DIR, cached_frame, cached_outputs,
+                             imported_sources, restore_outputs, stage_key)
 from data.util.dataframe import get_group
-from features.descriptive import demographics, flowchart
-from features.comparative import cessation
-from models.linear import univariate, multivariate
-from visualization import violin, regression
+from data.util.schema import memory_report, widen_floats
+from data.util.store import map_frame, read_frame, write_frame
 
 runs = [
     "descriptive", "comparative", "regression", "clustering", "visualisation"
@@ -30,89 +39,401 @@ demo_params = [
     "bp_la_avg",
     "bp_wap_avg",
 ]
+# Independent variables of the univariate regressions
+i_vars = ["fev1", "fvc", "fev1_fvc", "fev1_pp", "smoking_cessation_duration"]
 # Whether to scale all parameters to [0, 1] before plotting/regression
 min_max_params = False
 
+# Columns each run reads besides the bronchial parameters, None reads all
+# (the descriptive run summarises every variable)
+group_columns = [
+    "pack_years", "sex", "GOLD_stage", "copd_diagnosis", "asthma_diagnosis",
+    "cancer_type"
+]
+covariates = ["age", "height", "weight", "pack_year_categories"]
+run_columns = {
+    runs[0]: None,
+    runs[1]: covariates + ["smoking_cessation_duration"],
+    runs[2]: covariates + [
+        "fev1", "fvc", "fev1_fvc", "fev1_pp", "smoking_cessation_duration"
+    ],
+    runs[3]: [],
+    runs[4]: [
+        "age", "height", "weight", "bmi", "fev1_fvc", "fev1_pp",
+        "smoking_cessation_duration", "smoking_status"
+    ],
+}
+
+# Lines of ``python -X importtime``: self and cumulative microseconds, and
+# the module, indented by its nesting
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+# Modules listed by the import profile
+IMPORT_TOP = 20
+
 src_dir = Path(__file__).resolve().parent
 logging.config.fileConfig(src_dir / "logging.conf")
 logger = logging.getLogger("BronchialParameters")
 
 
+def get_columns(to_run: list, bps: list):
+    """
+    Return the columns needed by the given runs, or None if a run needs all.
+
+    Parameters:
+    to_run (list): The runs to execute.
+    bps (list): The bronchial parameters analysed.
+
+    Returns:
+    list: The columns to load.
+    """
+    columns = group_columns + bps
+    for run in to_run:
+        if run_columns[run] is None:
+            return None
+        columns += [col for col in run_columns[run] if col not in columns]
+    return columns
+
+
+def load_data(in_file: str, columns: list, pack_years: float):
+    """
+    Load the columns to analyse of the participants above a pack-year
+    threshold.
+
+    Parameters:
+    in_file (str): The processed dataset.
+    columns (list): The columns to load, None loads all.
+    pack_years (float): Minimum pack years.
+
+    Returns:
+    pd.DataFrame: The loaded data.
+    """
+    # Filter the dataset by pack years while reading.
+    data_all = read_frame(in_file,
+                          columns=columns,
+                          filters=[("pack_years", ">=", pack_years)],
+                          index_col=0)
+    logger.debug(f"Loaded {memory_report(data_all)}")
+    # Statistics are computed in float64, the schema stores bps as float32
+    widen_floats(data_all)
+    # Categories emptied by the filter would enter the models as empty levels
+    for col in data_all.select_dtypes("category"):
+        data_all[col] = data_all[col].cat.remove_unused_categories()
+    return data_all
+
+
+def select_group(data_all, health_stat: str):
+    """
+    Select the participants of a health status group.
+
+    Parameters:
+    data_all (pd.DataFrame): The loaded data.
+    health_stat (str): "healthy", "unhealthy" or "all" (without asthma).
+
+    Returns:
+    pd.DataFrame: The participants to analyse.
+    """
+    if health_stat == "all":
+        data = get_group(data_all, "all")
+        return data[data["asthma_diagnosis"] == False]
+    return get_group(data_all, health_stat)
+
+
+# ------ Units of work, run independently and possibly in parallel. Each takes
+# the loaded data, the selected group, the output directory and the bps. The
+# frames are shared by all units, the analyses never modify their input.
+# The analyses are imported when a unit runs, so the CLI only pays for the
+# libraries of the selected runs.
+def describe(data_all, data, out_path, bps):
+    from features.descriptive import demographics, flowchart
+    demographics.calc_demographics(data, demo_params,
+                                   out_path, "health_status")
+    flowchart.make_chart(data_all, out_path)
+
+
+def compare_cessation(data_all, data, out_path, bps):
+    from features.comparative import cessation
+    cessation.analyse(data, bps, out_path)
+
+
+def fit_univariate(data_all, data, out_path, bps, i_var):
+    from models.linear import univariate
+    univariate.fit_analyse(data, bps, i_var, out_path,
+                           min_max_params)
+
+
+def fit_multivariate(data_all, data, out_path, bps):
+    from models.linear import multivariate
+    multivariate.fit_analyse(data, bps, out_path,
+                             min_max_params)
+
+
+def plot_violins(data_all, data, out_path, bps):
+    from visualization import violin
+    violin.make_plots(data, bps, out_path)
+
+
+def plot_regressions(data_all, data, out_path, bps):
+    from visualization import regression
+    regression.make_plots(data, bps, out_path, min_max_params)
+
+
+run_units = {
+    runs[0]: {
+        "descriptive": describe
+    },
+    runs[1]: {
+        "cessation": compare_cessation
+    },
+    runs[2]: {
+        **{
+            f"univariate_{i_var}": partial(fit_univariate, i_var=i_var)
+            for i_var in i_vars
+        },
+        "multivariate": fit_multivariate,
+    },
+    runs[3]: {},
+    runs[4]: {
+        "violin": plot_violins,
+        "regression": plot_regressions
+    },
+}
+
+# Worker process state: the paths of the shared frames, loaded on first use
+_worker = {}
+
+
+def init_worker(queue, level: int, frame_paths: list):
+    """
+    Set up a pool worker: log through the parent and map the shared frames.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+
+    logger.handlers = [logging.handlers.QueueHandler(queue)]
+    logger.setLevel(level)
+    _worker["frame_paths"] = frame_paths
+
+
+def run_unit(stage: str, key: str, func, out_path: Path, bps: list,
+             cache_dir, frames: tuple = None):
+    """
+    Run a unit of work, storing its outputs in the stage cache.
+
+    In a pool worker ``frames`` is None and the data is memory-mapped from
+    the Arrow files written by the parent.
+
+    Returns:
+    tuple: The stage and the seconds it took.
+    """
+    start = time.perf_counter()
+    if frames is None:
+        if "frames" not in _worker:
+            _worker["frames"] = [
+                map_frame(path) for path in _worker["frame_paths"]
+            ]
+        frames = _worker["frames"]
+    data_all, data = frames
+    cached_outputs(stage, key, lambda path: func(data_all, data, path, bps),
+                   out_path, cache_dir)
+    return stage, time.perf_counter() - start
+
+
+def run_pool(units: list, frames: tuple, bps: list, cache_dir,
+             jobs: int) -> dict:
+    """
+    Run units of work on a pool of ``jobs`` processes.
+
+    The frames are written once to uncompressed Arrow IPC files which the
+    workers memory-map, instead of pickling a copy to every task. Their float
+    columns, the parameters, are shared read-only by the workers, the other
+    columns are copied into each. Worker log records are sent back through
+    a queue and handled by the parent, so the output of concurrent units
+    does not interleave mid-line.
+
+    Returns:
+    dict: The seconds each stage took.
+    """
+    timings = {}
+    context = multiprocessing.get_context()
+    queue = context.Queue()
+    listener = logging.handlers.QueueListener(queue,
+                                              *logger.handlers,
+                                              respect_handler_level=True)
+    listener.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            frame_paths = [
+                write_frame(frame, Path(tmp) / f"{name}.arrow", typed=False)
+                for name, frame in zip(["data_all", "data"], frames)
+            ]
+            with ProcessPoolExecutor(max_workers=jobs,
+                                     mp_context=context,
+                                     initializer=init_worker,
+                                     initargs=(queue, logger.level,
+                                               frame_paths)) as pool:
+                futures = [
+                    pool.submit(run_unit, *unit, bps, cache_dir)
+                    for unit in units
+                ]
+                for future in as_completed(futures):
+                    stage, seconds = future.result()
+                    timings[stage] = seconds
+                    logger.info(f"Finished {stage} in {seconds:.1f} s")
+    finally:
+        listener.stop()
+    return timings
+
+
+def log_timings(timings: dict, cached: list, load: float, total: float):
+    """
+    Log the time spent per run, summed over its units, and the units
+    restored from the cache.
+
+    Parameters:
+    timings (dict): The seconds of every stage run.
+    cached (list): The stages restored from the cache.
+    load (float): Seconds spent loading and selecting the data.
+    total (float): Seconds of the whole invocation.
+    """
+    logger.info("Timings:")
+    logger.info(f"  {'load':15} {load:8.1f} s")
+    for run in runs:
+        ran = [s for stage, s in timings.items() if stage.split("/")[0] == run]
+        hits = [stage for stage in cached if stage.split("/")[0] == run]
+        if ran or hits:
+            logger.info(f"  {run:15} {sum(ran):8.1f} s  {len(ran)} units run, "
+                        f"{len(hits)} cached")
+    logger.info(f"  {'total':15} {total:8.1f} s")
+
+
+def profile_imports(argv: list, top: int = IMPORT_TOP) -> int:
+    """
+    Run the CLI again under ``python -X importtime`` and log the total import
+    time and the top-level imports that took longest.
+
+    Parameters:
+    argv (list): The arguments of the run to profile.
+    top (int): Imports to list.
+
+    Returns:
+    int: The exit code of the run.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", __file__, *argv],
+        stderr=subprocess.PIPE,
+        text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match is None:
+            # The log of the run
+            print(line, file=sys.stderr)
+        elif not match.group(3):
+            imports.append((int(match.group(2)), match.group(4)))
+    imports.sort(reverse=True)
+    logger.info(f"Imported {len(imports)} top-level modules in "
+                f"{sum(us for us, _ in imports) / 1e6:.2f} s, slowest:")
+    for us, module in imports[:top]:
+        logger.info(f"{us / 1e3:9.1f} ms  {module}")
+    return result.returncode
+
+
 def main(args):
+    start = time.perf_counter()
     if args.debug:
         logger.setLevel(logging.DEBUG)
+    if "all" in args.to_run:
+        args.to_run = runs
 
-    data_all = pd.read_csv(args.in_file, low_memory=False)
-    # Filter the dataset by pack years.
-    data_all = data_all[data_all.pack_years >= args.pack_years]
     bps = args.param_list.split(",")
-    main_out_dir = Path(args.out_directory)
-
-    # Select group to analyse
-    if args.health_stat == "healthy":
-        data = get_group(data_all, "healthy")
-        main_out_dir = main_out_dir / "healthy"
-    elif args.health_stat == "unhealthy":
-        data = get_group(data_all, "unhealthy")
-        main_out_dir = main_out_dir / "unhealthy"
-    elif args.health_stat == "all":
-        data = get_group(data_all, "all")
-        data = data[data["asthma_diagnosis"] == False]
-        main_out_dir = main_out_dir / "all"
-    else:
-        raise ValueError("Invalid health status: " + args.heath_stat)
-
-    run_funcs = {
-        runs[0]:
-        lambda: (
-            demographics.calc_demographics(data.copy(deep=True), demo_params,
-                                           out_path, "health_status"),
-            flowchart.make_chart(data_all.copy(deep=True), out_path),
-        ),
-        runs[1]:
-        lambda: (cessation.analyse(data.copy(deep=True), bps, out_path), ),
-        runs[2]:
-        lambda: (
-            univariate.fit_analyse(data.copy(deep=True), bps, "fev1", out_path,
-                                   min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "fvc", out_path,
-                                   min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "fev1_fvc",
-                                   out_path, min_max_params),
-            univariate.fit_analyse(data.copy(deep=True), bps, "fev1_pp",
-                                   out_path, min_max_params),
-            univariate.fit_analyse(
-                data.copy(deep=True),
-                bps,
-                "smoking_cessation_duration",
-                out_path,
-                min_max_params,
-            ),
-            multivariate.fit_analyse(data.copy(deep=True), bps, out_path,
-                                     min_max_params),
-        ),
-        runs[3]:
-        lambda: (),
-        runs[4]:
-        lambda: (
-            violin.make_plots(data.copy(deep=True), bps, out_path),
-            regression.make_plots(data.copy(deep=True), bps, out_path,
-                                  min_max_params),
-        ),
-    }
-
-    # Run the analysis based on the desired run
+    columns = get_columns(args.to_run, bps)
+    main_out_dir = Path(args.out_directory) / args.health_stat
+    cache_dir = None if args.no_cache else CACHE_DIR
+    if runs[4] in args.to_run:
+        from visualization import fits, render
+        render.force = args.force or args.no_cache
+        fits.cache_dir = cache_dir
+
+    # The keys only need the input file hash, the data is only loaded if a
+    # unit is not cached
+    load_key = stage_key("load",
+                         inputs=[Path(args.in_file)],
+                         code=[load_data] + imported_sources(schema, store),
+                         params={
+                             "columns": columns,
+                             "pack_years": args.pack_years
+                         })
+    select_key = stage_key("select",
+                           inputs=[load_key],
+                           code=[select_group] +
+                           imported_sources("data.util.dataframe"),
+                           params={"health_stat": args.health_stat})
+
+    # Restore the cached units, collect the others
+    units = []
+    cached = []
     for run in args.to_run:
         logger.info(f"Running {run} analysis...")
         out_path = main_out_dir / run
         out_path.mkdir(parents=True, exist_ok=True)
-        run_funcs[run]()
+        for name, func in run_units[run].items():
+            stage = f"{run}/{name}"
+            key = stage_key(stage,
+                            inputs=[select_key],
+                            # The unit and the project sources it imports
+                            code=[func] + imported_sources(func),
+                            params={
+                                "bps": bps,
+                                "demo_params": demo_params,
+                                "min_max_params": min_max_params
+                            })
+            # Figures are skipped one by one through the manifest of their
+            # directory instead
+            if run == runs[4] or not restore_outputs(stage, key, out_path,
+                                                     cache_dir):
+                units.append((stage, key, func, out_path))
+            else:
+                cached.append(stage)
+    if not units:
+        log_timings({}, cached, 0, time.perf_counter() - start)
+        return
+
+    load_start = time.perf_counter()
+    data_all = cached_frame(
+        "load", load_key,
+        lambda: load_data(args.in_file, columns, args.pack_years), cache_dir)
+    data = cached_frame("select", select_key,
+                        lambda: select_group(data_all, args.health_stat),
+                        cache_dir)
+    load = time.perf_counter() - load_start
+    # Figures are rendered in parallel by the units drawing them, which so
+    # run here rather than in a worker
+    figures = [unit for unit in units if unit[0].split("/")[0] == runs[4]]
+    units = [unit for unit in units if unit not in figures]
+    timings = {}
+    if args.jobs > 1 and len(units) > 1:
+        timings.update(
+            run_pool(units, (data_all, data), bps, cache_dir, args.jobs))
+    else:
+        for unit in units:
+            stage, seconds = run_unit(*unit, bps, cache_dir,
+                                      frames=(data_all, data))
+            timings[stage] = seconds
+    if figures:
+        with render.pool(args.jobs):
+            for unit in figures:
+                stage, seconds = run_unit(*unit, bps, None,
+                                          frames=(data_all, data))
+                timings[stage] = seconds
+    log_timings(timings, cached, load, time.perf_counter() - start)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Analyse Bronchial Parameters.")
-    parser.add_argument("in_file", type=str, help="Input database csv.")
+    parser.add_argument("in_file",
+                        type=str,
+                        help="Input database (.parquet, .feather or .csv).")
     parser.add_argument("out_directory",
                         type=str,
                         help="Output report destination.")
@@ -126,8 +447,9 @@ if __name__ == "__main__":
         "--to_run",
         default=["descriptive"],
         nargs="+",
-        choices=runs,
-        help="Runs to execute. Default: descriptive.",
+        choices=runs + ["all"],
+        help="Runs to execute, \"all\" runs the whole study on the data "
+        "loaded once. Default: descriptive.",
     )
     parser.add_argument(
         "--health_stat",
@@ -139,6 +461,26 @@ if __name__ == "__main__":
                         type=float,
                         default=10.0,
                         help="Pack years.")
+    parser.add_argument("--jobs",
+                        type=int,
+                        default=1,
+                        help="Processes running the analyses, or rendering "
+                        "the figures, in parallel.")
+    parser.add_argument("--no_cache",
+                        action="store_true",
+                        help="Recompute every stage, ignoring the cache.")
+    parser.add_argument("--force",
+                        action="store_true",
+                        help="Redraw every figure, even if its data and "
+                        "code did not change.")
+    parser.add_argument("--profile_imports",
+                        action="store_true",
+                        help="Report the time spent importing modules, "
+                        "as measured by python -X importtime.")
     parser.add_argument("--debug", action="store_true", help="Debug mode.")
     args = parser.parse_args()
+    if args.profile_imports:
+        sys.exit(
+            profile_imports(
+                [arg for arg in sys.argv[1:] if arg != "--profile_imports"]))
     main(args)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Time and peak memory of ``coalesce`` against nested ``fillna`` chains.
+
+Runs every rule of ``COALESCE_RULES`` on a synthetic merged cohort, once
+with the chains ``fill_and_merge.py`` used to spell out and once with the
+rule engine, and checks both give the same frame.
+"""
+
+import argparse
+import time
+import tracemalloc
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic
+from data.util.constants import COALESCE_RULES
+from data.util.dataframe import coalesce
+
+
+def fillna_chains(df: pd.DataFrame, rules: dict) -> pd.DataFrame:
+    for target, sources in rules.items():
+        df[target] = reduce(lambda filled, col: df[col].fillna(filled),
+                            reversed(sources[:-1]), df[sources[-1]])
+        df.drop(columns=[s for s in sources if s != target], inplace=True)
+    return df
+
+
+def measure(func, df: pd.DataFrame):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for rules in COALESCE_RULES.values():
+        rules = {t: s for t, s in rules.items() if set(s) <= set(df.columns)}
+        func(df, rules)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return df, elapsed, peak / 2**20
+
+
+def main(args):
+    df = synthetic.merged(np.random.default_rng(args.seed), args.rows)
+    df["total_freq_calc"] = np.nan
+    print(f"{args.rows} rows, {df.shape[1]} columns")
+
+    old, old_time, old_peak = measure(fillna_chains, df.copy())
+    new, new_time, new_peak = measure(coalesce, df.copy())
+    print(f"fillna chains : {old_time:6.2f} s, peak {old_peak:8.1f} MiB")
+    print(f"coalesce      : {new_time:6.2f} s, peak {new_peak:8.1f} MiB")
+    pd.testing.assert_frame_equal(old, new, check_dtype=False)
+    print("Outputs match")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the coalescing of questionnaire waves.")
+    parser.add_argument("--rows", type=int, default=200000,
+                        help="Participants in the synthetic cohort.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Time the semicolon-list expansion on a synthetic segmentation file.
+
+Compares ``expand_bps.awk`` (the old Makefile step, CSV in and CSV out), a
+per-column ``str.split(expand=True)`` and ``data.util.expand.expand_lists``,
+and checks the three agree. Cells with commas, quotes and text are checked
+to become NaN first.
+"""
+
+import argparse
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic
+from data.util.expand import MAX_GENERATION, expand_lists, split_lists
+
+bench_dir = Path(__file__).resolve().parent
+
+
+def str_split(df: pd.DataFrame, cols: list, max_gen: int) -> pd.DataFrame:
+    expanded = {}
+    for col in cols:
+        parts = df[col].str.split(";", expand=True)
+        parts = parts.reindex(columns=range(max_gen))
+        for gen in range(max_gen):
+            expanded[f"{col}_{gen}"] = pd.to_numeric(parts[gen])
+    return pd.DataFrame(expanded, index=df.index)
+
+
+def check_tokens():
+    """Tokens the csv parser could split or unquote are NaN, as text."""
+    cells = ["1,5;2.5", "a, b;3", None, "4;5.5;x", '"7";8', ""]
+    expected = np.array([[np.nan, 2.5, np.nan], [np.nan, 3.0, np.nan],
+                         [np.nan] * 3, [4.0, 5.5, np.nan],
+                         [np.nan, 8.0, np.nan], [np.nan] * 3])
+    np.testing.assert_array_equal(split_lists(cells, 3), expected)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    out = func(*args)
+    return out, time.perf_counter() - start
+
+
+def main(args):
+    check_tokens()
+    rng = np.random.default_rng(args.seed)
+    cols = synthetic.BP_COLS
+    df = synthetic.segmentation(rng, args.rows)[cols]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        in_csv = Path(tmp) / "bps.csv"
+        df.to_csv(in_csv, index=False)
+        print(f"{args.rows} rows, {len(cols)} list columns, "
+              f"{args.max_gen} generations")
+
+        new, new_time = timed(
+            lambda: expand_lists(pd.read_csv(in_csv), cols, args.max_gen))
+        print(f"expand_lists : {new_time:8.2f} s")
+
+        old, old_time = timed(
+            lambda: str_split(pd.read_csv(in_csv), cols, args.max_gen))
+        print(f"str.split    : {old_time:8.2f} s "
+              f"({old_time / new_time:.1f}x)")
+        pd.testing.assert_frame_equal(old, new)
+
+        if shutil.which("awk") is None or args.max_gen != MAX_GENERATION:
+            print("Skipping awk, it needs awk and the default generations")
+            return
+
+        def run_awk():
+            out_csv = Path(tmp) / "expanded.csv"
+            with open(in_csv) as f_in, open(out_csv, "w") as f_out:
+                subprocess.run(["awk", "-f", str(bench_dir / "expand_bps.awk")],
+                               stdin=f_in, stdout=f_out, check=True)
+            return pd.read_csv(out_csv)
+
+        awk, awk_time = timed(run_awk)
+        print(f"awk + csv    : {awk_time:8.2f} s "
+              f"({awk_time / new_time:.1f}x)")
+        pd.testing.assert_frame_equal(awk, new, check_dtype=False)
+        print("Outputs match")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the bronchial parameter list expansion.")
+    parser.add_argument("--rows", type=int, default=1000000,
+                        help="Rows in the synthetic segmentation file.")
+    parser.add_argument("--max_gen", type=int, default=MAX_GENERATION,
+                        help="Generations to expand to.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args)
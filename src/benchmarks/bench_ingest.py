@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Time ``data/ingest.py`` against the csvkit recipe of ``make_data.mk``.
+
+Both pipelines run on the same synthetic raw directory and their outputs are
+compared as frames. The csvkit recipe is skipped if ``csvjoin`` is missing.
+The questionnaires are written as CSV so ``pspp-convert`` is not needed; the
+``sed`` and ``csvsort`` steps it fed are still timed.
+"""
+
+import argparse
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from benchmarks import synthetic
+from data import ingest
+
+bench_dir = Path(__file__).resolve().parent
+
+
+def run_legacy(paths: dict, work: Path) -> Path:
+    seg = paths["segmentation"]
+    bp_cols = ",".join(synthetic.BP_COLS)
+    splt = work / "formatted_bp_data.csv"
+    awk = bench_dir / "expand_bps.awk"
+    # Process substitution is not seekable for newer csvkit, use files
+    script = [
+        f"csvcut -C {bp_cols} {seg} | sed 's/participant_id/patientID/'"
+        f" > {work}/other.csv",
+        f"csvcut -c {bp_cols} {seg} | awk -f {awk} > {work}/bps.csv",
+        f"csvjoin {work}/other.csv {work}/bps.csv > {splt}",
+    ]
+    sorted_csvs = []
+    for path in paths["questionnaires"]:
+        out = work / f"sorted_{path.name}"
+        script.append(f"sed 's/\\$[0-9]//g' {path} | csvsort -c patientID > {out}")
+        sorted_csvs.append(str(out))
+    merged = work / "data_merged.csv"
+    script.append(f"csvjoin --left -c patientID {splt} {' '.join(sorted_csvs)} "
+                  f"{paths['participants']} > {merged}")
+    cols = ",".join(paths["columns"].read_text().split())
+    out = work / "legacy.csv"
+    script.append(f"csvcut -c {cols} {merged} > {out}")
+    subprocess.run(["bash", "-eo", "pipefail", "-c", "\n".join(script)],
+                   check=True, stderr=subprocess.DEVNULL)
+    return out
+
+
+def run_ingest(paths: dict, work: Path) -> Path:
+    out = work / "ingest.csv"
+    inputs = ([paths["segmentation"]] + paths["questionnaires"] +
+              [paths["participants"]])
+    columns = paths["columns"].read_text().split()
+    ingest.merge(inputs, columns).to_csv(out, index=False)
+    return out
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    out = func(*args)
+    return out, time.perf_counter() - start
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        paths = synthetic.write_raw(work / "raw", args.rows, args.seed)
+
+        new_out, new_time = timed(run_ingest, paths, work)
+        print(f"ingest.py : {new_time:8.2f} s ({args.rows} rows)")
+
+        if shutil.which("csvjoin") is None:
+            print("csvkit not installed, skipping the Makefile recipe")
+            return
+        old_out, old_time = timed(run_legacy, paths, work)
+        print(f"csvkit    : {old_time:8.2f} s ({old_time / new_time:.1f}x)")
+
+        pd.testing.assert_frame_equal(pd.read_csv(old_out, low_memory=False),
+                                      pd.read_csv(new_out, low_memory=False),
+                                      check_dtype=False)
+        print("Outputs match")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the raw data merge.")
+    parser.add_argument("--rows", type=int, default=10000,
+                        help="Participants in the synthetic cohort.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args)
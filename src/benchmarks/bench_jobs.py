@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Wall-clock time of ``analyse.py`` with one process against a pool.
+
+Runs every analysis on a synthetic processed cohort, without the stage
+cache, once serially and once with ``--jobs``, and checks both write the
+same result tables. Figures and model summaries are only compared by name
+as they embed timestamps.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks import synthetic
+
+SRC_DIR = Path(__file__).resolve().parents[1]
+RUNS = ["descriptive", "comparative", "regression", "visualisation"]
+
+
+def analyse(in_file: Path, out_dir: Path, jobs: int) -> float:
+    start = time.perf_counter()
+    subprocess.run([
+        sys.executable,
+        str(SRC_DIR / "analyse.py"),
+        str(in_file),
+        str(out_dir), "--health_stat", "all", "--no_cache", "--jobs",
+        str(jobs), "--to_run", *RUNS
+    ],
+                   stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL,
+                   check=True)
+    return time.perf_counter() - start
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        in_file = synthetic.processed(tmp / "data", args.rows, args.seed)
+        serial = analyse(in_file, tmp / "serial", 1)
+        pooled = analyse(in_file, tmp / "pooled", args.jobs)
+        print(f"--jobs 1 : {serial:6.1f} s")
+        print(f"--jobs {args.jobs} : {pooled:6.1f} s ({serial / pooled:.1f}x, "
+              f"{os.cpu_count()} cpus)")
+
+        serial_files = sorted(p.relative_to(tmp / "serial")
+                              for p in (tmp / "serial").rglob("*"))
+        pooled_files = sorted(p.relative_to(tmp / "pooled")
+                              for p in (tmp / "pooled").rglob("*"))
+        assert serial_files == pooled_files, "Different outputs written"
+        for path in serial_files:
+            if path.suffix == ".csv":
+                assert ((tmp / "serial" / path).read_bytes() ==
+                        (tmp / "pooled" / path).read_bytes()), path
+    print("Outputs match")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark running the analyses in parallel.")
+    parser.add_argument("--rows", type=int, default=5000,
+                        help="Participants in the synthetic cohort.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="Processes of the pool.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args)
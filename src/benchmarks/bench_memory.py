@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Peak resident memory of ``analyse.py`` runs on a large synthetic cohort.
+
+The processed dataset is resampled to ``--rows`` participants, ten times
+the processed scans by default. Each run is started in its own process,
+without the stage cache, and reports the high-water mark of its resident
+memory (``VmHWM``, Linux only). ``--src_dir`` points at another checkout
+(e.g. a ``git worktree`` of an older commit) to compare against.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks import synthetic
+from data.util.constants import SCANS_PROCESSED
+from data.util.store import read_frame, write_frame
+
+SRC_DIR = Path(__file__).resolve().parents[1]
+
+# Runs a script as __main__, then prints the peak RSS of the process. The
+# rusage of a child also counts the memory of the parent it was forked from.
+LAUNCHER = """
+import runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+finally:
+    with open("/proc/self/status") as f:
+        sys.stderr.write(next(l for l in f if l.startswith("VmHWM")))
+"""
+
+
+def peak_rss(cmd: list, env: dict) -> tuple:
+    """Run a python script, return its wall time (s) and peak RSS (MiB)."""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", LAUNCHER] + cmd,
+                          env=env,
+                          stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE,
+                          text=True,
+                          check=True)
+    wall = time.perf_counter() - start
+    # "VmHWM:   123456 kB"
+    return wall, int(proc.stderr.splitlines()[-1].split()[1]) / 1024
+
+
+def main(args):
+    src_dir = Path(args.src_dir).resolve()
+    env = {**os.environ, "PYTHONPATH": str(src_dir)}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        data = read_frame(synthetic.processed(tmp / "data", args.base_rows,
+                                              args.seed),
+                          index_col=0)
+        rng = np.random.default_rng(args.seed)
+        data = data.iloc[rng.integers(0, len(data), args.rows)]
+        data.index = np.arange(len(data))
+        in_file = write_frame(data, tmp / "cohort.parquet")
+        del data
+
+        print(f"{args.rows} participants, {src_dir}")
+        for run in args.to_run:
+            wall, rss = peak_rss([
+                str(src_dir / "analyse.py"),
+                str(in_file),
+                str(tmp / "out"), "--health_stat", "all", "--no_cache",
+                "--to_run", run
+            ], env)
+            print(f"{run:14}: {rss:8.1f} MiB peak RSS, {wall:6.1f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the peak memory of the analyses.")
+    parser.add_argument("--rows",
+                        type=int,
+                        default=10 * SCANS_PROCESSED,
+                        help="Participants in the analysed cohort.")
+    parser.add_argument("--base_rows",
+                        type=int,
+                        default=20000,
+                        help="Participants generated before resampling.")
+    parser.add_argument("--to_run",
+                        nargs="+",
+                        default=["descriptive", "comparative", "regression"],
+                        help="Runs to measure, each in its own process.")
+    parser.add_argument("--src_dir",
+                        default=SRC_DIR,
+                        help="Source tree whose analyse.py is measured.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Batched OLS fits against one statsmodels fit per model.
+
+Fits the univariate and multivariate models of every bronchial parameter of
+a synthetic processed cohort (all generations) against the spirometry
+outcomes, and checks the statistics match statsmodels.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+from scipy.stats import pearsonr
+
+from benchmarks import synthetic
+from data.util.schema import widen_floats
+from data.util.store import read_frame
+from models.linear import ols
+
+COVARIATES = ["sex", "age", "height", "weight", "pack_year_categories"]
+OUTCOMES = ["fev1", "fev1_pp", "fev1_fvc", "fvc"]
+CHANGES = {"rsquared_adj": "rsq_change", "aic": "aic_change",
+           "bic": "bic_change"}
+
+
+def formula_fits(data, bps):
+    results = {}
+    for param in bps:
+        for func in OUTCOMES:
+            formula = func + " ~ " + " + ".join(COVARIATES)
+            model_init = sm.formula.ols(formula=formula, data=data).fit()
+            formula = func + " ~ " + " + ".join(COVARIATES + [param])
+            model = sm.formula.ols(formula=formula, data=data).fit()
+            results[(param, func)] = {
+                change: getattr(model, stat) - getattr(model_init, stat)
+                for stat, change in CHANGES.items()
+            }
+    return pd.DataFrame(results).T
+
+
+def batched_fits(data, bps, summaries):
+    fits = ols.fit_nested(data, ols.base_design(data, COVARIATES), OUTCOMES,
+                          bps, summaries)
+    return pd.DataFrame({
+        change: fits[stat] - fits[f"{stat}_base"]
+        for stat, change in CHANGES.items()
+    })
+
+
+def pair_fits(data, bps, i_var):
+    results = {}
+    for param in bps:
+        data_param = data.dropna(subset=[param, i_var])
+        X = data_param[i_var].to_numpy()
+        y = data_param[param].to_numpy()
+        pearson, _ = pearsonr(X, y)
+        model = sm.OLS(y, sm.add_constant(X)).fit()
+        results[param] = {
+            "pearson": pearson,
+            "intercept": model.params[0],
+            "slope": model.params[1],
+            "rsquared": model.rsquared,
+            "fvalue": model.fvalue,
+            "f_pvalue": model.f_pvalue,
+            "pvalue": model.pvalues[1],
+        }
+    return pd.DataFrame(results).T
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        data = widen_floats(
+            read_frame(synthetic.processed(Path(tmp), args.rows, args.seed),
+                       index_col=0))
+    for col in data.select_dtypes("category"):
+        data[col] = data[col].cat.remove_unused_categories()
+    bps = [col for col in data.columns
+           if col.startswith("bp_") and data[col].dtype == float
+           and data[col].notna().sum() > 100][:args.params]
+    print(f"{len(data)} participants, {len(bps)} parameters x "
+          f"{len(OUTCOMES)} outcomes")
+
+    for sex in ["Male", "Female"]:
+        sex_data = data[data["sex"] == sex]
+        start = time.perf_counter()
+        old = pd.concat(
+            [pair_fits(sex_data, bps, i_var) for i_var in OUTCOMES])
+        old_time = time.perf_counter() - start
+        start = time.perf_counter()
+        new = pd.concat([
+            ols.simple_fits(sex_data[i_var], sex_data[bps])
+            for i_var in OUTCOMES
+        ])
+        print(f"{sex:6} univariate: pearsonr + sm.OLS {old_time:6.2f} s, "
+              f"simple_fits {time.perf_counter() - start:6.2f} s")
+        pd.testing.assert_frame_equal(old, new[old.columns], rtol=1e-8,
+                                      check_dtype=False)
+
+    start = time.perf_counter()
+    old = formula_fits(data, bps)
+    print(f"sm.formula.ols        : {time.perf_counter() - start:6.2f} s")
+    for summaries in [False, True]:
+        start = time.perf_counter()
+        new = batched_fits(data, bps, summaries)
+        print(f"fit_nested, summaries={summaries!s:5}: "
+              f"{time.perf_counter() - start:6.2f} s")
+        pd.testing.assert_frame_equal(old, new.loc[old.index], rtol=1e-8,
+                                      check_names=False)
+    print("Outputs match")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the batched multivariate regressions.")
+    parser.add_argument("--rows", type=int, default=20000,
+                        help="Participants in the synthetic cohort.")
+    parser.add_argument("--params", type=int, default=60,
+                        help="Maximum number of bronchial parameters.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args)
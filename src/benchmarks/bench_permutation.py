@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Vectorised permutation tests against a permutation loop around scipy.
+
+Compares the smoking groups of each sex of a synthetic filled cohort, before
+the filters keep the ex-smokers only, on every bronchial parameter. The loop runs a few permutations per parameter
+and is extrapolated to ``--perms``. Checks the F statistics match
+``scipy.stats.f_oneway``.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from benchmarks import synthetic
+from data.util import permutation
+from data.util.schema import widen_floats
+from data.util.store import read_frame
+
+GROUPS = ["current_smoker", "ex_smoker", "never_smoker"]
+LOOP_PERMS = 50
+
+
+def loop_tests(data, bps, n_perm, seed=0):
+    rng = np.random.default_rng(seed)
+    results = {}
+    for sex in ["Male", "Female"]:
+        for param in bps:
+            rows = data.loc[data["sex"] == sex, [param, "smoking_status"]]
+            rows = rows.dropna()
+            values = rows[param].to_numpy()
+            labels = rows["smoking_status"].to_numpy()
+            observed = stats.f_oneway(
+                *[values[labels == group] for group in GROUPS]).statistic
+            exceed = 0
+            for _ in range(n_perm):
+                shuffled = rng.permutation(labels)
+                exceed += stats.f_oneway(
+                    *[values[shuffled == group]
+                      for group in GROUPS]).statistic >= observed
+            results[(sex, param)] = {
+                "f": observed,
+                "pvalue": (exceed + 1) / (n_perm + 1)
+            }
+    return pd.DataFrame(results).T
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic.processed(Path(tmp), args.rows, args.seed)
+        data = widen_floats(read_frame(Path(tmp) / "bp_db_all.parquet"))
+    data = data[data["sex"].isin(["Male", "Female"])
+                & data["smoking_status"].isin(GROUPS)]
+    bps = [col for col in data.columns
+           if col.startswith("bp_") and data[col].dtype == float
+           and data[col].notna().sum() > 100][:args.params]
+    print(f"{len(data)} participants, {len(bps)} parameters x 2 sexes, "
+          f"{args.perms} permutations")
+
+    start = time.perf_counter()
+    old = loop_tests(data, bps, LOOP_PERMS)
+    old_time = (time.perf_counter() - start) * args.perms / LOOP_PERMS
+    print(f"scipy loop (extrapolated): {old_time:8.2f} s")
+
+    for jobs, precision in [(1, None), (args.jobs, None), (1, 0.005)]:
+        start = time.perf_counter()
+        new = permutation.group_test(data[bps],
+                                     data["smoking_status"],
+                                     GROUPS,
+                                     strata=data["sex"],
+                                     n_perm=args.perms,
+                                     precision=precision,
+                                     jobs=jobs)
+        print(f"group_test, jobs={jobs}, precision={precision!s:5}: "
+              f"{time.perf_counter() - start:8.2f} s, "
+              f"{new['permutations'].mean():.0f} permutations per test")
+        np.testing.assert_allclose(new.loc[old.index, "f"],
+                                   old["f"].astype(float), rtol=1e-8)
+    print("F statistics match")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the vectorised permutation tests.")
+    parser.add_argument("--rows", type=int, default=5000,
+                        help="Participants in the synthetic cohort.")
+    parser.add_argument("--params", type=int, default=60,
+                        help="Maximum number of bronchial parameters.")
+    parser.add_argument("--perms", type=int, default=10000,
+                        help="Permutations of each test.")
+    parser.add_argument("--jobs", type=int, default=2,
+                        help="Processes of the pooled run.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Figure rendering in process against a pool of rendering processes.
+
+Draws the violin, regression and percentile figures of a synthetic
+processed cohort with one worker and with ``--workers``, and checks the
+figures are identical.
+"""
+
+import argparse
+import filecmp
+import tempfile
+import time
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+from analyse import load_data
+from benchmarks import synthetic
+from visualization import percentile, regression, render, violin
+
+BPS = ["bp_pi10", "bp_wt_avg", "bp_la_avg", "bp_wap_avg"]
+PLOTS = {
+    "violin": violin.make_plots,
+    "regression": regression.make_plots,
+    "percentile": percentile.make_plots,
+}
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        data = load_data(synthetic.processed(tmp / "data", args.rows,
+                                             args.seed), None, 10.0)
+        print(f"{len(data)} participants, {len(BPS)} parameters")
+        for workers in [1, args.workers]:
+            with render.pool(workers):
+                for name, make_plots in PLOTS.items():
+                    start = time.perf_counter()
+                    make_plots(data, BPS, tmp / str(workers))
+                    print(f"{name:10}, {workers} workers: "
+                          f"{time.perf_counter() - start:6.2f} s")
+        for name in PLOTS:
+            serial, pooled = tmp / "1" / name, tmp / str(args.workers) / name
+            files = sorted(path.name for path in serial.iterdir())
+            _, mismatch, errors = filecmp.cmpfiles(serial, pooled, files,
+                                                   shallow=False)
+            assert not mismatch and not errors, mismatch + errors
+        print("Figures match")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark parallel figure rendering.")
+    parser.add_argument("--rows", type=int, default=20000,
+                        help="Participants in the synthetic cohort.")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Rendering processes.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args)
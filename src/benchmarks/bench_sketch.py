@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Accuracy of the reference value sketches against exact quantiles.
+
+Resamples a synthetic processed cohort to ``--rows`` participants, with
+jittered parameters, and splits it into ``--months`` files, as monthly
+exports would arrive. For every compression the files are sketched chunk by
+chunk, and also each month on its own with the saved sketches merged after,
+and the quantiles are compared to
+``groupby().quantile`` on the whole cohort in memory. The error is reported
+in value and in rank, the share of the group between the estimate and the
+exact quantile.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic
+from data.util.schema import DECIMALS, widen_floats
+from data.util.sketch import GroupSketches
+from data.util.store import read_frame, write_frame
+from features.descriptive.reference_values import QUANTILES, sketch_files
+
+BPS = ["bp_pi10", "bp_wt_avg", "bp_la_avg", "bp_wap_avg"]
+BY = ["sex", "age_5yr"]
+
+
+def rank_errors(data: pd.DataFrame, estimates: pd.DataFrame) -> pd.Series:
+    """
+    Largest rank error per parameter over the groups and quantiles.
+
+    Ties count as matching anywhere in their range of ranks.
+    """
+    errors = {param: 0.0 for param in BPS}
+    for group, rows in data.groupby(BY, observed=True):
+        for param in BPS:
+            values = np.sort(rows[param].dropna().to_numpy())
+            if len(values) == 0:
+                continue
+            found = estimates.loc[group, param].to_numpy()
+            low = np.searchsorted(values, found, side="left") / len(values)
+            high = np.searchsorted(values, found, side="right") / len(values)
+            error = np.maximum(np.maximum(low - QUANTILES, 0),
+                               np.maximum(QUANTILES - high, 0))
+            errors[param] = max(errors[param], error.max())
+    return pd.Series(errors)
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        data = read_frame(synthetic.processed(tmp / "data", args.base_rows,
+                                              args.seed),
+                          index_col=0)
+        rng = np.random.default_rng(args.seed)
+        data = data.iloc[rng.integers(0, len(data), args.rows)]
+        data.index = np.arange(len(data))
+        # Jitter the copies, so they are not ties as participants of a
+        # larger cohort would not be
+        for param in BPS:
+            noise = rng.normal(0, data[param].std() / 10, len(data))
+            data[param] = (data[param] + noise).round(DECIMALS)
+        months = [
+            write_frame(month, tmp / f"month_{i}.parquet")
+            for i, month in enumerate(np.array_split(data, args.months))
+        ]
+
+        data = widen_floats(data[BY + BPS].copy())
+        start = time.perf_counter()
+        exact = data.groupby(BY)[BPS].quantile(QUANTILES)
+        print(f"{len(data)} participants in {args.months} files, "
+              f"groupby().quantile {time.perf_counter() - start:6.2f} s")
+
+        for compression in args.compression:
+            start = time.perf_counter()
+            streamed = sketch_files(months,
+                                    BPS,
+                                    BY[1],
+                                    compression=compression,
+                                    chunk_rows=args.chunk_rows)
+            stream_time = time.perf_counter() - start
+
+            # Each month on its own, then the saved sketches merged
+            paths = [
+                sketch_files([month],
+                             BPS,
+                             BY[1],
+                             compression=compression,
+                             chunk_rows=args.chunk_rows).save(
+                                 tmp / f"sketch_{compression}_{i}.parquet")
+                for i, month in enumerate(months)
+            ]
+            start = time.perf_counter()
+            merged = GroupSketches(BPS, BY, compression)
+            for path in paths:
+                merged.merge(GroupSketches.load(path, BPS, BY, compression))
+            merge_time = time.perf_counter() - start
+
+            centroids = len(streamed.to_frame()) / len(streamed.digests)
+            size = paths[0].stat().st_size / 2**10
+            print(f"compression {compression:5.0f}: streamed in "
+                  f"{stream_time:6.2f} s, merged in {merge_time:6.2f} s, "
+                  f"{centroids:6.1f} centroids per sketch, {size:6.1f} KiB "
+                  f"saved per month")
+            for name, sketches in [("streamed", streamed), ("merged", merged)]:
+                estimates = sketches.quantiles(QUANTILES)
+                # Same groups, the sketches' keys are not categorical
+                assert list(estimates.index) == list(exact.index)
+                value = (estimates.set_axis(exact.index) - exact).abs().max()
+                rank = rank_errors(data, estimates)
+                print(f"  {name:8}: max |error| " + ", ".join(
+                    f"{param} {value[param]:.4f} ({rank[param]:.2%} rank)"
+                    for param in BPS))
+            counts = data.groupby(BY)[BPS].count()
+            assert (merged.counts().to_numpy() == counts.to_numpy()).all()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Validate the reference value sketches.")
+    parser.add_argument("--rows", type=int, default=500000,
+                        help="Participants in the resampled cohort.")
+    parser.add_argument("--base_rows", type=int, default=20000,
+                        help="Participants in the synthetic cohort.")
+    parser.add_argument("--months", type=int, default=12,
+                        help="Files the cohort is split into.")
+    parser.add_argument("--chunk_rows", type=int, default=2**16)
+    parser.add_argument("--compression",
+                        type=float,
+                        nargs="+",
+                        default=[50, 100, 200, 500])
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args)
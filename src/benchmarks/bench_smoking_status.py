@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Compare the vectorized smoking classifier with the row-wise original.
+
+The legacy path is the never smoker inference and ``df.apply`` classifier
+``fill_and_merge.py`` used before ``data.util.smoking``. Both run on random
+True/False/missing answers; the equivalence check covers answers with and
+without missing values (the latter take the non-fallback inference branch),
+then both paths are timed on a larger cohort.
+"""
+
+import argparse
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+
+from data.util.smoking import classify_smoking
+
+ANSWERS = ["never_smoker", "ever_smoker", "current_smoker", "ex_smoker"]
+
+
+def legacy(df: pd.DataFrame) -> pd.DataFrame:
+    # Fill never smoker = False if any of the others is True
+    df.loc[df.never_smoker.isna() &
+           (~df.current_smoker.isna() & df.current_smoker)
+           | (df.ever_smoker.notna() & df.ever_smoker) |
+           (df.ex_smoker.notna() & df.ex_smoker), ['never_smoker']] = False
+
+    # Fill never smoker = True if ALL the others are False
+    try:
+        df.loc[(df.never_smoker.isna() & df.current_smoker.notna()
+                & df.ever_smoker.notna() & df.ex_smoker.notna()) &
+               (~df.current_smoker & ~df.ex_smoker & ~df.ever_smoker),
+               ['never_smoker']] = True
+    except TypeError:
+        df.loc[(df.never_smoker.isna() & df.current_smoker.notna()
+                & df.ever_smoker.notna() & df.ex_smoker.notna()),
+               ['never_smoker']] = True
+
+    def get_smoking_status(row):
+        if row["current_smoker"] is True:
+            return "current_smoker"
+        if row["ex_smoker"] is True:
+            return "ex_smoker"
+        if row["never_smoker"] is True:
+            return "never_smoker"
+        else:
+            return None
+
+    df["smoking_status"] = df.apply(get_smoking_status, axis=1)
+    return df
+
+
+def random_answers(rng, n: int, p_missing: dict) -> pd.DataFrame:
+    """Random answers, typed like the merged data read back from csv."""
+    cols = {"age": rng.uniform(45, 90, n)}
+    for col in ANSWERS:
+        values = (rng.random(n) < rng.uniform(0.1, 0.9)).astype(object)
+        values[rng.random(n) < p_missing[col]] = np.nan
+        cols[col] = values
+    df = pd.DataFrame(cols)
+    # Bool-only columns stay bool, columns with missing values become object
+    return df.infer_objects()
+
+
+def check_equivalence(rng, n: int, repeats: int) -> int:
+    checked = 0
+    for pattern in itertools.product([0.0, 0.3], repeat=len(ANSWERS)):
+        p_missing = dict(zip(ANSWERS, pattern))
+        for _ in range(repeats):
+            df = random_answers(rng, n, p_missing)
+            old = legacy(df.copy())
+            new = classify_smoking(df.copy())
+            pd.testing.assert_series_equal(old.smoking_status,
+                                           new.smoking_status)
+            pd.testing.assert_series_equal(old.never_smoker.astype(object),
+                                           new.never_smoker.astype(object))
+            checked += 1
+    return checked
+
+
+def timed(func, df):
+    start = time.perf_counter()
+    func(df)
+    return time.perf_counter() - start
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    checked = check_equivalence(rng, 500, args.repeats)
+    print(f"Equivalent on {checked} random answer sets")
+
+    df = random_answers(rng, args.rows, dict.fromkeys(ANSWERS, 0.3))
+    old_time = timed(legacy, df.copy())
+    new_time = timed(classify_smoking, df.copy())
+    print(f"df.apply        : {old_time:8.3f} s ({args.rows} rows)")
+    print(f"classify_smoking: {new_time:8.3f} s ({old_time / new_time:.0f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the smoking status classification.")
+    parser.add_argument("--rows", type=int, default=100000,
+                        help="Participants in the timed cohort.")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="Random answer sets per missingness pattern.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Load time and memory of the typed columnar store against csv.
+
+Runs ``fill_and_merge.py`` on a synthetic merged cohort to get the
+processed dataset, then reads it back the way ``analyse.py`` used to (the
+whole csv, filtered in pandas) and the way it does now (only the columns of
+a run, filtered by the reader), and compares full loads with and without
+the schema dtypes.
+"""
+
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic
+from data.util.schema import memory_report
+from data.util.store import read_frame, write_frame
+
+SRC_DIR = Path(__file__).resolve().parents[1]
+
+# The columns a regression run needs
+COLUMNS = ["sex", "age", "height", "weight", "pack_year_categories", "fev1",
+           "fvc", "fev1_fvc", "fev1_pp", "bp_pi10", "bp_wt_avg", "bp_la_avg",
+           "bp_wap_avg"]
+FILTERS = [("pack_years", ">=", 10)]
+
+
+def timed(func):
+    start = time.perf_counter()
+    df = func()
+    return df, time.perf_counter() - start
+
+
+def main(args):
+    merged = synthetic.merged(np.random.default_rng(args.seed), args.rows)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        paths = {fmt: tmp / f"bp_db_all.{fmt}"
+                 for fmt in ["csv", "parquet", "feather"]}
+        subprocess.run(
+            [sys.executable, str(SRC_DIR / "data" / "fill_and_merge.py"),
+             "--output", *map(str, paths.values())],
+            input=merged.to_csv(index=False).encode(),
+            check=True)
+
+        def legacy():
+            data = pd.read_csv(paths["csv"], low_memory=False, index_col=0)
+            return data[data.pack_years >= 10]
+
+        old, old_time = timed(legacy)
+        print(f"read_csv, all columns       : {old_time:6.2f} s")
+        for fmt, path in paths.items():
+            new, new_time = timed(
+                lambda: read_frame(path, COLUMNS, FILTERS, index_col=0))
+            size = path.stat().st_size / 2**20
+            print(f"read_frame {fmt:8}, {len(COLUMNS)} columns: "
+                  f"{new_time:6.2f} s ({size:5.1f} MiB on disk)")
+            pd.testing.assert_frame_equal(old[COLUMNS], new,
+                                          check_dtype=False,
+                                          check_categorical=False)
+
+        untyped = write_frame(read_frame(paths["csv"], index_col=0,
+                                         typed=False),
+                              tmp / "untyped.parquet",
+                              typed=False)
+        for name, path, typed in [("csv, untyped", paths["csv"], False),
+                                  ("csv, typed", paths["csv"], True),
+                                  ("parquet, untyped", untyped, False),
+                                  ("parquet, typed", paths["parquet"], True)]:
+            full, full_time = timed(
+                lambda: read_frame(path, index_col=0, typed=typed))
+            print(f"{name:16}: {full_time:6.2f} s, {memory_report(full)}")
+    print("Outputs match")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark loading the processed dataset.")
+    parser.add_argument("--rows", type=int, default=200000,
+                        help="Participants in the synthetic cohort.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""Synthetic inputs for the benchmark harnesses."""
+
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BP_COLS = ["bp_wap", "bp_la", "bp_wt", "bp_ir", "bp_or"]
+
+
+def _bp_lists(rng, n: int, max_gen: int = 11) -> np.ndarray:
+    """Semicolon separated per-generation values, some empty or truncated."""
+    lengths = rng.integers(0, max_gen + 1, n)
+    values = np.round(rng.gamma(4.0, 2.0, (n, max_gen)), 3).astype(str)
+    return np.array([";".join(row[:k]) for row, k in zip(values, lengths)],
+                    dtype=object)
+
+
+def _tristate(rng, n: int, p_missing: float = 0.3) -> np.ndarray:
+    """0/1 answers with missing values, as stored in the questionnaires."""
+    values = rng.integers(0, 2, n).astype(float)
+    values[rng.random(n) < p_missing] = np.nan
+    return values
+
+
+def segmentation(rng, n: int) -> pd.DataFrame:
+    """A ``final_bp_list.csv`` like frame."""
+    df = pd.DataFrame({
+        "participant_id": np.arange(100000, 100000 + n),
+        "bp_seg_error": rng.random(n) < 0.05,
+        "bp_tlv": np.round(rng.normal(5.5, 1.0, n), 3),
+        "bp_pi10": np.round(rng.normal(3.5, 0.2, n), 3),
+        "bp_leak_score": rng.integers(-1, 3, n),
+        "bp_segmental_score": rng.integers(-1, 3, n),
+        "bp_subsegmental_score": rng.integers(-1, 3, n),
+    })
+    for col in BP_COLS:
+        df[col] = _bp_lists(rng, n)
+    return df
+
+
+def questionnaires(rng, ids: np.ndarray, n_files: int = 3,
+                   n_vars: int = 40) -> list:
+    """
+    Questionnaire exports sharing variable names, like the SPSS waves.
+
+    Each wave covers a random subset of the participants in shuffled order,
+    and repeats the variable names of the other waves so the merge has to
+    de-duplicate them.
+    """
+    frames = []
+    for wave in range(n_files):
+        sub = rng.choice(ids, int(len(ids) * 0.8), replace=False)
+        df = pd.DataFrame({"patientID": sub})
+        df["gender_first"] = rng.choice(["male", "female", None], len(sub))
+        for var in range(n_vars):
+            if var % 4 == 0:
+                df[f"smoker_adu_c_{var}"] = _tristate(rng, len(sub))
+            else:
+                values = np.round(rng.normal(50, 10, len(sub)), 2)
+                values[rng.random(len(sub)) < 0.2] = np.nan
+                df[f"var_{var}_q_{wave}"] = values
+        df[f"wave_{wave}_only"] = rng.normal(0, 1, len(sub)).round(3)
+        frames.append(df)
+    return frames
+
+
+def participants(rng, ids: np.ndarray) -> pd.DataFrame:
+    """An ``imalife_participant_data.csv`` like frame."""
+    age = np.round(rng.uniform(45, 90, len(ids)), 1).astype(object)
+    age[rng.random(len(ids)) < 0.01] = "#NUM!"
+    return pd.DataFrame({
+        "patientID": ids,
+        "age_at_scan": age,
+        "weight_at_scan": np.round(rng.normal(80, 12, len(ids)), 1),
+        "length_at_scan": np.round(rng.normal(172, 9, len(ids)), 1),
+    })
+
+
+def write_raw(out_dir: Path, n: int, seed: int = 0) -> dict:
+    """
+    Write a synthetic raw data directory.
+
+    Returns:
+    dict: ``segmentation``, ``questionnaires`` and ``participants`` paths and
+        the ``columns`` file projecting the merge.
+    """
+    rng = np.random.default_rng(seed)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    seg = segmentation(rng, n)
+    quest = questionnaires(rng, seg.participant_id.to_numpy())
+    ima = participants(rng, seg.participant_id.to_numpy())
+
+    paths = {"segmentation": out_dir / "final_bp_list.csv"}
+    seg.to_csv(paths["segmentation"], index=False)
+    paths["questionnaires"] = []
+    for i, df in enumerate(quest):
+        path = out_dir / f"wave_{i}.csv"
+        df.to_csv(path, index=False)
+        paths["questionnaires"].append(path)
+    paths["participants"] = out_dir / "imalife_participant_data.csv"
+    ima.to_csv(paths["participants"], index=False)
+
+    # Keep roughly half of the columns, including renamed duplicates
+    columns = ["patientID", "bp_seg_error", "bp_tlv", "bp_pi10",
+               "bp_leak_score", "gender_first", "gender_first2",
+               "gender_first2_2", "wave_1_only", "age_at_scan",
+               "weight_at_scan"]
+    columns += [f"{col}_{g}" for col in BP_COLS for g in range(3, 7)]
+    columns += [c for c in quest[0].columns if c.startswith("smoker")]
+    columns += [f"{c}2" for c in quest[1].columns if c.startswith("smoker")]
+    paths["columns"] = out_dir / "variable_filter_list.txt"
+    paths["columns"].write_text("\n".join(columns) + "\n")
+    return paths
+
+
+def _flags(rng, n: int, p_true: float, p_missing: float) -> np.ndarray:
+    """True/False answers with missing values, as inferred by the merge."""
+    values = (rng.random(n) < p_true).astype(object)
+    values[rng.random(n) < p_missing] = np.nan
+    return values
+
+
+def _numbers(rng, n: int, loc: float, scale: float,
+             p_missing: float) -> np.ndarray:
+    values = np.round(rng.normal(loc, scale, n), 2)
+    values[rng.random(n) < p_missing] = np.nan
+    return values
+
+
+def merged(rng, n: int) -> pd.DataFrame:
+    """
+    A ``bp_db_filtered.csv`` like frame, the input of ``fill_and_merge.py``.
+
+    Every wave of a questionnaire variable is present with its own share of
+    missing answers, so all coalescing and inference paths are exercised.
+    """
+    waves_c2 = ["adu_c_22", "adu_c_2", "adu_c_22_2", "adu_c_22_3",
+                "adu_c_22_4"]
+    age = np.round(rng.uniform(45, 90, n), 1)
+    cols = {
+        "patientID": np.arange(100000, 100000 + n),
+        "bp_seg_error": rng.random(n) < 0.05,
+        "bp_tlv": np.round(rng.normal(5.5, 1.0, n), 3),
+        "bp_pi10": np.round(rng.normal(3.5, 0.2, n), 3),
+        "bp_leak_score": rng.integers(-1, 3, n),
+        "bp_segmental_score": rng.integers(-1, 3, n),
+        "bp_subsegmental_score": rng.integers(-1, 3, n),
+    }
+    for name, loc in zip(BP_COLS, [20.0, 15.0, 1.0, 2.0, 4.0]):
+        for gen in range(9):
+            cols[f"{name}_{gen}"] = _numbers(rng, n, loc / (gen + 1),
+                                             loc / 20, 0.1 + gen / 20)
+    sexes = np.array(["male", "female", np.nan], dtype=object)
+    for col, p in zip(["gender", "gender_first", "gender_first2"],
+                      [[0.45, 0.45, 0.1], [0.3, 0.3, 0.4], [0.2, 0.2, 0.6]]):
+        cols[col] = rng.choice(sexes, n, p=p)
+    age_at_scan = age.astype(object)
+    age_at_scan[rng.random(n) < 0.05] = "#NUM!"
+    age_at_scan[rng.random(n) < 0.05] = np.nan
+    cols["age_at_scan"] = age_at_scan
+    cols["age"] = np.where(rng.random(n) < 0.5, age, np.nan)
+    for col in ["weight_at_scan", "bodyweight_kg_all_m_1_max2",
+                "bodyweight_kg_all_m_1_max", "bodyweight_current_adu_q_1"]:
+        cols[col] = _numbers(rng, n, 80, 12, 0.4)
+    for col in ["length_at_scan", "bodylength_cm_all_m_1_max2",
+                "bodylength_cm_all_m_1_max"]:
+        cols[col] = _numbers(rng, n, 172, 9, 0.4)
+
+    for wave in ["adu_c_12", "adu_c_1", "adu_c_12_2"]:
+        cols[f"never_smoker_{wave}"] = _flags(rng, n, 0.4, 0.5)
+    for var, p_true in [("ever_smoker", 0.5), ("current_smoker", 0.1),
+                        ("ex_smoker", 0.4)]:
+        for wave in waves_c2:
+            cols[f"{var}_{wave}"] = _flags(rng, n, p_true, 0.6)
+    for var, loc, scale in [("packyears_cumulative", 15, 10),
+                            ("smoking_endage", 40, 10),
+                            ("smoking_startage", 18, 3),
+                            ("smoking_duration", 20, 8)]:
+        for wave in waves_c2:
+            cols[f"{var}_{wave}"] = np.abs(_numbers(rng, n, loc, scale, 0.7))
+    for var in ["cigarettes", "cigarillos", "cigars", "pipetobacco"]:
+        for wave in ["adu_q_1_a", "adu_q_1", "adu_c_2"]:
+            cols[f"{var}_frequency_{wave}"] = np.abs(
+                _numbers(rng, n, 5 if var == "cigarettes" else 0.5, 5, 0.6))
+    for wave in ["adu_c_12", "adu_c_1"]:
+        cols[f"total_frequency_{wave}"] = np.abs(_numbers(rng, n, 8, 6, 0.7))
+
+    for col in ["copd_presence_adu_q_2", "copd_presence_adu_q_1",
+                "spirometry_copd_all_q_1_max", "elon_copd_adu_q_13",
+                "asthma_diagnosis_adu_q_1", "spirometry_astma_all_q_1_max",
+                "spirometry_astma_all_q_1_max2", "elon_asthma_adu_q_06",
+                "breathing_problems_adu_q_1", "coughing_presence_adu_q_1",
+                "wheezing_presence_adu_q_1", "elon_wheeze_adu_q_01"]:
+        values = rng.choice([1.0, 2.0], n, p=[0.1, 0.9])
+        values[rng.random(n) < 0.5] = np.nan
+        cols[col] = values
+    cancers = np.array(["LONGKANKER", "BORST LONG", "HUID", np.nan],
+                       dtype=object)
+    for col in ["cancer_type_adu_q_1", "cancer_type_adu_q_2"]:
+        cols[col] = rng.choice(cancers, n, p=[0.02, 0.01, 0.07, 0.9])
+
+    for var, loc, scale in [("spirometry_fev1_all_m_1", 3.0, 0.7),
+                            ("spirometry_fvc_all_m_1", 4.0, 0.9),
+                            ("fev1_percpredicted_all_c_1", 95, 18),
+                            ("fev1fvc_lowerlimit_all_c_1", 0.65, 0.04),
+                            ("fev1_lowerlimit_all_c_1", 2.3, 0.4),
+                            ("fvc_lowerlimit_all_c_1", 3.1, 0.5)]:
+        for suffix in ["max2", "max"]:
+            cols[f"{var}_{suffix}"] = _numbers(rng, n, loc, scale, 0.4)
+    return pd.DataFrame(cols)
+
+
+def processed(out_dir: Path, n: int, seed: int = 0) -> Path:
+    """
+    Run ``fill_and_merge.py`` and ``filter_dataset.py`` on a merged cohort.
+
+    Returns:
+    Path: The ``final_bp_db.parquet`` like file ``analyse.py`` reads.
+    """
+    src_dir = Path(__file__).resolve().parents[1]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    filled = out_dir / "bp_db_all.parquet"
+    final = out_dir / "final_bp_db.parquet"
+    df = merged(np.random.default_rng(seed), n)
+    subprocess.run([
+        sys.executable,
+        str(src_dir / "data" / "fill_and_merge.py"), "--no_cache", "--output",
+        str(filled)
+    ],
+                   input=df.to_csv(index=False).encode(),
+                   stdout=subprocess.DEVNULL,
+                   check=True)
+    subprocess.run([
+        sys.executable,
+        str(src_dir / "data" / "filter_dataset.py"),
+        str(filled), "--no_cache", "--output",
+        str(final)
+    ],
+                   stdout=subprocess.DEVNULL,
+                   check=True)
+    return final
@@ -1,13 +1,52 @@
 #!/usr/bin/env python
 
+import argparse
 import sys
 from pathlib import Path
+
 import pandas as pd
 
-df = pd.read_csv(sys.stdin, index_col=0)
+from data.util.cache import (CACHE_DIR, imported_sources, load_frame,
+                             save_frame, stage_key)
+from data.util.store import read_frame, write_frame
+
+parser = argparse.ArgumentParser(
+    description="Select the participants included in the study.")
+parser.add_argument("in_file",
+                    nargs="?",
+                    default="./data/interim/bp_db_all.parquet",
+                    help="Filled dataset (.parquet, .feather or .csv).")
+parser.add_argument("--output",
+                    nargs="+",
+                    default=[
+                        "./data/processed/final_bp_db.parquet",
+                        "./data/processed/final_bp_db.csv"
+                    ],
+                    help="Output files, the format follows the suffix.")
+parser.add_argument("--no_cache",
+                    action="store_true",
+                    help="Always recompute, ignoring the stage cache.")
+args = parser.parse_args()
+cache_dir = None if args.no_cache else CACHE_DIR
+
+# ------ Reuse the result if neither the input nor the code changed
+key = stage_key("filter",
+                inputs=[Path(args.in_file)],
+                code=imported_sources(Path(__file__)))
+df = load_frame("filter", key, cache_dir)
+if df is not None:
+    # The report of the run which filtered it, cached with it
+    print(load_frame("filter/describe", key, cache_dir).iloc[:, 0])
+    for output in args.output:
+        write_frame(df, output)
+    sizes = load_frame("filter/sizes", key, cache_dir)["removed"].to_dict()
+    print(f"Removed:\n {sizes}")
+    sys.exit()
+
+df = read_frame(args.in_file, index_col=0)
 df = df[~df.index.duplicated(keep="first")]
-outpath = Path("./data/processed/")
-print(df.bp_pi10.describe())
+describe = df.bp_pi10.describe()
+print(describe)
 
 sizes = {}
 # ------ Only use ex-smokers
@@ -25,7 +64,12 @@ df = df[(df.bp_leak_score != 0) | (df.bp_segmental_score != 0) |
         (df.bp_subsegmental_score != 0)]
 sizes["screened"] = sizes["total"] - sizes["error"] - len(df)
 # ------ SAVE DF
-df.to_csv(str(outpath / "final_bp_db.csv"))
+save_frame("filter/describe", key, describe.to_frame(), cache_dir)
+save_frame("filter/sizes", key, pd.Series(sizes).to_frame("removed"),
+           cache_dir)
+save_frame("filter", key, df, cache_dir)
+for output in args.output:
+    write_frame(df, output)
 
 print(f"Removed:\n {sizes}")
 
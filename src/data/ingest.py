@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+"""
+Build the projected, merged participant table straight from the raw files.
+
+Replaces the ``pspp-convert | sed | csvsort`` and ``csvjoin | csvcut`` chain
+of ``make_data.mk``. The first input is the segmentation list, the remaining
+inputs are left joined onto it on ``patientID`` in the given order, exactly
+like ``csvjoin --left -c patientID``. Column names clashing with an already
+joined column are renamed the way csvkit does (``name2``, ``name2_2``, ...),
+so ``variable_filter_list.txt`` can be applied before any data is read.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data.util.cache import (CACHE_DIR, cached_frame, imported_sources,
+                             stage_key)
+from data.util.expand import MAX_GENERATION, expand_lists
+
+KEY = "patientID"
+SEG_KEY = "participant_id"
+BP_COLS = ["bp_wap", "bp_la", "bp_wt", "bp_ir", "bp_or"]
+
+# Values csvkit (agate) infers as booleans
+TRUE_VALUES = ("yes", "y", "true", "t", "1")
+FALSE_VALUES = ("no", "n", "false", "f", "0")
+
+
+def read_columns(path: Path) -> list:
+    """
+    Read only the header of a raw file.
+
+    Parameters:
+    path (Path): SPSS ``.sav`` or CSV file.
+
+    Returns:
+    list: The column names in file order.
+    """
+    if path.suffix == ".sav":
+        import pyreadstat
+
+        _, meta = pyreadstat.read_sav(str(path), metadataonly=True)
+        return list(meta.column_names)
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def read_frame(path: Path, usecols: list) -> pd.DataFrame:
+    """
+    Read the requested columns of a raw file into a frame.
+
+    SPSS files are read natively, replacing the ``pspp-convert`` step. The
+    ``$N`` missing-value codes the Makefile stripped with ``sed`` are removed
+    from string columns.
+
+    Parameters:
+    path (Path): SPSS ``.sav`` or CSV file.
+    usecols (list): Columns to load, everything else is skipped by the reader.
+
+    Returns:
+    pd.DataFrame: The loaded columns.
+    """
+    if path.suffix == ".sav":
+        df = pd.read_spss(str(path), usecols=usecols,
+                          convert_categoricals=False)
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].str.replace(r"\$[0-9]", "", regex=True).replace(
+                "", np.nan)
+            df[col] = pd.to_numeric(df[col], errors="ignore")
+        return df
+    return pd.read_csv(path, usecols=usecols, low_memory=False)
+
+
+def infer_booleans(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert columns csvkit would type as Boolean into True/False values.
+
+    A column is boolean when every non-missing value is 0/1 or one of the
+    yes/no, true/false spellings. Missing values are kept as NaN.
+    """
+    for col in df.columns:
+        values = df[col].dropna()
+        if values.empty:
+            continue
+        if pd.api.types.is_bool_dtype(values):
+            continue
+        if pd.api.types.is_numeric_dtype(values):
+            if not values.isin([0, 1]).all():
+                continue
+            df[col] = df[col].map({0: False, 1: True})
+        elif values.dtype == object:
+            lowered = values.astype(str).str.strip().str.lower()
+            if not lowered.isin(TRUE_VALUES + FALSE_VALUES).all():
+                continue
+            df[col] = df[col].astype(str).str.strip().str.lower().map(
+                dict.fromkeys(TRUE_VALUES, True)
+                | dict.fromkeys(FALSE_VALUES, False))
+    return df
+
+
+def joined_names(headers: list) -> list:
+    """
+    Name the columns of every input as they appear after ``csvjoin --left``.
+
+    Parameters:
+    headers (list): Column names of each input, in join order. The key column
+        must already be called ``patientID``.
+
+    Returns:
+    list: For every input, the final name of each of its columns. The key of
+        the right hand tables maps to None as csvkit drops it.
+    """
+    seen = list(headers[0])
+    names = [list(headers[0])]
+    for header in headers[1:]:
+        renamed = []
+        for col in header:
+            if col == KEY:
+                renamed.append(None)
+                continue
+            new = f"{col}2" if col in seen else col
+            # agate de-duplicates repeated names with _2, _3, ...
+            final, dup = new, 0
+            while final in seen:
+                final = f"{new}_{dup + 2}"
+                dup += 1
+            seen.append(final)
+            renamed.append(final)
+        names.append(renamed)
+    return names
+
+
+def join_key(key: pd.Series) -> pd.Series:
+    """Normalise a ``patientID`` column so numeric ids match across files."""
+    numeric = pd.to_numeric(key, errors="coerce")
+    if numeric.notna().sum() == key.notna().sum():
+        return numeric
+    return key.astype(str)
+
+
+def merge(inputs: list,
+          columns: list,
+          max_gen: int = MAX_GENERATION) -> pd.DataFrame:
+    """
+    Left join all raw inputs on ``patientID`` and keep only ``columns``.
+
+    Parameters:
+    inputs (list): Paths of the segmentation list followed by the files to
+        join onto it.
+    columns (list): Output columns, in output order.
+    max_gen (int): Generations each bronchial parameter list is expanded to.
+
+    Returns:
+    pd.DataFrame: The merged table, equal to the Makefile's
+        ``bp_db_filtered.csv``.
+    """
+    inputs = [Path(p) for p in inputs]
+    wanted = set(columns)
+
+    # Segmentation list: rename the id and drop the lists to be expanded
+    seg_cols = read_columns(inputs[0])
+    bp_cols = [col for col in BP_COLS if col in seg_cols]
+    seg_header = [KEY if c == SEG_KEY else c
+                  for c in seg_cols if c not in bp_cols]
+    bp_header = [f"{c}_{g}" for c in bp_cols for g in range(max_gen)]
+
+    headers = [seg_header + bp_header]
+    headers += [read_columns(path) for path in inputs[1:]]
+    names = joined_names(headers)
+
+    missing = wanted - {n for header in names for n in header}
+    if missing:
+        raise ValueError(f"Columns not found in inputs: {sorted(missing)}")
+
+    # Left table
+    seg_use = [c for c, n in zip(seg_cols, names[0]) if n in wanted or c in
+               (SEG_KEY, KEY)]
+    seg_use += [c for c in bp_cols if any(
+        n in wanted for n in bp_header if n.startswith(f"{c}_"))]
+    df = read_frame(inputs[0], seg_use).rename(columns={SEG_KEY: KEY})
+    if bp_cols:
+        expanded = expand_lists(df, [c for c in bp_cols if c in df.columns],
+                                max_gen)
+        df = pd.concat([df.drop(columns=bp_cols, errors="ignore"), expanded],
+                       axis=1)
+    df = infer_booleans(df)
+    df["_key"] = join_key(df[KEY])
+
+    # Right tables, indexed once on the key
+    for path, header, renamed in zip(inputs[1:], headers[1:], names[1:]):
+        mapping = {c: n for c, n in zip(header, renamed) if n in wanted}
+        if not mapping:
+            continue
+        right = read_frame(path, [KEY] + list(mapping))
+        right = infer_booleans(right.rename(columns=mapping))
+        right.index = pd.Index(join_key(right.pop(KEY)), name="_key")
+        df = df.join(right, on="_key", how="left")
+
+    return df[columns].reset_index(drop=True)
+
+
+def main(args):
+    columns = Path(args.columns).read_text().split()
+    key = stage_key("merge",
+                    inputs=[Path(path) for path in args.inputs],
+                    code=imported_sources(Path(__file__)),
+                    params={
+                        "columns": columns,
+                        "max_gen": args.max_gen
+                    })
+    df = cached_frame("merge", key,
+                      lambda: merge(args.inputs, columns, args.max_gen),
+                      None if args.no_cache else CACHE_DIR)
+    df.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge the raw participant data on patientID.")
+    parser.add_argument("inputs",
+                        nargs="+",
+                        help="Segmentation list, then the files to join.")
+    parser.add_argument("--columns",
+                        required=True,
+                        help="File listing the columns to keep.")
+    parser.add_argument("--max_gen",
+                        type=int,
+                        default=MAX_GENERATION,
+                        help="Airway generations per bronchial parameter.")
+    parser.add_argument("--output",
+                        default=sys.stdout,
+                        help="Output csv. Default: stdout.")
+    parser.add_argument("--no_cache",
+                        action="store_true",
+                        help="Always merge, ignoring the stage cache.")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,213 @@
+"""
+Bootstrap confidence intervals, computed over all resamples at once.
+
+A resample is represented by how often it draws each row, so a block of
+resamples is a (resamples, rows) count matrix. Weighted by the counts, sums
+over the resamples are matrix products with the data, for all columns at
+once, and quantiles are read off the cumulative counts of the rows in sorted
+order. The blocks are drawn once and shared by every statistic of a
+``bootstrap`` call, and hold at most ``BLOCK`` counts, bounding the memory
+whatever the columns.
+
+A statistic is built from the data, e.g. ``mean(values)``, and called with
+each block of counts, returning one row per resample. Missing values are
+left out of each resample, so every column uses the rows present in it.
+"""
+
+import numpy as np
+
+N_BOOT = 2000
+CONFIDENCE = 0.95
+# Counts held at a time
+BLOCK = 2**22
+
+
+def resample_counts(n: int, n_boot: int = N_BOOT, seed=0):
+    """
+    Draw the resamples of ``n`` rows, in blocks.
+
+    The same seed, rows and resamples give the same blocks.
+
+    Parameters:
+    n (int): Rows of the data.
+    n_boot (int): Resamples.
+    seed (int or np.random.SeedSequence): Seed of the draws.
+
+    Yields:
+    np.ndarray: How often each resample of the block draws each row, of
+        shape (resamples, n).
+    """
+    rng = np.random.default_rng(seed)
+    rows = max(1, BLOCK // max(n, 1))
+    for start in range(0, n_boot, rows):
+        size = min(rows, n_boot - start)
+        drawn = rng.integers(0, n, (size, n))
+        drawn += np.arange(size)[:, None] * n
+        yield np.bincount(drawn.ravel(),
+                          minlength=size * n).reshape(size, n).astype(float)
+
+
+def bootstrap(n: int,
+              statistics: dict,
+              n_boot: int = N_BOOT,
+              seed=0) -> dict:
+    """
+    Compute statistics over the same resamples of ``n`` rows.
+
+    Parameters:
+    n (int): Rows of the data the statistics were built from.
+    statistics (dict): The statistics by name, e.g. ``{"mean":
+        mean(values)}``.
+    n_boot (int): Resamples.
+    seed (int or np.random.SeedSequence): Seed of the draws.
+
+    Returns:
+    dict: The values of each statistic, one row per resample.
+    """
+    samples = {name: [] for name in statistics}
+    for counts in resample_counts(n, n_boot, seed):
+        for name, statistic in statistics.items():
+            samples[name].append(statistic(counts))
+    return {name: np.concatenate(values) for name, values in samples.items()}
+
+
+def interval(samples: np.ndarray,
+             confidence: float = CONFIDENCE) -> np.ndarray:
+    """
+    Percentile interval of bootstrapped values.
+
+    Returns:
+    np.ndarray: The lower and upper bounds, stacked on the first axis.
+    """
+    tail = (1 - confidence) / 2 * 100
+    with np.errstate(invalid="ignore"):
+        return np.nanpercentile(samples, [tail, 100 - tail], axis=0)
+
+
+def _present(values: np.ndarray):
+    """The values with missing ones zeroed, and the mask of the others."""
+    present = ~np.isnan(values)
+    return np.where(present, values, 0.0), present.astype(float)
+
+
+def mean(values: np.ndarray):
+    """
+    Mean of every column of ``values``, of shape (rows, columns).
+
+    The statistic gives one row of column means per resample.
+    """
+    filled, present = _present(values)
+
+    def statistic(counts):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (counts @ filled) / (counts @ present)
+
+    return statistic
+
+
+def quantile(values: np.ndarray, qs: list):
+    """
+    Quantiles of every column of ``values``, interpolated linearly between
+    the values of each resample as ``np.percentile`` does.
+
+    The statistic gives one (quantile, column) matrix per resample.
+    """
+    columns = []
+    for column in values.T:
+        rows = np.flatnonzero(~np.isnan(column))
+        order = rows[np.argsort(column[rows], kind="stable")]
+        columns.append((order, column[order]))
+    qs = np.asarray(qs, dtype=float)
+
+    def statistic(counts):
+        size = len(counts)
+        result = np.full((size, len(qs), len(columns)), np.nan)
+        for j, (order, ordered) in enumerate(columns):
+            if len(order) == 0:
+                continue
+            cumulative = np.cumsum(counts[:, order], axis=1)
+            total = cumulative[:, -1]
+            # Offset every resample past the last count of the previous
+            # one, to look the ranks of all resamples up in one search
+            offsets = np.arange(size) * (counts.shape[1] + 1)
+            flat = (cumulative + offsets[:, None]).ravel()
+
+            def value(rank):
+                found = np.searchsorted(flat, rank + offsets, side="right")
+                return ordered[np.minimum(found - np.arange(size) * len(order),
+                                          len(order) - 1)]
+
+            for i, q in enumerate(qs):
+                position = q * (total - 1)
+                low = np.floor(position)
+                high = np.minimum(low + 1, total - 1)
+                a, b = value(low), value(high)
+                result[:, i, j] = np.where(total > 0,
+                                           a + (position - low) * (b - a),
+                                           np.nan)
+        return result
+
+    return statistic
+
+
+def line(x: np.ndarray, Y: np.ndarray):
+    """
+    OLS line of every column of ``Y`` on ``x``, each on the rows where both
+    are present.
+
+    The statistic gives one (intercept and slope, column) matrix per
+    resample.
+    """
+    Y_filled, present = _present(Y)
+    present *= ~np.isnan(x)[:, None]
+    Y_filled *= present
+    # Centred, for the precision of the sums of squares
+    shift = np.nanmean(x) if (~np.isnan(x)).any() else 0.0
+    x = np.where(np.isnan(x), 0.0, x - shift)[:, None]
+    x_present, Y_x = present * x, Y_filled * x
+    xx_present = x_present * x
+
+    def statistic(counts):
+        nobs = counts @ present
+        sx, sy = counts @ x_present, counts @ Y_filled
+        sxx, sxy = counts @ xx_present, counts @ Y_x
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = (sxy - sx * sy / nobs) / (sxx - sx**2 / nobs)
+            intercept = (sy - slope * sx) / nobs - slope * shift
+        return np.stack([intercept, slope], axis=1)
+
+    return statistic
+
+
+def rsquared_change(y: np.ndarray, X: np.ndarray, p: np.ndarray):
+    """
+    Change of the adjusted R-squared of the OLS fit of ``y`` on the design
+    ``X`` when the column ``p`` is added, on complete rows.
+
+    The statistic gives one change per resample.
+    """
+    Z = np.column_stack([X, p])
+    # Centring the non-constant columns does not change the fits, with an
+    # intercept, and keeps the normal equations well conditioned
+    varying = Z.std(axis=0) > 0
+    Z[:, varying] -= Z[:, varying].mean(axis=0)
+    y = y - y.mean()
+    n, k = Z.shape
+    products = (Z[:, :, None] * Z[:, None, :]).reshape(n, k * k)
+    Zy = Z * y[:, None]
+
+    def adjusted(ZZ, Zy_sums, yy, sy, rank):
+        beta = np.einsum("bij,bj->bi", np.linalg.pinv(ZZ), Zy_sums)
+        ssr = yy - np.einsum("bi,bi->b", beta, Zy_sums)
+        rsquared = 1 - ssr / (yy - sy**2 / n)
+        return 1 - (n - 1) / (n - rank) * (1 - rsquared)
+
+    def statistic(counts):
+        ZZ = (counts @ products).reshape(len(counts), k, k)
+        Zy_sums = counts @ Zy
+        yy, sy = counts @ y**2, counts @ y
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (adjusted(ZZ, Zy_sums, yy, sy, k) -
+                    adjusted(ZZ[:, :-1, :-1], Zy_sums[:, :-1], yy, sy, k - 1))
+
+    return statistic
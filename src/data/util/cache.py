@@ -0,0 +1,323 @@
+import ast
+import hashlib
+import importlib.util
+import inspect
+import json
+import logging
+import shutil
+import tempfile
+import textwrap
+from pathlib import Path
+from functools import partial
+from types import ModuleType
+
+import pandas as pd
+
+logger = logging.getLogger("BronchialParameters")
+
+CACHE_DIR = Path("./data/cache/")
+# Bump to invalidate every entry when the cache layout changes
+CACHE_VERSION = "1"
+# Root of the project packages, the modules below it key the stages
+SRC_DIR = Path(__file__).resolve().parents[2]
+
+_file_hashes = {}
+_file_imports = {}
+
+
+def hash_file(path) -> str:
+    """
+    Return the sha256 of a file's content, memoised on its size and mtime.
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    memo = (path, stat.st_size, stat.st_mtime_ns)
+    if memo not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                digest.update(block)
+        _file_hashes[memo] = digest.hexdigest()
+    return _file_hashes[memo]
+
+
+def hash_frame(df: pd.DataFrame) -> str:
+    """
+    Return a hash of a dataframe's values, index, column names and dtypes.
+    """
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy())
+    digest.update(repr(list(df.columns)).encode())
+    digest.update(repr(list(df.dtypes.astype(str))).encode())
+    return digest.hexdigest()
+
+
+def _code_bytes(code) -> bytes:
+    """
+    Bytecode, names and constants of a code object, nested ones included.
+
+    Unlike the source this also works for lambdas and ignores formatting.
+    """
+    parts = [code.co_code, repr(code.co_names).encode()]
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            parts.append(_code_bytes(const))
+        else:
+            parts.append(repr(const).encode())
+    return b"\0".join(parts)
+
+
+def _hash_item(item) -> str:
+    if isinstance(item, pd.DataFrame):
+        return hash_frame(item)
+    if isinstance(item, Path):
+        return hash_file(item)
+    if isinstance(item, ModuleType):
+        return hash_file(inspect.getsourcefile(item))
+    if inspect.isfunction(item):
+        return hashlib.sha256(_code_bytes(item.__code__)).hexdigest()
+    if isinstance(item, partial):
+        bound = repr((item.args, sorted(item.keywords.items())))
+        return _hash_item([_hash_item(item.func), bound])
+    if isinstance(item, bytes):
+        return hashlib.sha256(item).hexdigest()
+    return hashlib.sha256(str(item).encode()).hexdigest()
+
+
+def _module_file(name: str):
+    """The source file of a project module, None for other modules."""
+    path = SRC_DIR.joinpath(*name.split("."))
+    for candidate in (path.with_suffix(".py"), path / "__init__.py"):
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def _package(path: Path) -> str:
+    """The package of a project source file, for its relative imports."""
+    parts = path.relative_to(SRC_DIR).with_suffix("").parts
+    return ".".join(parts if parts[-1] == "__init__" else parts[:-1])
+
+
+def _imports(source: str, package: str) -> set:
+    """
+    The project source files imported by some source, functions included,
+    with the packages they are imported through.
+    """
+    names = set()
+    for node in ast.walk(ast.parse(textwrap.dedent(source))):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                base = importlib.util.resolve_name("." * node.level + base,
+                                                   package)
+            # The imported names may be modules or attributes of the base
+            names.add(base)
+            names.update(f"{base}.{alias.name}" for alias in node.names)
+    files = set()
+    for name in names:
+        parts = name.split(".")
+        for end in range(1, len(parts) + 1):
+            path = _module_file(".".join(parts[:end]))
+            if path is not None:
+                files.add(path)
+    return files
+
+
+def imported_sources(*entries) -> list:
+    """
+    The project source files some code depends on, following its imports
+    recursively, to key the stages on all of them.
+
+    The sources are parsed, not imported, and every import counts, also
+    those inside functions and of the unused branches. Modules outside the
+    project are left out, their versions are pinned by the requirements.
+
+    Parameters:
+    entries: Module names, modules, source paths or functions. Modules and
+        paths are included with their imports, functions only contribute
+        the imports in their body as they are hashed themselves.
+
+    Returns:
+    list: The source paths, sorted.
+    """
+    todo = set()
+    for entry in entries:
+        if isinstance(entry, partial):
+            entry = entry.func
+        if inspect.isfunction(entry):
+            path = Path(inspect.getsourcefile(entry)).resolve()
+            todo |= _imports(inspect.getsource(entry), _package(path))
+            continue
+        if isinstance(entry, str):
+            path = _module_file(entry)
+        elif isinstance(entry, ModuleType):
+            path = inspect.getsourcefile(entry)
+        else:
+            path = entry
+        todo.add(Path(path).resolve())
+
+    sources = set()
+    while todo:
+        path = todo.pop()
+        if path in sources:
+            continue
+        sources.add(path)
+        if path not in _file_imports:
+            _file_imports[path] = _imports(path.read_text(), _package(path))
+        todo |= _file_imports[path] - sources
+    return sorted(sources)
+
+
+def stage_key(stage: str,
+              inputs: list = (),
+              code: list = (),
+              params: dict = None) -> str:
+    """
+    Build the cache key of a pipeline stage.
+
+    Parameters:
+    stage (str): Name of the stage, e.g. ``"filter"``.
+    inputs (list): The stage inputs. Paths are hashed by file content,
+        dataframes by value, bytes as is and anything else (e.g. the key of
+        an upstream stage) by its string.
+    code (list): Modules, functions or source file paths implementing the
+        stage.
+    params (dict): The stage parameters, must be JSON serialisable.
+
+    Returns:
+    str: The hex digest identifying this stage run.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{CACHE_VERSION}:{stage}".encode())
+    for item in list(inputs) + list(code):
+        digest.update(_hash_item(item).encode())
+    digest.update(
+        json.dumps(params or {}, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _entry(stage: str, key: str, cache_dir) -> Path:
+    return Path(cache_dir) / stage / key
+
+
+def _staging(entry: Path) -> Path:
+    """Create a private directory to build an entry in."""
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    return Path(tempfile.mkdtemp(prefix=entry.name + ".", dir=entry.parent))
+
+
+def _commit(tmp: Path, entry: Path):
+    """Move a complete staged entry in place, so partial runs never hit."""
+    try:
+        tmp.rename(entry)
+    except OSError:
+        # Another process stored the same entry first
+        shutil.rmtree(tmp)
+
+
+def load_frame(stage: str, key: str, cache_dir=CACHE_DIR):
+    """
+    Return the cached dataframe of a stage run, or None on a miss.
+    """
+    if cache_dir is None:
+        return None
+    path = _entry(stage, key, cache_dir) / "frame.pkl"
+    if not path.exists():
+        return None
+    logger.info(f"Using cached {stage} ({key[:12]})")
+    return pd.read_pickle(path)
+
+
+def save_frame(stage: str, key: str, df: pd.DataFrame, cache_dir=CACHE_DIR):
+    """
+    Store the dataframe produced by a stage run.
+
+    Pickled rather than written with ``store.write_frame``, so any frame
+    round-trips exactly, untyped and mixed-type columns included.
+    """
+    if cache_dir is None:
+        return
+    entry = _entry(stage, key, cache_dir)
+    tmp = _staging(entry)
+    df.to_pickle(tmp / "frame.pkl")
+    _commit(tmp, entry)
+
+
+def cached_frame(stage: str, key: str, compute, cache_dir=CACHE_DIR):
+    """
+    Return the dataframe of a stage run, computing and storing it on a miss.
+
+    Parameters:
+    stage (str): Name of the stage.
+    key (str): The ``stage_key`` of this run.
+    compute (callable): Returns the dataframe when called without arguments.
+    cache_dir (Path): Cache root, None disables caching.
+
+    Returns:
+    pd.DataFrame: The cached or computed dataframe.
+    """
+    df = load_frame(stage, key, cache_dir)
+    if df is None:
+        df = compute()
+        save_frame(stage, key, df, cache_dir)
+    return df
+
+
+def restore_outputs(stage: str, key: str, out_path: Path,
+                    cache_dir=CACHE_DIR) -> bool:
+    """
+    Copy the cached files of a stage run to ``out_path``.
+
+    Returns:
+    bool: True on a hit, False if the run is not cached.
+    """
+    if cache_dir is None:
+        return False
+    entry = _entry(stage, key, cache_dir)
+    if not entry.exists():
+        return False
+    logger.info(f"Using cached {stage} ({key[:12]})")
+    shutil.copytree(entry, out_path, dirs_exist_ok=True)
+    return True
+
+
+def cached_outputs(stage: str, key: str, compute, out_path: Path,
+                   cache_dir=CACHE_DIR) -> bool:
+    """
+    Run a stage writing files to ``out_path``, or restore its cached files.
+
+    On a miss the stage writes into an empty staging directory, which is
+    stored as the cache entry and copied to ``out_path``. Stages sharing an
+    output directory can so run concurrently.
+
+    Parameters:
+    stage (str): Name of the stage.
+    key (str): The ``stage_key`` of this run.
+    compute (callable): Writes the outputs to the directory it is called
+        with.
+    out_path (Path): Directory the outputs belong in.
+    cache_dir (Path): Cache root, None disables caching.
+
+    Returns:
+    bool: True if the outputs were restored from the cache.
+    """
+    out_path = Path(out_path)
+    if cache_dir is None:
+        compute(out_path)
+        return False
+    if restore_outputs(stage, key, out_path, cache_dir):
+        return True
+
+    entry = _entry(stage, key, cache_dir)
+    tmp = _staging(entry)
+    try:
+        compute(tmp)
+    except BaseException:
+        shutil.rmtree(tmp)
+        raise
+    shutil.copytree(tmp, out_path, dirs_exist_ok=True)
+    _commit(tmp, entry)
+    return False
@@ -1,41 +1,108 @@
+import numpy as np
 import pandas as pd
 
 
-def get_group(df, group: str="healthy"):
+def healthy_mask(df) -> pd.Series:
     """
-    This function takes a pandas DataFrame as input and returns
-    a subset of the DataFrame containing healthy individuals.
+    The participants without COPD, asthma or lung cancer.
 
     Parameters:
-    df (pandas.DataFrame): The DataFrame containing the data to filter
+    df (pandas.DataFrame): The participants.
 
     Returns:
-    pandas.DataFrame: A subset of the original DataFrame containing
-                      individuals who meet the filter criteria
+    pandas.Series: Whether each participant is healthy.
     """
-
-    healthy_mask = (
+    mask = (
         (df.GOLD_stage == "0")
         & (df.copd_diagnosis == False)
         & (df.asthma_diagnosis == False)
         & (df.cancer_type != "LONGKANKER")
         & (df.cancer_type != "BORST LONG")
     )
+    # Missing answers in the nullable boolean columns count as not healthy
+    return mask.fillna(False).astype(bool)
+
+
+def get_group(df, group: str="healthy"):
+    """
+    This function takes a pandas DataFrame as input and returns
+    a subset of the DataFrame containing healthy individuals.
+
+    Parameters:
+    df (pandas.DataFrame): The DataFrame containing the data to filter,
+                           left unmodified
+
+    Returns:
+    pandas.DataFrame: A subset of the original DataFrame containing
+                      individuals who meet the filter criteria, or for
+                      "all" every individual with a "health_status" column
+    """
+
+    healthy = healthy_mask(df)
 
     if group == "healthy":
-        df_group = df[healthy_mask]
+        df_group = df[healthy]
     elif group == "unhealthy":
-        df_group = df[~healthy_mask]
+        df_group = df[~healthy]
     elif group == "all":
-        df_group = df
-        df_group.loc[healthy_mask, "health_status"] = "healthy"
-        df_group.loc[~healthy_mask, "health_status"] = "unhealthy"
+        # Shallow copy: the new column is not added to the caller's frame
+        df_group = df.copy(deep=False)
+        df_group["health_status"] = np.where(healthy, "healthy",
+                                             "unhealthy")
     else:
         raise ValueError("Invalid group name: " + group)
 
     return df_group
 
 
+def coalesce(df: pd.DataFrame, rules: dict, drop: bool = True) -> pd.DataFrame:
+    """
+    Fill each target column with the first non-null value of its sources.
+
+    Equivalent to chaining ``a.fillna(b.fillna(c))``, but every rule is
+    resolved with a single "first non-null along the row" pass over the
+    stacked block of its sources, instead of allocating a temporary Series
+    for each link of the chain.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The dataframe holding the source columns, modified in place.
+    rules : dict
+        Maps each target column to its ordered list of source columns. The
+        target may be one of its own sources.
+    drop : bool, optional
+        Drop the consumed sources, keeping memory low. Default True.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The dataframe with the target columns filled.
+    """
+    for target, sources in rules.items():
+        columns = [df[col].to_numpy() for col in sources]
+        if any(col.dtype == object for col in columns):
+            columns = [col.astype(object, copy=False) for col in columns]
+        block = np.column_stack(columns)
+        filled = np.column_stack([pd.notna(col) for col in columns])
+
+        first = filled.argmax(axis=1)
+        values = np.take_along_axis(block, first[:, None], axis=1)[:, 0]
+        missing = ~filled.any(axis=1)
+        if missing.any():
+            values = values.astype(np.result_type(values, np.float64))
+            values[missing] = np.nan
+
+        df[target] = pd.Series(values, index=df.index).infer_objects()
+        if drop:
+            # del frees each column without copying the rest of the frame
+            for col in sources:
+                if col != target:
+                    del df[col]
+
+    return df
+
+
 def normalise_bps(df: pd.DataFrame, bps: list, norm_to: str = "height") -> pd.DataFrame:
     """
     Normalizes the base pairs (bps) data in a pandas dataframe (df) with respect to a specified column (norm_to).
@@ -51,12 +118,14 @@ def normalise_bps(df: pd.DataFrame, bps: list, norm_to: str = "height") -> pd.Da
     Returns
     -------
     pandas.DataFrame
-        A new pandas dataframe with the normalized bps data.
+        A new pandas dataframe with the normalized bps data. It shares the
+        other columns with ``df``, which is left unmodified.
     """
     # Calculate the normalization factor
     norm_factor = df[norm_to]
 
-    # Normalize the bps data
+    # Normalize the bps data into new columns of a shallow copy
+    df = df.copy(deep=False)
     for bp in bps:
         df[bp] = df[bp] / norm_factor
 
@@ -99,7 +168,8 @@ def min_max_scale(data: pd.DataFrame, params: list) -> pd.DataFrame:
     params (list): The list of feature columns which needs to be normalized.
 
     Returns:
-    pd.DataFrame: The normalized input data with the same dimensions as the input data.
+    pd.DataFrame: The normalized input data with the same dimensions as the input data. The
+    unscaled columns are shared with ``data``, which is left unmodified.
 
     Raises:
     TypeError: If any of the input parameters' data types are not as expected.
@@ -117,6 +187,7 @@ def min_max_scale(data: pd.DataFrame, params: list) -> pd.DataFrame:
     for param in params:
         if param not in data.columns:
             raise ValueError("Invalid parameter name: " + param)
+    data = data.copy(deep=False)
     for param in params:
         data[param] = (data[param] - data[param].min()) / (
             data[param].max() - data[param].min()
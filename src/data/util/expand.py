@@ -0,0 +1,78 @@
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+
+MAX_GENERATION = 9
+
+
+def split_lists(values, max_gen: int = MAX_GENERATION) -> np.ndarray:
+    """
+    Split semicolon separated lists into a 2-D float array in a single pass.
+
+    All cells are joined into one buffer, the separators are located with
+    NumPy and every token is parsed at once by the C csv parser. Cells shorter
+    than ``max_gen`` are padded with NaN, longer cells are truncated, missing
+    or non-numeric values become NaN.
+
+    Parameters:
+    values (array-like): The list cells, e.g. ``"1.2;3.4;5.6"``.
+    max_gen (int): Number of generations (output columns) to keep.
+
+    Returns:
+    np.ndarray: Array of shape (len(values), max_gen).
+    """
+    cells = pd.Series(values, dtype=object).fillna("").astype(str).to_numpy()
+    out = np.full((len(cells), max_gen), np.nan)
+    if len(cells) == 0:
+        return out
+
+    text = "\n".join(cells)
+    buf = np.frombuffer(text.encode(), dtype=np.uint8)
+    sep = np.flatnonzero((buf == ord(";")) | (buf == ord("\n")))
+    if len(sep) == len(buf):
+        # Only empty cells
+        return out
+    newline = buf[sep] == ord("\n")
+
+    # Token k lies after separator k-1, rows start after every newline
+    row = np.concatenate(([0], np.cumsum(newline)))
+    first = np.concatenate(([0], np.flatnonzero(newline) + 1))
+    gen = np.arange(len(row)) - first[row]
+
+    # One token per line, empty tokens are kept as NaN. The separators are
+    # all replaced, so ";" is a delimiter no token holds, commas included
+    tokens = pd.read_csv(io.StringIO(text.replace(";", "\n") + "\n"),
+                         sep=";",
+                         names=["value"],
+                         skip_blank_lines=False,
+                         quoting=csv.QUOTE_NONE)["value"]
+    values = pd.to_numeric(tokens, errors="coerce").to_numpy(float)
+
+    keep = gen < max_gen
+    out[row[keep], gen[keep]] = values[keep]
+    return out
+
+
+def expand_lists(df: pd.DataFrame,
+                 cols: list,
+                 max_gen: int = MAX_GENERATION) -> pd.DataFrame:
+    """
+    Expand list columns into one float column per generation.
+
+    Parameters:
+    df (pd.DataFrame): Frame holding the semicolon separated columns.
+    cols (list): Columns to expand.
+    max_gen (int): Number of generations, ``{col}_0`` .. ``{col}_{max_gen-1}``.
+
+    Returns:
+    pd.DataFrame: The expanded columns on the index of ``df``, ready to be
+        concatenated onto it.
+    """
+    expanded = {}
+    for col in cols:
+        gens = split_lists(df[col], max_gen)
+        for gen in range(max_gen):
+            expanded[f"{col}_{gen}"] = gens[:, gen]
+    return pd.DataFrame(expanded, index=df.index)
@@ -0,0 +1,282 @@
+"""
+Permutation tests of differences between groups, over all columns at once.
+
+The labels of the rows are shuffled within each stratum, e.g. sex, in blocks
+of permutations, as a (permutations, rows) label matrix. The group sums and
+sizes of every permutation and column then come from one matrix product of
+the label indicators with the values and their presence, and from them the
+one-way ANOVA F statistics and the differences of the group means.
+
+Every column is tested on its present rows, with the labels its rows draw
+in each permutation, so all columns of a stratum share the permutations and
+the product. The tests are exact under the null of the labels being
+exchangeable with the values and with their missingness.
+
+Permutations run in rounds, split over a pool of processes if ``jobs`` > 1,
+and the columns whose p-values are precise enough, once the Monte Carlo
+standard error of all of them is at most ``precision``, stop early.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+N_PERM = 10000
+ALPHA = 0.05
+# Permutations of a stratum per round when stopping early
+ROUND = 1000
+# Label indicators held at a time
+BLOCK = 2**22
+# Permuted statistics this close to the observed ones count as ties, which
+# rounding would otherwise split
+RTOL = 1e-9
+
+
+def _statistics(indicators: np.ndarray, filled: np.ndarray,
+                present: np.ndarray, squares: np.ndarray, pairs: list):
+    """
+    ANOVA F and standardised pairwise mean differences of every column.
+
+    Parameters:
+    indicators (np.ndarray): The one-hot labels, of shape (permutations,
+        groups, rows).
+    filled (np.ndarray): The values, zero where missing, (rows, columns).
+    present (np.ndarray): Where the values are present, as floats.
+    squares (np.ndarray): The sums of squares of the columns.
+    pairs (list): The pairs of group indices.
+
+    Returns:
+    tuple: The F statistics, of shape (permutations, columns), and the mean
+        differences of the pairs, scaled by the square root of the summed
+        inverse group sizes, of shape (permutations, pairs, columns).
+    """
+    size, groups, rows = indicators.shape
+    k = filled.shape[1]
+    products = indicators.reshape(size * groups, rows) @ np.hstack(
+        [filled, present])
+    sums = products[:, :k].reshape(size, groups, k)
+    sizes = products[:, k:].reshape(size, groups, k)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums / sizes
+        nobs = sizes.sum(axis=1)
+        correction = sums.sum(axis=1)**2 / nobs
+        explained = np.where(sizes > 0, sums * means, 0).sum(axis=1)
+        filled_groups = (sizes > 0).sum(axis=1)
+        f = (((explained - correction) / (filled_groups - 1)) /
+             ((squares - explained) / (nobs - filled_groups)))
+        differences = np.stack([
+            (means[:, b] - means[:, a]) /
+            np.sqrt(1 / sizes[:, a] + 1 / sizes[:, b]) for a, b in pairs
+        ], axis=1)
+    return f, differences
+
+
+class _Stratum:
+    """The values of the rows of a stratum, with their labels."""
+
+    def __init__(self, values: np.ndarray, codes: np.ndarray, groups: int):
+        present = ~np.isnan(values)
+        self.filled = np.where(present, values, 0.0)
+        self.present = present.astype(float)
+        self.squares = (self.filled**2).sum(axis=0)
+        self.codes = codes
+        self.groups = groups
+        self.pairs = list(combinations(range(groups), 2))
+
+    def columns(self, columns: np.ndarray) -> "_Stratum":
+        """The stratum restricted to some of its columns."""
+        part = object.__new__(_Stratum)
+        part.__dict__.update(self.__dict__)
+        part.filled = self.filled[:, columns]
+        part.present = self.present[:, columns]
+        part.squares = self.squares[columns]
+        return part
+
+    def statistics(self, labels: np.ndarray):
+        """The statistics of ``_statistics`` for each row of labels."""
+        indicators = labels[:, None, :] == np.arange(self.groups)[:, None]
+        return _statistics(indicators.astype(float), self.filled,
+                           self.present, self.squares, self.pairs)
+
+    def exceedances(self, n_perm: int, seed) -> tuple:
+        """
+        Count the permutations at least as extreme as the observed
+        statistics.
+
+        Returns:
+        tuple: The permutations, and the exceedances of the F statistic per
+            column and of the largest absolute pair difference per pair and
+            column.
+        """
+        rng = np.random.default_rng(seed)
+        f_obs, pairs_obs = self.statistics(self.codes[None, :])
+        f_obs = f_obs[0] * (1 - RTOL)
+        pairs_obs = np.abs(pairs_obs[0]) * (1 - RTOL)
+        f_count = np.zeros(f_obs.shape, dtype=int)
+        pair_count = np.zeros(pairs_obs.shape, dtype=int)
+        rows = max(1, BLOCK // (self.groups * len(self.codes)))
+        for start in range(0, n_perm, rows):
+            size = min(rows, n_perm - start)
+            labels = rng.permuted(np.tile(self.codes, (size, 1)), axis=1)
+            f, pairs = self.statistics(labels)
+            f_count += (f >= f_obs).sum(axis=0)
+            # Single-step max-T: each pair against the largest difference
+            # of the permutation, adjusting for the pairs as Tukey's HSD
+            largest = np.fmax.reduce(np.abs(pairs), axis=1, initial=0)
+            pair_count += (largest[:, None, :] >= pairs_obs).sum(axis=0)
+        return n_perm, f_count, pair_count
+
+
+def _count(stratum: _Stratum, n_perm: int, seed) -> tuple:
+    return stratum.exceedances(n_perm, seed)
+
+
+def group_test(values: pd.DataFrame,
+               labels: pd.Series,
+               groups: list,
+               strata: pd.Series = None,
+               n_perm: int = N_PERM,
+               seed: int = 0,
+               precision: float = None,
+               jobs: int = 1) -> pd.DataFrame:
+    """
+    Permutation tests of the differences between groups of every column.
+
+    The overall test permutes the one-way ANOVA F statistic. The pairs of
+    groups are tested on their mean difference with the single-step max-T
+    procedure, which controls the family-wise error over the pairs as
+    Tukey's HSD does, without assuming normal data.
+
+    Parameters:
+    values (pd.DataFrame): The columns to test.
+    labels (pd.Series): The group of every row, indexed like ``values``.
+        Rows in none of ``groups`` are left out.
+    groups (list): The groups to compare, the pairs follow their order.
+    strata (pd.Series): Labels are shuffled within these, which are tested
+        separately. None tests all rows together.
+    n_perm (int): Permutations of each test, at most if stopping early.
+    seed (int): Seed of the permutations, the same seed, ``jobs`` and
+        ``precision`` give the same p-values.
+    precision (float): Stop testing a column once the Monte Carlo standard
+        error of its p-values is at most this. None runs all ``n_perm``.
+    jobs (int): Processes running the permutations.
+
+    Returns:
+    pd.DataFrame: Indexed by (stratum, column), the "nobs", the ANOVA "f"
+        and its parametric "f_pvalue", the permutation "pvalue", the
+        "permutations" run, and "meandiff_{a}_vs_{b}" and
+        "pvalue_{a}_vs_{b}" for every pair of groups.
+    """
+    codes = pd.Categorical(labels, categories=groups).codes
+    strata = (pd.Series("all", index=values.index)
+              if strata is None else strata)
+    units = {}
+    for stratum, rows in strata.groupby(strata, sort=False).indices.items():
+        rows = rows[codes[rows] >= 0]
+        units[stratum] = _Stratum(values.iloc[rows].to_numpy(dtype=float),
+                                  codes[rows], len(groups))
+
+    k = values.shape[1]
+    pairs = list(combinations(range(len(groups)), 2))
+    done = {stratum: np.zeros(k, dtype=int) for stratum in units}
+    f_counts = {stratum: np.zeros(k, dtype=int) for stratum in units}
+    pair_counts = {
+        stratum: np.zeros((len(pairs), k), dtype=int)
+        for stratum in units
+    }
+    sizes = {
+        stratum: np.stack([
+            unit.present[unit.codes == g].sum(axis=0)
+            for g in range(len(groups))
+        ])
+        for stratum, unit in units.items()
+    }
+    seeds = dict(zip(units, np.random.SeedSequence(seed).spawn(len(units))))
+    step = n_perm if precision is None else min(ROUND, n_perm)
+    # Columns with less than two groups present have nothing to compare
+    active = {
+        stratum: np.flatnonzero((sizes[stratum] > 0).sum(axis=0) > 1)
+        for stratum in units
+    }
+    executor = ProcessPoolExecutor(jobs) if jobs > 1 else None
+    try:
+        while any(len(columns) for columns in active.values()):
+            tasks = []
+            for stratum, columns in active.items():
+                if not len(columns):
+                    continue
+                unit = units[stratum].columns(columns)
+                todo = min(step, n_perm - done[stratum][columns[0]])
+                shares = [todo // jobs + (i < todo % jobs)
+                          for i in range(jobs)]
+                for share, task_seed in zip(
+                        shares, seeds[stratum].spawn(len(shares))):
+                    if share == 0:
+                        continue
+                    args = (unit, share, task_seed)
+                    tasks.append((stratum, columns,
+                                  executor.submit(_count, *args)
+                                  if executor else _count(*args)))
+            for stratum, columns, task in tasks:
+                count, f_count, pair_count = (task.result()
+                                              if executor else task)
+                done[stratum][columns] += count
+                f_counts[stratum][columns] += f_count
+                pair_counts[stratum][:, columns] += pair_count
+
+            for stratum, columns in active.items():
+                runs = done[stratum][columns]
+                unsettled = runs < n_perm
+                if precision is not None and len(columns):
+                    p = (np.vstack([
+                        f_counts[stratum][None, columns],
+                        pair_counts[stratum][:, columns]
+                    ]) + 1) / (runs + 1)
+                    unsettled &= (np.sqrt(p * (1 - p) / runs).max(axis=0)
+                                  > precision)
+                active[stratum] = columns[unsettled]
+    finally:
+        if executor:
+            executor.shutdown()
+
+    results = []
+    for stratum, unit in units.items():
+        f, differences = unit.statistics(unit.codes[None, :])
+        nobs = unit.present.sum(axis=0)
+        filled_groups = (sizes[stratum] > 0).sum(axis=0)
+        runs = done[stratum]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tested = np.where(runs > 0, 1.0, np.nan)
+            result = {
+                "nobs": nobs.astype(int),
+                "f": f[0],
+                "f_pvalue": stats.f.sf(f[0], filled_groups - 1,
+                                       nobs - filled_groups),
+                "pvalue": (f_counts[stratum] + 1) / (runs + 1) * tested,
+                "permutations": runs,
+            }
+            for p, (a, b) in enumerate(pairs):
+                name = f"{groups[a]}_vs_{groups[b]}"
+                result[f"meandiff_{name}"] = differences[0, p] * np.sqrt(
+                    1 / sizes[stratum][a] + 1 / sizes[stratum][b])
+                result[f"pvalue_{name}"] = (pair_counts[stratum][p] +
+                                            1) / (runs + 1) * tested
+        results.append(
+            pd.DataFrame(result,
+                         index=pd.MultiIndex.from_product(
+                             [[stratum], values.columns],
+                             names=["stratum", "column"])))
+    if not results:
+        # No row is in any of the groups
+        names = [f"{groups[a]}_vs_{groups[b]}" for a, b in pairs]
+        return pd.DataFrame(
+            columns=["nobs", "f", "f_pvalue", "pvalue", "permutations"] + [
+                f"{stat}_{name}" for name in names
+                for stat in ("meandiff", "pvalue")
+            ],
+            index=pd.MultiIndex.from_arrays([[], []],
+                                            names=["stratum", "column"]))
+    return pd.concat(results)
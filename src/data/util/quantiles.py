@@ -0,0 +1,179 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from data.util.cache import hash_frame
+
+# Sorted groups of the most recently used (data, params, by), shared by all
+# callers of group_quantiles in a process
+MAX_SORTED = 8
+_sorted_groups = OrderedDict()
+
+
+def sorted_quantiles(ordered: np.ndarray, counts: np.ndarray,
+                     qs: list) -> np.ndarray:
+    """
+    Quantiles of every column of a block sorted along its rows.
+
+    Interpolated exactly as ``Series.quantile`` (numpy's linear method)
+    does. ``groupby.quantile`` can differ in the last bit, which flips the
+    rounding of ties between 3-decimal values.
+
+    Parameters:
+    ordered (np.ndarray): The block, each column sorted with NaN last.
+    counts (np.ndarray): The non-NaN values of each column.
+    qs (list): The quantiles, in [0, 1].
+
+    Returns:
+    np.ndarray: One row per quantile, one column per column of the block.
+    """
+    result = np.full((len(qs), ordered.shape[1]), np.nan)
+    if len(ordered) == 0:
+        return result
+    last = np.maximum(counts - 1, 0)
+    columns = np.arange(ordered.shape[1])
+    # Series.quantile passes percentages to np.percentile, which divides
+    # them by 100 again
+    for row, q in enumerate(np.asarray(qs, dtype=float) * 100 / 100):
+        index = (counts - 1) * q
+        low = np.clip(np.floor(index).astype(int), 0, last)
+        a = ordered[low, columns]
+        b = ordered[np.minimum(low + 1, last), columns]
+        gamma = index - low
+        diff = b - a
+        result[row] = np.where(gamma >= 0.5, b - diff * (1 - gamma),
+                               a + diff * gamma)
+    result[:, counts == 0] = np.nan
+    return result
+
+
+def quantiles(block: np.ndarray, qs: list) -> np.ndarray:
+    """
+    Quantiles of every column of a block, ignoring NaN, from one sort.
+    """
+    return sorted_quantiles(np.sort(block, axis=0),
+                            (~np.isnan(block)).sum(axis=0), qs)
+
+
+def _group_rows(data: pd.DataFrame, by: list) -> dict:
+    """
+    Row positions of each observed group, missing keys included as NaN.
+
+    ``groupby(dropna=False)`` still drops missing categorical keys in
+    pandas 1.5, so the groups are built from the factorised keys.
+    """
+    factorised = [pd.factorize(data[col], sort=True) for col in by]
+    keys, inverse = np.unique(np.column_stack([codes
+                                               for codes, _ in factorised]),
+                              axis=0,
+                              return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(keys)))[:-1]
+    return {
+        tuple(uniques[code] if code >= 0 else np.nan
+              for code, (_, uniques) in zip(key, factorised)): rows
+        for key, rows in zip(keys, np.split(order, bounds))
+    }
+
+
+def _merge(groups: dict, positions: list) -> dict:
+    """
+    Coarser groups from sorted groups, keeping the key ``positions``.
+
+    The sorted blocks are concatenated and merged by a stable sort, which
+    runs in linear time per sorted run instead of sorting from scratch.
+    """
+    parts = {}
+    for group, sort in groups.items():
+        parts.setdefault(tuple(group[i] for i in positions), []).append(sort)
+    return {
+        group: (np.sort(np.concatenate([ordered for ordered, _ in sorts]),
+                        axis=0,
+                        kind="stable"), sum(counts for _, counts in sorts))
+        for group, sorts in parts.items()
+    }
+
+
+def sort_groups(data: pd.DataFrame, params: list, by: list) -> dict:
+    """
+    Sort the parameters of each group once, reusing earlier sorts.
+
+    Groups coarser than an earlier sort of the same data, e.g. by sex after
+    by (sex, smoking_status, age_5yr), are merged from its sorted groups.
+    Rows with missing group keys are kept as their own groups so they are
+    not lost in coarser groups.
+
+    Parameters:
+    data (pd.DataFrame): The data.
+    params (list): The numeric columns to sort.
+    by (list): The grouping columns.
+
+    Returns:
+    dict: Group key tuple -> (sorted block, non-NaN counts per column).
+    """
+    values_key = (hash_frame(data[params]), tuple(params))
+    by_key = tuple((col, hash_frame(data[[col]])) for col in by)
+    if (values_key, by_key) in _sorted_groups:
+        _sorted_groups.move_to_end((values_key, by_key))
+        return _sorted_groups[(values_key, by_key)]
+
+    finer = [(cached_by, groups)
+             for (cached_values, cached_by), groups in _sorted_groups.items()
+             if cached_values == values_key and set(by_key) <= set(cached_by)]
+    if finer:
+        # The fewest groups to merge
+        cached_by, groups = min(finer, key=lambda item: len(item[1]))
+        groups = _merge(groups, [cached_by.index(item) for item in by_key])
+    else:
+        block = data[params].to_numpy(dtype=float)
+        groups = {}
+        for group, rows in _group_rows(data, by).items():
+            values = block[rows]
+            groups[group] = (np.sort(values, axis=0),
+                             (~np.isnan(values)).sum(axis=0))
+
+    _sorted_groups[(values_key, by_key)] = groups
+    if len(_sorted_groups) > MAX_SORTED:
+        _sorted_groups.popitem(last=False)
+    return groups
+
+
+def group_quantiles(data: pd.DataFrame, params: list, by: list,
+                    qs: list) -> pd.DataFrame:
+    """
+    Quantiles of the parameters per group, each group sorted only once.
+
+    Equivalent to ``data.groupby(by)[params].quantile(qs)``: the groups of
+    unobserved categories are included, with NaN. The sorted groups are
+    kept, so further quantiles of the same data, by the same or coarser
+    groups, e.g. for a table and then for plots, need no new sort.
+
+    Parameters:
+    data (pd.DataFrame): The data.
+    params (list): The numeric columns.
+    by (list): The grouping columns.
+    qs (list): The quantiles, in [0, 1].
+
+    Returns:
+    pd.DataFrame: Indexed by the ``by`` columns and the quantile, one
+        column per parameter.
+    """
+    groups = sort_groups(data, params, by)
+    levels = []
+    for col in by:
+        if isinstance(data[col].dtype, pd.CategoricalDtype):
+            levels.append(list(data[col].cat.categories))
+        else:
+            levels.append(sorted(data[col].dropna().unique()))
+    index = pd.MultiIndex.from_product(levels + [qs], names=by + [None])
+
+    empty = np.full((len(qs), len(params)), np.nan)
+    values = [
+        sorted_quantiles(*groups[group], qs) if group in groups else empty
+        for group in pd.MultiIndex.from_product(levels)
+    ]
+    return pd.DataFrame(np.concatenate(values) if values else empty[:0],
+                        index=index,
+                        columns=params)
@@ -0,0 +1,127 @@
+import logging
+
+import pandas as pd
+
+from data.util.smoking import SMOKING_STATUSES
+
+logger = logging.getLogger("BronchialParameters")
+
+# Category labels, shared with fill_and_merge.py which creates them
+SEXES = ["Female", "Male"]
+GOLD_STAGES = ["0", "GOLD-1", "GOLD-2", "GOLD-3", "GOLD-4"]
+AGE_5YR_LABELS = [
+    '45-50', '50-55', '55-60', '60-65', '65-70', '70-75', '75-80', '80+'
+]
+AGE_10YR_LABELS = ['45-54', '55-64', '65-74', '75-84', '85+']
+PACK_YEAR_LABELS = ['0', '1-10', '10-20', '20+']
+
+# Decimals kept by fill_and_merge.py. float32 holds about 7 significant
+# digits, so rounding to them recovers the stored values only below 2**14
+# (16384). The bronchial parameters are well below, the larger values are
+# measurements kept as float64
+DECIMALS = 3
+
+# Bronchial parameters (bp_*) not listed here are float32, measured values
+# keep float64 as they are also model covariates and outcomes.
+SCHEMA = {
+    "sex": pd.CategoricalDtype(SEXES),
+    "age": "float64",
+    "weight": "float64",
+    "height": "float64",
+    "bmi": "float64",
+    "age_5yr": pd.CategoricalDtype(AGE_5YR_LABELS, ordered=True),
+    "age_10yr": pd.CategoricalDtype(AGE_10YR_LABELS, ordered=True),
+    "never_smoker": "boolean",
+    "ever_smoker": "boolean",
+    "current_smoker": "boolean",
+    "ex_smoker": "boolean",
+    "smoking_status": pd.CategoricalDtype(SMOKING_STATUSES),
+    "pack_years": "float64",
+    "pack_year_categories": pd.CategoricalDtype(PACK_YEAR_LABELS,
+                                                ordered=True),
+    "smoking_end_age": "float64",
+    "smoking_start_age": "float64",
+    "smoking_duration": "float64",
+    "smoking_cessation_duration": "float64",
+    "total_frequency": "float64",
+    "copd_diagnosis": "boolean",
+    "asthma_diagnosis": "boolean",
+    "cancer_type": "category",
+    "resp_other": "category",
+    "fev1": "float64",
+    "fvc": "float64",
+    "fev1_pp": "float64",
+    "fev1fvc_lln": "float64",
+    "fev1_fvc": "float64",
+    "GOLD_stage": pd.CategoricalDtype(GOLD_STAGES),
+    "bp_seg_error": "boolean",
+}
+
+
+def get_dtype(column: str):
+    """
+    Return the schema dtype of a column, or None if it is not declared.
+    """
+    if column in SCHEMA:
+        return SCHEMA[column]
+    if column.startswith("bp_"):
+        return "float32"
+    return None
+
+
+def get_dtypes(columns) -> dict:
+    """
+    Return the schema dtypes of the declared columns among ``columns``.
+    """
+    dtypes = {col: get_dtype(col) for col in columns}
+    return {col: dtype for col, dtype in dtypes.items() if dtype is not None}
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cast the columns of a dataframe to their schema dtypes.
+
+    Columns already of the right dtype are left untouched and columns the
+    schema does not declare keep their dtype.
+
+    Parameters:
+    df (pd.DataFrame): The dataframe to cast, modified in place.
+
+    Returns:
+    pd.DataFrame: The dataframe with the schema dtypes.
+    """
+    for col, dtype in get_dtypes(df.columns).items():
+        if df[col].dtype != dtype:
+            df[col] = df[col].astype(dtype)
+    undeclared = [col for col in df.columns if get_dtype(col) is None]
+    if undeclared:
+        logger.debug(f"Columns without a schema dtype: {undeclared}")
+    return df
+
+
+def widen_floats(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cast the float32 columns back to float64 for computing statistics.
+
+    The values are rounded to the stored ``DECIMALS``, so those below 2**14
+    are exactly the float64 values written before the schema was applied.
+
+    Parameters:
+    df (pd.DataFrame): The dataframe to cast, modified in place.
+
+    Returns:
+    pd.DataFrame: The dataframe without float32 columns.
+    """
+    for col in df.columns[df.dtypes == "float32"]:
+        df[col] = df[col].astype("float64").round(DECIMALS)
+    return df
+
+
+def memory_report(df: pd.DataFrame) -> str:
+    """
+    Summarise the memory a dataframe uses, in total and per participant.
+    """
+    usage = df.memory_usage(deep=True).sum()
+    return (f"{len(df)} participants x {df.shape[1]} columns: "
+            f"{usage / 2**20:.2f} MiB, {usage / max(len(df), 1):.0f} bytes "
+            f"per participant")
@@ -0,0 +1,286 @@
+"""
+Mergeable quantile sketches, for quantiles of data streamed in chunks.
+
+``TDigest`` summarises the values of one variable by weighted centroids,
+small near the extremes and larger towards the median, so the quantiles of
+any number of values are estimated from a bounded number of centroids.
+Digests of separate chunks, e.g. monthly exports, merge into the digest of
+their union. ``GroupSketches`` keeps one digest per group and variable, and
+round-trips through the frames ``store.write_frame`` writes.
+"""
+
+import numpy as np
+import pandas as pd
+
+from data.util.quantiles import sorted_quantiles
+from data.util.store import read_frame, write_frame
+
+# Centroids kept per digest are about half the compression. Larger values
+# are more accurate, the rank error is roughly 1 / compression near the
+# median and much smaller towards the tails.
+COMPRESSION = 200
+# Raw values buffered per unit of compression before compressing, digests
+# of fewer values are exact
+BUFFER = 5
+
+
+def _compress(means: np.ndarray, weights: np.ndarray,
+              compression: float) -> tuple:
+    """
+    Merge sorted centroids into clusters spanning at most one unit of the
+    arcsine scale function.
+
+    The first and last centroid, the minimum and maximum, are kept as they
+    are so the extremes stay exact.
+    """
+    if len(means) < 3:
+        return means, weights
+    total = weights.sum()
+    cum = np.cumsum(weights)
+    mid = (cum - weights / 2) / total
+    scale = compression / (2 * np.pi) * (np.arcsin(2 * mid - 1) + np.pi / 2)
+    ids = np.floor(scale).astype(int) + 1
+    ids[0] = 0
+    ids[-1] = ids[-2] + 1
+    # Renumber the occupied clusters consecutively
+    ids = np.cumsum(np.diff(ids, prepend=0) > 0)
+    cluster_weights = np.bincount(ids, weights)
+    cluster_means = np.bincount(ids, weights * means) / cluster_weights
+    # Clusters of a single centroid keep its mean exactly
+    single = np.bincount(ids) == 1
+    cluster_means[single] = means[np.searchsorted(ids, np.flatnonzero(single))]
+    return cluster_means, cluster_weights
+
+
+class TDigest:
+    """
+    A merging t-digest of the non-missing values of one variable.
+
+    Parameters:
+    compression (float): Accuracy, about twice the centroids kept.
+    means (np.ndarray): Sorted centroid means, e.g. of a saved digest.
+    weights (np.ndarray): Their weights, the values each summarises.
+    """
+
+    def __init__(self,
+                 compression: float = COMPRESSION,
+                 means: np.ndarray = None,
+                 weights: np.ndarray = None):
+        self.compression = compression
+        self.means = np.empty(0) if means is None else np.asarray(
+            means, dtype=float)
+        self.weights = np.empty(0) if weights is None else np.asarray(
+            weights, dtype=float)
+
+    @property
+    def count(self) -> int:
+        return int(self.weights.sum())
+
+    def _add(self, means: np.ndarray, weights: np.ndarray,
+             compress: bool = False):
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind="stable")
+        self.means, self.weights = means[order], weights[order]
+        if compress or len(self.means) > BUFFER * self.compression:
+            self.means, self.weights = _compress(self.means, self.weights,
+                                                 self.compression)
+
+    def update(self, values: np.ndarray):
+        """Add values, missing ones are ignored."""
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        self._add(values, np.ones(len(values)))
+
+    def merge(self, other: "TDigest"):
+        """Add the values summarised by another digest."""
+        # Interleaved centroids of both are merged into clusters again,
+        # interpolating between them directly is much less accurate
+        compressed = (len(self.means) < self.weights.sum()
+                      or len(other.means) < other.weights.sum())
+        self._add(other.means, other.weights, compress=compressed)
+
+    def quantile(self, qs: list) -> np.ndarray:
+        """
+        Estimate quantiles, NaN if the digest is empty.
+
+        Interpolates between the centroids at the ranks of numpy's linear
+        method, so digests that were never compressed give exactly the
+        quantiles ``Series.quantile`` gives.
+        """
+        qs = np.asarray(qs, dtype=float)
+        if len(self.means) == 0:
+            return np.full(len(qs), np.nan)
+        total = self.weights.sum()
+        if total == len(self.means):
+            # Only raw values
+            return sorted_quantiles(self.means[:, None],
+                                    np.array([len(self.means)]), qs)[:, 0]
+        centres = np.cumsum(self.weights) - self.weights / 2
+        return np.interp(qs * (total - 1) + 0.5, centres, self.means)
+
+
+class GroupSketches:
+    """
+    One ``TDigest`` per group and variable, fed chunk by chunk.
+
+    Rows missing a group key are skipped, as by ``groupby``.
+
+    Parameters:
+    params (list): The numeric variables.
+    by (list): The grouping columns, e.g. ``["sex", "age_5yr"]``.
+    compression (float): Accuracy of the digests.
+    """
+
+    def __init__(self,
+                 params: list,
+                 by: list,
+                 compression: float = COMPRESSION):
+        self.params = list(params)
+        self.by = list(by)
+        self.compression = compression
+        self.digests = {}
+        # Category order of the grouping columns, when categorical
+        self.levels = {}
+
+    def _digest(self, group: tuple, param: str) -> TDigest:
+        key = (group, param)
+        if key not in self.digests:
+            self.digests[key] = TDigest(self.compression)
+        return self.digests[key]
+
+    def _track_levels(self, data: pd.DataFrame):
+        for col in self.by:
+            if isinstance(data[col].dtype, pd.CategoricalDtype):
+                levels = self.levels.setdefault(col, [])
+                levels += [level for level in data[col].cat.categories
+                           if level not in levels]
+
+    def update(self, chunk: pd.DataFrame):
+        """Add the rows of a chunk of the data."""
+        self._track_levels(chunk)
+        block = chunk[self.params].to_numpy(dtype=float)
+        groups = chunk.groupby(self.by, observed=True).indices
+        for group, rows in groups.items():
+            group = group if isinstance(group, tuple) else (group, )
+            for j, param in enumerate(self.params):
+                self._digest(group, param).update(block[rows, j])
+
+    def merge(self, other: "GroupSketches"):
+        """Add the data summarised by other sketches of the same groups."""
+        if other.by != self.by:
+            raise ValueError(f"Cannot merge sketches by {other.by} into "
+                             f"sketches by {self.by}")
+        for col, other_levels in other.levels.items():
+            levels = self.levels.setdefault(col, [])
+            levels += [level for level in other_levels if level not in levels]
+        for (group, param), digest in other.digests.items():
+            if param not in self.params:
+                self.params.append(param)
+            self._digest(group, param).merge(digest)
+
+    def _index(self) -> pd.MultiIndex:
+        """Every group, in category order, unobserved categories included."""
+        levels = []
+        for i, col in enumerate(self.by):
+            if col in self.levels:
+                levels.append(self.levels[col])
+            else:
+                levels.append(sorted({group[i] for group, _ in self.digests}))
+        return pd.MultiIndex.from_product(levels, names=self.by)
+
+    def quantiles(self, qs: list) -> pd.DataFrame:
+        """
+        Estimated quantiles of every variable per group.
+
+        Returns:
+        pd.DataFrame: Shaped as ``quantiles.group_quantiles``, indexed by the
+            ``by`` columns and the quantile, with NaN for empty groups.
+        """
+        groups = self._index()
+        empty = np.full(len(qs), np.nan)
+        values = {
+            param: np.concatenate([
+                self.digests[(group, param)].quantile(qs)
+                if (group, param) in self.digests else empty
+                for group in groups
+            ]) for param in self.params
+        }
+        index = pd.MultiIndex.from_product(list(groups.levels) + [qs],
+                                           names=self.by + [None])
+        return pd.DataFrame(values, index=index, columns=self.params)
+
+    def counts(self) -> pd.DataFrame:
+        """
+        The non-missing values of every variable per group.
+
+        Returns:
+        pd.DataFrame: Indexed by the ``by`` columns, 0 for empty groups.
+        """
+        groups = self._index()
+        return pd.DataFrame(
+            {
+                param: [
+                    self.digests[(group, param)].count
+                    if (group, param) in self.digests else 0
+                    for group in groups
+                ] for param in self.params
+            },
+            index=groups)
+
+    def to_frame(self) -> pd.DataFrame:
+        """The centroids of every digest, one row each."""
+        frames = []
+        for (group, param), digest in self.digests.items():
+            frame = pd.DataFrame({
+                "centroid_mean": digest.means,
+                "centroid_weight": digest.weights
+            })
+            frame.insert(0, "variable", param)
+            for col, key in reversed(list(zip(self.by, group))):
+                frame.insert(0, col, key)
+            frames.append(frame)
+        if not frames:
+            return pd.DataFrame(
+                columns=self.by +
+                ["variable", "centroid_mean", "centroid_weight"])
+        return pd.concat(frames, ignore_index=True)
+
+    def save(self, path):
+        """Write the sketches, in any format of ``store.write_frame``."""
+        return write_frame(self.to_frame(), path)
+
+    @classmethod
+    def from_frame(cls,
+                   frame: pd.DataFrame,
+                   params: list,
+                   by: list,
+                   compression: float = COMPRESSION) -> "GroupSketches":
+        """
+        Sketches from the centroids of ``to_frame``.
+
+        Sketches saved with another compression are merged and compressed
+        with ``compression`` from then on.
+        """
+        sketches = cls(params, by, compression)
+        sketches._track_levels(frame)
+        for key, rows in frame.groupby(by + ["variable"],
+                                       observed=True,
+                                       sort=False):
+            *group, param = key
+            if param not in sketches.params:
+                sketches.params.append(param)
+            sketches.digests[(tuple(group), param)] = TDigest(
+                compression, rows["centroid_mean"].to_numpy(),
+                rows["centroid_weight"].to_numpy())
+        return sketches
+
+    @classmethod
+    def load(cls,
+             path,
+             params: list,
+             by: list,
+             compression: float = COMPRESSION) -> "GroupSketches":
+        """Read sketches written by ``save``."""
+        return cls.from_frame(read_frame(path, index_col=0), params, by,
+                              compression)
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+# Checked in order, the first true status wins
+SMOKING_STATUSES = ("current_smoker", "ex_smoker", "never_smoker")
+
+MISSING, FALSE, TRUE = -1, 0, 1
+
+
+def tristate(values: pd.Series) -> np.ndarray:
+    """
+    Encode a True/False/missing answer as -1 (missing), 0 (False), 1 (True).
+
+    Parameters:
+    values (pd.Series): The answers, of any dtype the merge produces (bool,
+        object with NaN or 0/1 floats).
+
+    Returns:
+    np.ndarray: The int8 encoded answers.
+    """
+    state = values.eq(True).to_numpy(dtype=np.int8)
+    state[values.isna().to_numpy()] = MISSING
+    return state
+
+
+def classify_smoking(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Infer the missing never smoker answers and derive the smoking status.
+
+    Never smoker is set False if the participant is a current smoker, an ever
+    smoker or an ex smoker, and True if all three answers are False. Any True
+    answer already forces False, so the "all answered" fallback used when the
+    answers could not be inverted gives the same result and needs no special
+    case. The status is then the first true of current, ex and never smoker.
+
+    Parameters:
+    df (pd.DataFrame): Frame with the ``never_smoker``, ``ever_smoker``,
+        ``current_smoker`` and ``ex_smoker`` answers, modified in place.
+
+    Returns:
+    pd.DataFrame: The frame with ``never_smoker`` filled in and the
+        ``smoking_status`` column added.
+    """
+    never = tristate(df["never_smoker"])
+    ever = tristate(df["ever_smoker"])
+    current = tristate(df["current_smoker"])
+    ex = tristate(df["ex_smoker"])
+
+    not_never = (((never == MISSING) & (current == TRUE)) | (ever == TRUE) |
+                 (ex == TRUE))
+    is_never = ((never == MISSING) & (current == FALSE) & (ever == FALSE) &
+                (ex == FALSE))
+    never = np.select([not_never, is_never], [FALSE, TRUE], never)
+
+    answers = np.array([np.nan, False, True], dtype=object)
+    df["never_smoker"] = pd.Series(answers[never + 1],
+                                   index=df.index).infer_objects()
+    df["smoking_status"] = np.select(
+        [current == TRUE, ex == TRUE, never == TRUE],
+        SMOKING_STATUSES,
+        default=None)
+
+    return df
@@ -0,0 +1,341 @@
+from pathlib import Path
+
+import pandas as pd
+
+from data.util.schema import apply_schema, get_dtype, get_dtypes
+
+# File suffix -> storage format
+FORMATS = {
+    ".parquet": "parquet",
+    ".feather": "ipc",
+    ".arrow": "ipc",
+    ".csv": "csv",
+}
+
+# Predicates supported by the csv fallback of read_frame
+OPERATORS = {
+    "==": lambda col, val: col == val,
+    "!=": lambda col, val: col != val,
+    "<": lambda col, val: col < val,
+    "<=": lambda col, val: col <= val,
+    ">": lambda col, val: col > val,
+    ">=": lambda col, val: col >= val,
+    "in": lambda col, val: col.isin(val),
+    "not in": lambda col, val: ~col.isin(val),
+}
+
+
+def get_format(path) -> str:
+    """
+    Return the storage format of a path from its suffix.
+
+    Raises:
+    ValueError: If the suffix is not one of ``FORMATS``.
+    """
+    suffix = Path(path).suffix
+    if suffix not in FORMATS:
+        raise ValueError("Unsupported file type: " + suffix)
+    return FORMATS[suffix]
+
+
+def _to_arrow(df: pd.DataFrame, nan_as_null: bool = True):
+    import pyarrow as pa
+
+    # Arrow needs one type per column, keep mixed object columns as text
+    mixed = [
+        col for col in df.columns[df.dtypes == object]
+        if pd.api.types.infer_dtype(df[col], skipna=True).startswith("mixed")
+    ]
+    if mixed:
+        df = df.copy()
+        for col in mixed:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    table = pa.Table.from_pandas(df)
+    if not nan_as_null:
+        # NaNs as float values rather than nulls, so the columns have no
+        # validity bitmap and convert back to NumPy without a copy
+        for i, name in enumerate(table.column_names):
+            if name in df.columns and pd.api.types.is_float_dtype(df[name]):
+                table = table.set_column(
+                    i, name, pa.array(df[name].to_numpy(), from_pandas=False))
+    return table
+
+
+def write_frame(df: pd.DataFrame, path, typed: bool = True) -> Path:
+    """
+    Write a dataframe, choosing the format from the file suffix.
+
+    Parquet and Arrow IPC (feather) files keep the index and the dtypes,
+    including categoricals and booleans. The IPC file is left uncompressed,
+    with NaNs stored as float values, so ``map_frame`` can share its float
+    columns.
+
+    Parameters:
+    df (pd.DataFrame): The dataframe to write.
+    path (str or Path): Output file, ``.parquet``, ``.feather``/``.arrow`` or
+        ``.csv``.
+    typed (bool): Cast the columns to their schema dtypes first, without
+        modifying ``df``.
+
+    Returns:
+    Path: The written file.
+    """
+    path = Path(path)
+    fmt = get_format(path)
+    if typed:
+        df = apply_schema(df.copy(deep=False))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == "csv":
+        df.to_csv(path)
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(_to_arrow(df), path)
+    else:
+        import pyarrow.feather as pf
+
+        pf.write_feather(_to_arrow(df, nan_as_null=False),
+                         path,
+                         compression="uncompressed")
+    return path
+
+
+def read_frame(path,
+               columns: list = None,
+               filters: list = None,
+               index_col=None,
+               typed: bool = True) -> pd.DataFrame:
+    """
+    Read a dataframe written by ``write_frame``.
+
+    For Parquet and Arrow IPC files only the requested columns are read and
+    the filters are pushed down to the reader, so skipped row groups and
+    columns are never loaded. CSV files are read fully and filtered after.
+
+    Parameters:
+    path (str or Path): Input file.
+    columns (list): Columns to load, None loads all. The stored index is
+        always restored.
+    filters (list): ``(column, operator, value)`` tuples that must all hold,
+        e.g. ``[("pack_years", ">=", 10)]``.
+    index_col (int or str): Index column of a CSV file, as in
+        ``pd.read_csv``. Ignored for the other formats.
+    typed (bool): Cast the columns to their schema dtypes, csv files are
+        parsed directly into them.
+
+    Returns:
+    pd.DataFrame: The loaded data.
+    """
+    fmt = get_format(path)
+    if fmt == "csv":
+        usecols = None
+        # A positional index column cannot be matched by name
+        if columns is not None and not isinstance(index_col, int):
+            needed = set(columns) | {f[0] for f in filters or []}
+            usecols = lambda col: col in needed or col == index_col
+        dtype = None
+        if typed:
+            header = pd.read_csv(path, nrows=0).columns
+            dtype = get_dtypes(header)
+        df = pd.read_csv(path,
+                         usecols=usecols,
+                         index_col=index_col,
+                         dtype=dtype,
+                         low_memory=False)
+        if filters:
+            mask = pd.Series(True, index=df.index)
+            for col, op, val in filters:
+                mask &= OPERATORS[op](df[col], val)
+            df = df[mask]
+        if columns is not None:
+            df = df[[col for col in columns if col in df.columns]]
+        return apply_schema(df) if typed else df
+
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    dataset = ds.dataset(str(path), format=fmt)
+    if columns is not None:
+        meta = dataset.schema.pandas_metadata or {}
+        index = [c for c in meta.get("index_columns", []) if isinstance(c, str)]
+        columns = index + [col for col in columns if col not in index]
+    expression = pq.filters_to_expression(filters) if filters else None
+    df = dataset.to_table(columns=columns, filter=expression).to_pandas()
+    return apply_schema(df) if typed else df
+
+
+def map_frame(path) -> pd.DataFrame:
+    """
+    Read an Arrow IPC file written by ``write_frame`` through a memory map.
+
+    The float columns are read-only NumPy views of the mapped file, one
+    block per column, so all processes mapping it share them through the
+    page cache instead of each holding a copy. Only the other columns, i.e.
+    the categoricals, booleans and text, are copied into every process. The
+    dtypes are restored as written.
+
+    Parameters:
+    path (str or Path): An uncompressed ``.feather`` or ``.arrow`` file.
+
+    Returns:
+    pd.DataFrame: The stored data.
+    """
+    import pyarrow as pa
+
+    with pa.memory_map(str(path)) as source:
+        # The buffers keep the mapping alive once the file is closed
+        return pa.ipc.open_file(source).read_all().to_pandas(
+            split_blocks=True)
+
+
+def iter_frames(path,
+                columns: list = None,
+                filters: list = None,
+                index_col=None,
+                typed: bool = True,
+                chunk_rows: int = 2**16):
+    """
+    Read a dataframe written by ``write_frame`` in chunks of rows.
+
+    Only one chunk is in memory at a time, so files larger than memory can
+    be aggregated. Columns and filters are as in ``read_frame``, pushed down
+    to the reader for Parquet and Arrow IPC files. The chunks of Parquet
+    files follow its row groups, so they can be smaller than ``chunk_rows``.
+
+    Parameters:
+    path (str or Path): Input file.
+    columns (list): Columns to load, None loads all.
+    filters (list): ``(column, operator, value)`` tuples that must all hold.
+    index_col (int or str): Index column of a CSV file.
+    typed (bool): Cast the columns to their schema dtypes.
+    chunk_rows (int): Maximum rows per chunk.
+
+    Yields:
+    pd.DataFrame: The next chunk of the data, possibly empty after the
+        filters.
+    """
+    fmt = get_format(path)
+    if fmt == "csv":
+        usecols = None
+        if columns is not None and not isinstance(index_col, int):
+            needed = set(columns) | {f[0] for f in filters or []}
+            usecols = lambda col: col in needed or col == index_col
+        dtype = None
+        if typed:
+            header = pd.read_csv(path, nrows=0).columns
+            dtype = get_dtypes(header)
+        with pd.read_csv(path,
+                         usecols=usecols,
+                         index_col=index_col,
+                         dtype=dtype,
+                         chunksize=chunk_rows) as reader:
+            for df in reader:
+                if filters:
+                    mask = pd.Series(True, index=df.index)
+                    for col, op, val in filters:
+                        mask &= OPERATORS[op](df[col], val)
+                    df = df[mask]
+                if columns is not None:
+                    df = df[[col for col in columns if col in df.columns]]
+                yield apply_schema(df) if typed else df
+        return
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    dataset = ds.dataset(str(path), format=fmt)
+    if columns is not None:
+        meta = dataset.schema.pandas_metadata or {}
+        index = [c for c in meta.get("index_columns", []) if isinstance(c, str)]
+        columns = index + [col for col in columns if col not in index]
+    expression = pq.filters_to_expression(filters) if filters else None
+    for batch in dataset.to_batches(columns=columns,
+                                    filter=expression,
+                                    batch_size=chunk_rows):
+        # Through a table, so the index and dtypes stored in the schema
+        # metadata are restored as by read_frame
+        df = pa.Table.from_batches([batch]).to_pandas()
+        yield apply_schema(df) if typed else df
+
+
+class ChunkWriter:
+    """
+    Write a dataframe chunk by chunk, choosing the format from the suffix.
+
+    Only the current chunk is held in memory. The file reads back with
+    ``read_frame`` as if the concatenated chunks had been written with
+    ``write_frame``, except that columns of the plain "category" schema
+    dtype are stored as text: their categories are only known at the end,
+    the typed readers sort them as ``astype("category")`` would. The columns
+    of the first chunk fix the file's types, later chunks are cast to them.
+
+    Parameters:
+    path (str or Path): Output file, ``.parquet``, ``.feather``/``.arrow`` or
+        ``.csv``.
+    typed (bool): Cast each chunk to the schema dtypes first.
+    """
+
+    def __init__(self, path, typed: bool = True):
+        self.path = Path(path)
+        self.format = get_format(self.path)
+        self.typed = typed
+        self._writer = None
+        self._started = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def _arrow(self, df: pd.DataFrame):
+        import pyarrow as pa
+
+        open_categories = [
+            col for col in df.columns if get_dtype(col) == "category"
+        ]
+        if open_categories:
+            df = df.copy(deep=False)
+            for col in open_categories:
+                df[col] = df[col].astype(object)
+        table = _to_arrow(df)
+        if not self._started:
+            # Columns without any value in the first chunk hold text
+            self.schema = pa.schema([
+                field.with_type(pa.string())
+                if pa.types.is_null(field.type) else field
+                for field in table.schema
+            ], metadata=table.schema.metadata)
+        return table.cast(self.schema)
+
+    def write(self, df: pd.DataFrame):
+        """Append a chunk, with the same columns as the first."""
+        if self.typed:
+            df = apply_schema(df.copy(deep=False))
+        if self.format == "csv":
+            df.to_csv(self.path,
+                      mode="a" if self._started else "w",
+                      header=not self._started)
+        else:
+            table = self._arrow(df)
+            if self._writer is None:
+                self._writer = self._open()
+            self._writer.write_table(table)
+        self._started = True
+
+    def _open(self):
+        if self.format == "parquet":
+            import pyarrow.parquet as pq
+
+            return pq.ParquetWriter(self.path, self.schema)
+        import pyarrow as pa
+
+        return pa.ipc.new_file(self.path,
+                               self.schema,
+                               options=pa.ipc.IpcWriteOptions(compression=None))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,57 +1,68 @@
 #!/usr/bin/env python3
 
 import pandas as pd
-from scipy import stats
-from statsmodels.stats.multicomp import pairwise_tukeyhsd
-
-
-def compare(data, parameters, out_path):
-    # Function to perform one-way ANOVA and Tukey's test
-    def _perform_anova_and_tukey(data, parameter):
-        # One-way ANOVA
-        anova_result = stats.f_oneway(
-            data[data["smoking_status"] == "current_smoker"][parameter],
-            data[data["smoking_status"] == "never_smoker"][parameter],
-            data[data["smoking_status"] == "ex_smoker"][parameter],
-        )
-
-        # Check if ANOVA is significant
-        if anova_result.pvalue < 0.05:
-            # Perform Tukey's test
-            tukey = pairwise_tukeyhsd(
-                endog=data[parameter],
-                groups=data["smoking_status"],
-                alpha=0.05,
-            )
-            return (True, anova_result, tukey)
-        else:
-            return (False, anova_result, None)
+
+from data.util import permutation
+
+GROUPS = ["current_smoker", "ex_smoker", "never_smoker"]
+
+
+def compare(data,
+            parameters,
+            out_path,
+            n_perm=permutation.N_PERM,
+            precision=None,
+            jobs=1):
+    """
+    Compare the smoking groups of each sex on every parameter.
+
+    The one-way ANOVA F and the pairwise mean differences are tested by
+    permuting the smoking status within each sex, for all parameters at
+    once, instead of the normal-theory ANOVA and Tukey's HSD per parameter.
+    The pairs are only reported where the overall test is significant.
+
+    Parameters:
+    data (pd.DataFrame): The parameters, "sex" and "smoking_status".
+    parameters (list): The parameters to compare.
+    out_path (Path): The directory of "sex_differences.csv".
+    n_perm (int): Permutations of each test.
+    precision (float): Stop the tests of a parameter once the Monte Carlo
+        standard error of its p-values is at most this.
+    jobs (int): Processes running the permutations.
+    """
+    data = data[data["sex"].isin(["Male", "Female"])]
+    tests = permutation.group_test(data[parameters],
+                                   data["smoking_status"],
+                                   GROUPS,
+                                   strata=data["sex"],
+                                   n_perm=n_perm,
+                                   precision=precision,
+                                   jobs=jobs)
+    # A sex without rows in the group has no tests, its results are NaN
+    tests = tests.reindex(
+        pd.MultiIndex.from_product([["Male", "Female"], parameters]))
+    tests["permutations"] = tests["permutations"].fillna(0)
+    pairs = [
+        column for column in tests.columns
+        if column.startswith(("pvalue_", "meandiff_"))
+    ]
 
     # Initialize results table
     results = []
-
-    # Perform tests for each sex and parameter
     for sex in ["Male", "Female"]:
-        sex_df = data[data["sex"] == sex]
         for param in parameters:
-            param_df = sex_df.dropna(subset=[param])
-            significant, anova, tukey = _perform_anova_and_tukey(param_df, param)
+            test = tests.loc[(sex, param)]
+            significant = test["pvalue"] < permutation.ALPHA
             result = {
                 "sex": sex,
                 "parameter": param,
-                "anova_f": anova.statistic,
-                "anova_p": anova.pvalue,
+                "anova_f": test["f"],
+                "anova_p": test["pvalue"],
                 "significant": significant,
+                "permutations": int(test["permutations"]),
             }
             if significant:
-                group1, group2 = tukey._multicomp.pairindices
-                for g1, g2, pvalue, meandiff in zip(
-                    group1, group2, tukey.pvalues, tukey.meandiffs
-                ):
-                    pair = (tukey.groupsunique[g1], tukey.groupsunique[g2])
-                    result[f"pvalue_{pair[0]}_vs_{pair[1]}"] = pvalue
-                    result[f"meandiff_{pair[0]}_vs_{pair[1]}"] = meandiff
-
+                result.update(test[pairs])
             results.append(result)
 
     # Convert results to DataFrame and save as CSV
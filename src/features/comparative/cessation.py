@@ -6,11 +6,28 @@ import numpy as np
 import statsmodels.api as sm
 import matplotlib.pyplot as plt
 
+from data.util import bootstrap
+from models.linear import ols
 
-def analyse(data: pd.DataFrame, bps: list, out_path: Path):
-    # Create empty lists to store results
-    results = []
 
+def analyse(data: pd.DataFrame,
+            bps: list,
+            out_path: Path,
+            n_boot: int = bootstrap.N_BOOT):
+    """
+    Model the bronchial parameters on the smoking cessation duration, over
+    the covariates, per health status.
+
+    Parameters:
+    data (pd.DataFrame): The participants.
+    bps (list): The bronchial parameters.
+    out_path (Path): The output directory.
+    n_boot (int): Resamples of the bootstrap interval of the change in
+        adjusted R-squared, 0 leaves it out.
+    """
+
+    # Derived columns go to a shallow copy, the caller's data is shared
+    data = data.copy(deep=False)
     data['years_quit'] = pd.cut(data['smoking_cessation_duration'],
                                 [0, 5, 10, 15, 20, 100],
                                 right=False,
@@ -19,7 +36,8 @@ def analyse(data: pd.DataFrame, bps: list, out_path: Path):
                                     '15-20 years', '20+ years'
                                 ])
 
-    results = {}
+    # Per health status, so a group's table only holds its own models
+    results = {"healthy": {}, "unhealthy": {}}
 
     # Loop over each parameter and calculate Pearson's correlation coefficient and R-squared
     fig = plt.figure(figsize=(8,6))
@@ -49,11 +67,27 @@ def analyse(data: pd.DataFrame, bps: list, out_path: Path):
             bic_change = model.bic - model_init.bic
 
             # Save the results to a dictionary
-            results[param] = {
+            results[group][param] = {
                 "rsq_change": rsq_change,
                 "aic_change": aic_change,
                 "bic_change": bic_change,
             }
+            if n_boot:
+                # The rows the models were fitted on
+                design = ols.base_design(data_param, independent_vars)
+                rows = design.notna().all(axis=1).to_numpy()
+                changes = bootstrap.bootstrap(
+                    rows.sum(), {
+                        "rsq_change":
+                        bootstrap.rsquared_change(
+                            data_param[param].to_numpy(dtype=float)[rows],
+                            design.to_numpy()[rows],
+                            data_param["smoking_cessation_duration"].
+                            to_numpy(dtype=float)[rows])
+                    }, n_boot)["rsq_change"]
+                (results[group][param]["rsq_change_low"],
+                 results[group][param]["rsq_change_high"]) = bootstrap.interval(
+                     changes)
 
             x_values = np.linspace(data["smoking_cessation_duration"].min(),
                                    data["smoking_cessation_duration"].max(), 100)
@@ -65,11 +99,11 @@ def analyse(data: pd.DataFrame, bps: list, out_path: Path):
                 axs[(idx//2), (idx%2)].plot(x_values, y_values, color='blue')
             else:
                 axs[(idx//2), (idx%2)].plot(x_values, y_values, color='red')
-            results_data = pd.DataFrame.from_dict(results)
+            results_data = pd.DataFrame.from_dict(results[group])
             results_data = results_data.round(4)
 
-            # Output results to a CSV file
-            results_data.to_csv(str(out_path / f"cessation_results_mlr_{group}.csv"), index=False)
+            # Output results to a CSV file, labelling the statistics of the rows
+            results_data.to_csv(str(out_path / f"cessation_results_mlr_{group}.csv"), index_label="statistic")
             sm.graphics.plot_regress_exog(model, 'smoking_cessation_duration', fig=plt.figure(figsize=(12,10))).savefig(str(out_path / f"smoking_cessation_residuals_{group}_{param}.jpg"), dpi=300)
 
         axs[(idx//2), (idx%2)].set_ylim(data[param].quantile(0.1), data[param].quantile(0.9))
@@ -1,88 +1,186 @@
 #!/usr/bin/env python3
 import pandas as pd
 import numpy as np
-from scipy.stats import ttest_ind, t
+from scipy.stats import t, ttest_ind_from_stats
+
+from data.util import bootstrap
+from data.util.quantiles import quantiles
+
+SEXES = ["Male", "Female"]
+# Confidence level of the mean and quantiles of the reference range
+CONFIDENCE = 0.99
+RANGE = [0.025, 0.975]
+
+
+def _aggregate(values: pd.DataFrame, by: list, n_boot: int) -> pd.DataFrame:
+    """
+    Count, mean, SD, range quantiles and bootstrap interval of the mean of
+    every column per group, long.
+    """
+    grouped = values.groupby(by)
+    moments = pd.concat(
+        {
+            "count": grouped.count(),
+            "mean": grouped.mean(),
+            "std": grouped.std()
+        },
+        axis=1).stack(level=1)
+
+    # Quantiles of all columns of a group at once, interpolated exactly as
+    # Series.quantile does
+    block = values.to_numpy()
+    ranges = {}
+    for key, rows in grouped.indices.items():
+        ranges[key] = pd.DataFrame(quantiles(block[rows], RANGE).T,
+                                   index=values.columns,
+                                   columns=["range_low", "range_high"])
+        if n_boot:
+            means = bootstrap.bootstrap(len(rows),
+                                        {"mean": bootstrap.mean(block[rows])},
+                                        n_boot)["mean"]
+            (ranges[key]["boot_low"],
+             ranges[key]["boot_high"]) = bootstrap.interval(means, CONFIDENCE)
+    return moments.join(pd.concat(ranges, names=moments.index.names))
+
+
+def group_stats(data: pd.DataFrame,
+                params: list,
+                split_by: str,
+                n_boot: int = bootstrap.N_BOOT) -> pd.DataFrame:
+    """
+    Compute the descriptive statistics of every variable per sex, for all
+    participants and for each ``split_by`` group, in one aggregation each.
+
+    Parameters:
+    data (pd.DataFrame): The participants.
+    params (list): The numeric variables to describe.
+    split_by (str): The column defining the groups, e.g. "health_status".
+    n_boot (int): Resamples of the bootstrap intervals, 0 leaves them out.
+
+    Returns:
+    pd.DataFrame: Indexed by (group, sex, variable), with group "all" first
+        and then the groups in order of appearance, the "count" of values,
+        their "share" of the group's participants, "mean", "std", the
+        ``CONFIDENCE`` interval of the mean ("ci_low", "ci_high"), the
+        ``RANGE`` quantiles ("range_low", "range_high") and the bootstrap
+        percentile interval of the mean ("boot_low", "boot_high"), which
+        does not assume the mean is normal. The "Participants" variable
+        counts the participants of each sex.
+    """
+    groups = data[split_by].dropna().unique().tolist()
+    keys = ["all"] + groups
+    values = data[params].astype(float)
+    values.insert(0, "Participants", 0.0)
+    sex = data["sex"].astype(object)
+    by_group = [data[split_by].astype(object).rename("group"), sex]
+    by_all = [pd.Series("all", index=data.index, name="group"), sex]
+
+    stats = pd.concat([_aggregate(values, by_all, n_boot),
+                       _aggregate(values, by_group, n_boot)])
+    stats.index.names = ["group", "sex", "variable"]
+    stats = stats.reindex(
+        pd.MultiIndex.from_product([keys, SEXES, ["Participants"] + params],
+                                   names=stats.index.names))
+    stats["count"] = stats["count"].fillna(0).astype(int)
+
+    sizes = data[split_by].value_counts()
+    sizes["all"] = len(data)
+    stats.insert(1, "share",
+                 stats["count"] / sizes.reindex(
+                     stats.index.get_level_values("group")).to_numpy())
+    participants = stats.index.get_level_values("variable") == "Participants"
+    stats.loc[participants,
+              stats.columns.difference(["count", "share"])] = np.nan
+
+    se = stats["std"] / np.sqrt(stats["count"])
+    with np.errstate(invalid="ignore"):
+        stats["ci_low"], stats["ci_high"] = t.interval(CONFIDENCE,
+                                                       stats["count"] - 1,
+                                                       loc=stats["mean"],
+                                                       scale=se)
+    return stats
+
+
+def sex_pvalues(stats: pd.DataFrame) -> pd.Series:
+    """
+    Two-sample t-test p-values between the sexes, from ``group_stats``.
+
+    Returns:
+    pd.Series: Indexed by (group, variable).
+    """
+    male = stats.xs("Male", level="sex")
+    female = stats.xs("Female", level="sex")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        _, pvalues = ttest_ind_from_stats(male["mean"], male["std"],
+                                          male["count"], female["mean"],
+                                          female["std"], female["count"])
+    return pd.Series(pvalues, index=male.index)
+
+
+def format_table(stats: pd.DataFrame, pvalues: pd.Series) -> pd.DataFrame:
+    """
+    Format the statistics as the "Mean±SD" demographics table, one row per
+    variable and the columns of each group side by side.
+
+    Parameters:
+    stats (pd.DataFrame): From ``group_stats``.
+    pvalues (pd.Series): From ``sex_pvalues``.
+
+    Returns:
+    pd.DataFrame: The report table.
+    """
+    variables = stats.index.unique("variable").tolist()
+    ci = f"{CONFIDENCE * 100:.0f}% CI"
+    boot = "boot_low" in stats
+    coverage = f"{(RANGE[1] - RANGE[0]) * 100:.0f}% Range"
+    result_dict = {"Variable": variables}
+    cells = {
+        key: cell.droplevel(["group", "sex"])
+        for key, cell in stats.groupby(level=["group", "sex"], sort=False)
+    }
+    for group in stats.index.unique("group"):
+        columns = {}
+        for sex in SEXES:
+            cell = cells[(group, sex)]
+            columns[f"{sex} Mean±SD"] = [
+                f"{cell.loc[var, 'count']} ({cell.loc[var, 'share']*100:.1f})"
+                if var == "Participants" else
+                f"{cell.loc[var, 'mean']:.3f}±{cell.loc[var, 'std']:.3f}"
+                for var in variables
+            ]
+            columns[f"{sex} {ci}"] = [
+                "NA" if var == "Participants" else
+                f"{cell.loc[var, 'ci_low']:.3f}-{cell.loc[var, 'ci_high']:.3f}"
+                for var in variables
+            ]
+            if boot:
+                columns[f"{sex} Bootstrap {ci}"] = [
+                    "NA" if var == "Participants" else
+                    f"{cell.loc[var, 'boot_low']:.3f}-{cell.loc[var, 'boot_high']:.3f}"
+                    for var in variables
+                ]
+            columns[f"{sex} {coverage}"] = [
+                "NA" if var == "Participants" else
+                f"[{cell.loc[var, 'range_low']:.3f}-{cell.loc[var, 'range_high']:.3f}]"
+                for var in variables
+            ]
+        columns["p-val"] = [
+            "NA" if var == "Participants" else
+            f"{pvalues.loc[(group, var)]:.4f}" for var in variables
+        ]
+        for name in ["Male Mean±SD", "Female Mean±SD", "p-val",
+                     f"Male {ci}", f"Male Bootstrap {ci}", f"Male {coverage}",
+                     f"Female {ci}", f"Female Bootstrap {ci}",
+                     f"Female {coverage}"]:
+            if name in columns:
+                result_dict[f"{name} {group.title()}"] = columns[name]
+    return pd.DataFrame(result_dict)
 
 
 def calc_demographics(data, params, out_dir, split_by):
+    # Every statistic for all variables x sex x group, then the report
+    stats = group_stats(data, params, split_by)
+    result_df = format_table(stats, sex_pvalues(stats))
 
-    groups = data[split_by].dropna().unique().tolist()
-
-    # Define the descriptive stats function
-    def descriptive_stats(data, group, result_dict):
-        male_dataframe = data[(data['sex'] == 'Male')]
-        female_dataframe = data[(data['sex'] == 'Female')]
-        male_count = len(male_dataframe)
-        female_count = len(female_dataframe)
-
-        result_dict[f'Male Mean±SD {group.title()}'] = []
-        result_dict[f'Female Mean±SD {group.title()}'] = []
-        result_dict[f'p-val {group.title()}'] = []
-        result_dict[f'Male 99% CI {group.title()}'] = []
-        result_dict[f'Male 95% Range {group.title()}'] = []
-        result_dict[f'Female 99% CI {group.title()}'] = []
-        result_dict[f'Female 95% Range {group.title()}'] = []
-
-        result_dict[f'Male Mean±SD {group.title()}'].append(
-            f'{male_count} ({male_count/len(data)*100:.1f})')
-        result_dict[f'Female Mean±SD {group.title()}'].append(
-            f'{female_count} ({female_count/len(data)*100:.1f})')
-        result_dict[f'p-val {group.title()}'].append('NA')
-        result_dict[f'Male 99% CI {group.title()}'].append('NA')
-        result_dict[f'Female 99% CI {group.title()}'].append('NA')
-        result_dict[f'Male 95% Range {group.title()}'].append('NA')
-        result_dict[f'Female 95% Range {group.title()}'].append('NA')
-
-        for var in params:
-
-            male_data = male_dataframe[var].dropna()
-            female_data = female_dataframe[var].dropna()
-
-            male_mean = male_data.mean()
-            male_std = male_data.std()
-            male_se = male_std / np.sqrt(len(male_data))
-            male_ci = t.interval(0.99,
-                                 len(male_data) - 1,
-                                 loc=male_mean,
-                                 scale=male_se)
-            male_range = f"[{male_data.quantile(0.025):.3f}-{male_data.quantile(0.975):.3f}]"
-
-            female_mean = female_data.mean()
-            female_std = female_data.std()
-            female_se = female_std / np.sqrt(len(female_data))
-            female_ci = t.interval(0.99,
-                                 len(female_data) - 1,
-                                 loc=female_mean,
-                                 scale=female_se)
-            female_range = f"[{female_data.quantile(0.025):.3f}-{female_data.quantile(0.975):.3f}]"
-
-            t_stat, p_value = ttest_ind(male_data, female_data)
-
-            if group == groups[0] and var not in result_dict['Variable']:
-                result_dict['Variable'].append(var)
-
-            result_dict[f'Male Mean±SD {group.title()}'].append(
-                f'{male_mean:.3f}±{male_std:.3f}')
-            result_dict[f'Female Mean±SD {group.title()}'].append(
-                f'{female_mean:.3f}±{female_std:.3f}')
-            result_dict[f'p-val {group.title()}'].append(f'{p_value:.4f}')
-            result_dict[f'Male 99% CI {group.title()}'].append(f'{male_ci[0]:.3f}-{male_ci[1]:.3f}')
-            result_dict[f'Female 99% CI {group.title()}'].append(f'{female_ci[0]:.3f}-{female_ci[1]:.3f}')
-            result_dict[f'Male 95% Range {group.title()}'].append(male_range)
-            result_dict[f'Female 95% Range {group.title()}'].append(female_range)
-
-    # Calculate descriptive statistics and t-test p-values
-    result_dict = {'Variable': ["Participants"]}
-    for group in ['all'] + groups:
-        if group == 'all':
-            descriptive_stats(data, group, result_dict)
-            data.describe().to_csv(
-                str(out_dir / "demographics_all.csv"))
-        else:
-            descriptive_stats(data[data[split_by] == group], group,
-                              result_dict)
-
-    # Create a DataFrame with the results
-    result_df = pd.DataFrame(result_dict)
+    data.describe().to_csv(str(out_dir / "demographics_all.csv"))
     result_df.to_csv(str(out_dir / "demographics.csv"), index=False)
-
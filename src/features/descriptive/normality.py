@@ -1,102 +1,257 @@
 #!/usr/bin/env python
+"""
+Normality tests of every parameter per subgroup, in one batched pass.
+
+The parameters of every group of the ``split_by`` columns are spread into
+NaN-masked columns of one matrix, and the tests are computed for all its
+columns at once from the column moments and the sorted, standardised
+values: D'Agostino and Pearson's omnibus test, Anderson-Darling and
+Kolmogorov-Smirnov against the normal distribution with the sample mean and
+SD. Shapiro-Wilk has no closed form and is run per column, on the values
+already sorted. The results are written to one table, and the histogram and
+Q-Q figures are only drawn on request.
+"""
+
 import logging
+from pathlib import Path
 
 import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
 import scipy.stats as stats
 import statsmodels.api as sm
-from matplotlib.pyplot import text
+
+from visualization.render import render
 
 logger = logging.getLogger("BronchialParameters")
 
-def test(data, bps, out_path):
-
-    for param in bps:
-        for sex in data["sex"].unique():
-            var_name = param.replace("_", " ").title()
-            var_name += f" {sex}"
-            logger.info(f"Testing normality for {var_name}")
-
-            fig, axs = plt.subplots(2, 2, figsize=(12, 8))
-            fig.suptitle(var_name)
-
-            param_data = data[param].dropna()
-
-            # histogram
-            axs[0, 0].hist(param_data,
-                           bins=30,
-                           density=True,
-                           alpha=0.6,
-                           color='b')
-            axs[0, 0].set_title('Histogram')
-            axs[0, 0].set_xlabel('Data')
-            axs[0, 0].set_ylabel('Frequency')
-
-            # Q-Q plot
-            sm.qqplot(param_data, line='s', ax=axs[0, 1])
-            axs[0, 1].set_title("Q-Q plot")
-
-            # Anderson-Darling test
-            result = stats.anderson(param_data)
-            axs[1, 0].text(0.5,
-                           0.7,
-                           'Anderson-Darling test:',
-                           fontsize=12,
-                           ha='center',
-                           va='center',
-                           weight='bold')
-            axs[1, 0].text(
-                0.5,
-                0.4,
-                'Statistic: %.3f\n' % result.statistic + '\n'.join([
-                    f'{sl} : {cv}, data ' +
-                    ('does not look normal (reject H0)' if result.statistic > cv else
-                     'looks normal (fail to reject H0)') for sl, cv in zip(
-                         result.significance_level, result.critical_values)
-                ]),
-                fontsize=12,
-                ha='center',
-                va='center')
-            axs[1, 0].axis('off')
-
-            # Shapiro-Wilk test
-            result = stats.shapiro(param_data)
-            text(0.5,
-                 0.6,
-                 'Shapiro-Wilk test:',
-                 fontsize=12,
-                 ha='center',
-                 va='center',
-                 transform=axs[1, 1].transAxes,
-                 weight='bold')
-            text(0.5,
-                 0.5,
-                 'Statistics=%.3f, p=%.3f' % (result),
-                 fontsize=12,
-                 ha='center',
-                 va='center',
-                 transform=axs[1, 1].transAxes)
-            axs[1, 1].axis('off')
-
-            # Kolmogorov-Smirnov test
-            result = stats.kstest(param_data, 'norm')
-            text(0.5,
-                 0.4,
-                 'Kolmogorov-Smirnov test:',
-                 fontsize=12,
-                 ha='center',
-                 va='center',
-                 fontweight='bold',
-                 transform=axs[1, 1].transAxes)
-            text(0.5,
-                 0.3,
-                 'Statistics=%.3f, p=%.3f' % (result),
-                 fontsize=12,
-                 ha='center',
-                 va='center',
-                 transform=axs[1, 1].transAxes)
-            axs[1, 1].axis('off')
-
-            plt.subplots_adjust(hspace=0.4)
-            plt.savefig(str(out_path / f'{var_name}_{sex}_norm_test.png'), dpi=300)
-            plt.close()
-            logger.info(f"Done testing normality for {param}")
+SPLIT_BY = ["health_status", "sex"]
+# Significance levels of the Anderson-Darling critical values, in percent,
+# and the critical values for n -> inf, as scipy.stats.anderson
+AD_LEVELS = [15.0, 10.0, 5.0, 2.5, 1.0]
+AD_CRITICAL = np.array([0.576, 0.656, 0.787, 0.918, 1.092])
+
+
+def _by_group(data: pd.DataFrame, params: list, split_by: list):
+    """
+    The parameters of every group as their own columns, NaN outside the
+    group's rows.
+    """
+    # Grouping by a list of one key warns, its scalar groups become tuples
+    groups = data.groupby(split_by if len(split_by) > 1 else split_by[0],
+                          observed=True)
+    return pd.concat(
+        {
+            group if isinstance(group, tuple) else (group, ): rows[params]
+            for group, rows in groups
+        },
+        axis=1,
+        names=split_by + ["param"]).reindex(data.index)
+
+
+def _skewtest(skew: np.ndarray, n: np.ndarray) -> np.ndarray:
+    """Z score of the sample skewness, as scipy.stats.skewtest."""
+    y = skew * np.sqrt(((n + 1) * (n + 3)) / (6.0 * (n - 2)))
+    beta2 = (3.0 * (n**2 + 27 * n - 70) * (n + 1) * (n + 3)) / (
+        (n - 2.0) * (n + 5) * (n + 7) * (n + 9))
+    w2 = -1 + np.sqrt(2 * (beta2 - 1))
+    delta = 1 / np.sqrt(0.5 * np.log(w2))
+    alpha = np.sqrt(2.0 / (w2 - 1))
+    y = np.where(y == 0, 1, y)
+    return delta * np.log(y / alpha + np.sqrt((y / alpha)**2 + 1))
+
+
+def _kurtosistest(kurtosis: np.ndarray, n: np.ndarray) -> np.ndarray:
+    """
+    Z score of the sample (Pearson) kurtosis, as scipy.stats.kurtosistest.
+    """
+    mean = 3.0 * (n - 1) / (n + 1)
+    var = 24.0 * n * (n - 2) * (n - 3) / ((n + 1) * (n + 1.0) * (n + 3) *
+                                          (n + 5))
+    x = (kurtosis - mean) / np.sqrt(var)
+    sqrtbeta1 = 6.0 * (n * n - 5 * n + 2) / ((n + 7) * (n + 9)) * np.sqrt(
+        (6.0 * (n + 3) * (n + 5)) / (n * (n - 2) * (n - 3)))
+    a = 6.0 + 8.0 / sqrtbeta1 * (2.0 / sqrtbeta1 +
+                                 np.sqrt(1 + 4.0 / (sqrtbeta1**2)))
+    term1 = 1 - 2 / (9.0 * a)
+    denom = 1 + x * np.sqrt(2 / (a - 4.0))
+    term2 = np.sign(denom) * np.where(denom == 0.0, np.nan,
+                                      ((1 - 2.0 / a) / np.abs(denom))**(1 /
+                                                                        3.0))
+    return (term1 - term2) / np.sqrt(2 / (9.0 * a))
+
+
+def normality_stats(values: pd.DataFrame) -> pd.DataFrame:
+    """
+    Test every column of ``values`` for normality, on its present values.
+
+    The statistics match scipy's ``normaltest``, ``anderson``, ``shapiro``
+    and ``kstest`` against ``norm(mean, sd)`` column by column. The omnibus
+    test needs 8 values, Anderson-Darling 5, Shapiro-Wilk 3 and
+    Kolmogorov-Smirnov 2, columns with fewer get NaNs.
+
+    Parameters:
+    values (pd.DataFrame): The columns to test.
+
+    Returns:
+    pd.DataFrame: Indexed by the columns of ``values``, the "nobs", "mean",
+        "std", "skew" and excess "kurtosis", and the statistic and p-value
+        of each test. Anderson-Darling has no p-value, its critical value
+        at 5% is given instead.
+    """
+    block = values.to_numpy(dtype=float, na_value=np.nan)
+    n = (~np.isnan(block)).sum(axis=0).astype(float)
+    rows = np.arange(block.shape[0])[:, None]
+    valid = rows < n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.nanmean(block, axis=0)
+        centred = block - mean
+        m2, m3, m4 = (np.nanmean(centred**p, axis=0) for p in (2, 3, 4))
+        std = np.sqrt(m2 * n / (n - 1))
+        skew = m3 / m2**1.5
+        kurtosis = m4 / m2**2
+        omnibus = np.where(
+            n >= 8,
+            _skewtest(skew, n)**2 + _kurtosistest(kurtosis, n)**2, np.nan)
+
+        # Sorted standardised values, the missing ones sorted last
+        z = np.sort(centred, axis=0) / std
+        logcdf = stats.norm.logcdf(z)
+        logsf = stats.norm.logsf(z)
+        mirrored = np.take_along_axis(
+            logsf, np.clip(n.astype(int) - 1 - rows, 0, None), axis=0)
+        weights = (2 * rows + 1.0) / n
+        anderson = -n - np.where(valid, weights * (logcdf + mirrored),
+                                 0).sum(axis=0)
+        anderson_critical = np.round(
+            AD_CRITICAL[AD_LEVELS.index(5.0)] / (1.0 + 4.0 / n - 25.0 / n**2),
+            3)
+
+        cdf = np.exp(logcdf)
+        ks = np.maximum(
+            np.where(valid, (rows + 1) / n - cdf, -np.inf).max(axis=0),
+            np.where(valid, cdf - rows / n, -np.inf).max(axis=0))
+        ks_pvalue = np.where(n >= 2, stats.kstwo.sf(ks, np.maximum(n, 1)),
+                             np.nan)
+
+    shapiro = np.full((2, block.shape[1]), np.nan)
+    ordered = np.sort(block, axis=0)
+    for j in np.flatnonzero(n >= 3):
+        shapiro[:, j] = stats.shapiro(ordered[:int(n[j]), j])
+
+    return pd.DataFrame(
+        {
+            "nobs": n.astype(int),
+            "mean": mean,
+            "std": std,
+            "skew": skew,
+            "kurtosis": kurtosis - 3,
+            "normaltest_stat": omnibus,
+            "normaltest_pvalue": stats.chi2.sf(omnibus, 2),
+            "shapiro_stat": shapiro[0],
+            "shapiro_pvalue": shapiro[1],
+            "anderson_stat": np.where(n >= 5, anderson, np.nan),
+            "anderson_critical_5": np.where(n >= 5, anderson_critical,
+                                            np.nan),
+            "ks_stat": np.where(n >= 2, ks, np.nan),
+            "ks_pvalue": ks_pvalue,
+        },
+        index=values.columns)
+
+
+def test(data: pd.DataFrame,
+         bps: list,
+         out_path: Path,
+         split_by: list = None,
+         plots: bool = False) -> pd.DataFrame:
+    """
+    Test the normality of every parameter per subgroup and write the
+    results to "normality.csv".
+
+    Parameters:
+    data (pd.DataFrame): The parameters and the ``split_by`` columns.
+    bps (list): The parameters to test.
+    out_path (Path): The output directory.
+    split_by (list): The columns defining the subgroups, by default
+        "health_status" and "sex", those of them in ``data``.
+    plots (bool): Also draw the histogram and Q-Q plot of every test, to
+        the "normality" directory.
+
+    Returns:
+    pd.DataFrame: The results, indexed by ("param", *split_by).
+    """
+    if split_by is None:
+        split_by = [col for col in SPLIT_BY if col in data.columns]
+    data = data.dropna(subset=split_by)
+    logger.info(f"Testing normality of {len(bps)} parameters per "
+                f"{', '.join(split_by)}")
+    columns = _by_group(data, bps, split_by)
+    results = normality_stats(columns).reorder_levels(["param", *split_by])
+    results = results.reindex(bps, level="param")
+    out_path.mkdir(parents=True, exist_ok=True)
+    results.round(4).to_csv(out_path / "normality.csv")
+
+    if plots:
+        plot_path = out_path / "normality"
+        plot_path.mkdir(parents=True, exist_ok=True)
+
+        def jobs():
+            for key, result in results.iterrows():
+                param, groups = key[0], key[1:]
+                title = " ".join([param.replace("_", " ").title(),
+                                  *map(str, groups)])
+                yield (plot_path / f"{'_'.join(map(str, key))}_norm_test.png",
+                       plot_normality,
+                       (columns[(*groups, param)].dropna().to_frame(),
+                        result.to_frame().T, title))
+
+        render(jobs(), total=len(results), desc="normality")
+    return results
+
+
+def plot_normality(values: pd.DataFrame, result: pd.DataFrame, title: str,
+                   path: Path):
+    """
+    Plot the histogram and Q-Q plot of a parameter, with its test results.
+
+    Parameters:
+    values (pd.DataFrame): The values tested, in one column.
+    result (pd.DataFrame): The row of ``normality_stats`` of the values.
+    title (str): The figure title.
+    path (Path): The figure file.
+    """
+    values = values.iloc[:, 0]
+    result = result.iloc[0]
+    fig, axs = plt.subplots(2, 2, figsize=(12, 8))
+    fig.suptitle(title)
+
+    axs[0, 0].hist(values, bins=30, density=True, alpha=0.6, color='b')
+    axs[0, 0].set_title('Histogram')
+    axs[0, 0].set_xlabel('Data')
+    axs[0, 0].set_ylabel('Frequency')
+
+    sm.qqplot(values, line='s', ax=axs[0, 1])
+    axs[0, 1].set_title("Q-Q plot")
+
+    tests = [
+        ("Anderson-Darling test",
+         "Statistic=%.3f, 5%% critical value=%.3f" %
+         (result.anderson_stat, result.anderson_critical_5)),
+        ("Shapiro-Wilk test", "Statistics=%.3f, p=%.3f" %
+         (result.shapiro_stat, result.shapiro_pvalue)),
+        ("Kolmogorov-Smirnov test",
+         "Statistics=%.3f, p=%.3f" % (result.ks_stat, result.ks_pvalue)),
+        ("D'Agostino-Pearson test", "Statistics=%.3f, p=%.3f" %
+         (result.normaltest_stat, result.normaltest_pvalue)),
+    ]
+    for ax, pair in zip(axs[1], [tests[:2], tests[2:]]):
+        for i, (name, text) in enumerate(pair):
+            ax.text(0.5, 0.8 - 0.4 * i, name + ":", fontsize=12,
+                    ha='center', va='center', weight='bold')
+            ax.text(0.5, 0.65 - 0.4 * i, text, fontsize=12, ha='center',
+                    va='center')
+        ax.axis('off')
+
+    plt.subplots_adjust(hspace=0.4)
+    fig.savefig(path, dpi=300)
+    plt.close(fig)
@@ -1,8 +1,31 @@
 #!/usr/bin/env python
 
+import argparse
 from pathlib import Path
 import pandas as pd
 
+from data.util.quantiles import group_quantiles
+from data.util.schema import widen_floats
+from data.util.sketch import COMPRESSION, GroupSketches
+from data.util.store import iter_frames
+
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9, 0.95]
+
+
+def _write_table(quantiles: pd.DataFrame, counts: pd.DataFrame, sexes: list,
+                 bps: list, out_path: Path):
+    """
+    Write the reference table from the quantiles and counts per (sex, group).
+    """
+    ref_dfs = {}
+    for sex in sexes:
+        ref_vals = quantiles.xs(sex, level="sex").unstack()
+        ref_vals[sex] = counts.xs(sex, level="sex")[bps[0]]
+        ref_dfs[sex] = ref_vals.T.round(3)
+
+    ref_df = pd.concat(ref_dfs.values())
+    ref_df.to_csv(str(out_path / 'reference_table.csv'))
+
 
 def create_table(data: pd.DataFrame, bps: list, out_path: Path, group_by: str):
     """
@@ -20,15 +43,112 @@ def create_table(data: pd.DataFrame, bps: list, out_path: Path, group_by: str):
     Raises:
     None
     """
-    ref_dfs = {}
+    # Every quantile of every (sex, group) from a single sort of each group
+    quantiles = group_quantiles(data, bps, ["sex", group_by], QUANTILES)
+    counts = data.groupby(["sex", group_by])[bps].count()
+    _write_table(quantiles, counts, data.sex.dropna().unique(), bps, out_path)
 
-    for sex in data.sex.unique():
-        sex_data = data.groupby("sex").get_group(sex)
-        ref_vals = sex_data.groupby(group_by)[bps].quantile(
-            [0.1, 0.25, 0.5, 0.75, 0.9, 0.95])
-        ref_vals = ref_vals.unstack()
-        ref_vals[sex] = sex_data.groupby(group_by)[bps[0]].count()
-        ref_dfs[sex] = ref_vals.T.round(3)
 
-    ref_df = pd.concat(ref_dfs.values())
-    ref_df.to_csv(str(out_path / 'reference_table.csv'))
+def sketch_table(sketches: GroupSketches, out_path: Path):
+    """
+    Create the reference table from quantile sketches by sex and group.
+
+    The quantiles are estimates, exact for groups of up to
+    ``sketch.BUFFER`` times the compression participants.
+
+    Parameters:
+    sketches (GroupSketches): Sketches by ``["sex", group_by]``.
+    out_path (Path): Path of the output reference table csv file.
+    """
+    counts = sketches.counts()
+    sexes = [sex for sex in counts.index.unique("sex")
+             if counts.xs(sex, level="sex").to_numpy().any()]
+    _write_table(sketches.quantiles(QUANTILES), counts, sexes,
+                 sketches.params, out_path)
+
+
+def sketch_files(in_files: list,
+                 bps: list,
+                 group_by: str,
+                 pack_years: float = None,
+                 sketches: GroupSketches = None,
+                 compression: float = COMPRESSION,
+                 chunk_rows: int = 2**16) -> GroupSketches:
+    """
+    Sketch the quantiles of processed datasets read chunk by chunk.
+
+    Parameters:
+    in_files (list): Processed datasets, e.g. monthly exports.
+    bps (list): The columns to sketch.
+    group_by (str): The grouping column besides sex.
+    pack_years (float): Minimum pack years, None keeps everyone.
+    sketches (GroupSketches): Earlier sketches to add the files to.
+    compression (float): Accuracy of new sketches.
+    chunk_rows (int): Rows read at once.
+
+    Returns:
+    GroupSketches: The sketches of all the data.
+    """
+    by = ["sex", group_by]
+    if sketches is None:
+        sketches = GroupSketches(bps, by, compression)
+    filters = None if pack_years is None else [("pack_years", ">=",
+                                                pack_years)]
+    for in_file in in_files:
+        for chunk in iter_frames(in_file,
+                                 columns=by + bps,
+                                 filters=filters,
+                                 index_col=0,
+                                 chunk_rows=chunk_rows):
+            # As analysed, the schema stores bps as float32
+            sketches.update(widen_floats(chunk))
+    return sketches
+
+
+def main(args):
+    bps = args.param_list.split(",")
+    by = ["sex", args.group_by]
+    sketches = None
+    if args.sketch is not None and args.sketch.exists():
+        sketches = GroupSketches.load(args.sketch, bps, by, args.compression)
+    sketches = sketch_files(args.in_files, bps, args.group_by,
+                            args.pack_years, sketches, args.compression,
+                            args.chunk_rows)
+    if args.sketch is not None:
+        sketches.save(args.sketch)
+    args.out_path.mkdir(parents=True, exist_ok=True)
+    sketch_table(sketches, args.out_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reference values from datasets too large for memory, "
+        "from mergeable quantile sketches.")
+    parser.add_argument("in_files",
+                        nargs="*",
+                        type=Path,
+                        help="Processed datasets to add, read in chunks.")
+    parser.add_argument("out_path",
+                        type=Path,
+                        help="Directory of the reference table.")
+    parser.add_argument("--param_list",
+                        type=str,
+                        default="bp_pi10,bp_wt_avg,bp_la_avg,bp_wap_avg",
+                        help="Comma separated parameters.")
+    parser.add_argument("--group_by", type=str, default="age_5yr")
+    parser.add_argument("--pack_years",
+                        type=float,
+                        default=None,
+                        help="Minimum pack years, all participants if unset.")
+    parser.add_argument("--sketch",
+                        type=Path,
+                        default=None,
+                        help="Saved sketches to add the datasets to, and "
+                        "to update (e.g. sketches.parquet).")
+    parser.add_argument("--compression",
+                        type=float,
+                        default=COMPRESSION,
+                        help="Sketch accuracy, about twice the centroids "
+                        "kept per group and parameter.")
+    parser.add_argument("--chunk_rows", type=int, default=2**16)
+    main(parser.parse_args())
@@ -1,118 +1,63 @@
 #!/usr/bin/env python
-from pathlib import Path
-import sys
+"""
+Test the normality of the parameters per health status and sex.
+
+Loads the processed dataset once, with only the parameters and the columns
+defining the subgroups, and runs the normality tests of all parameters in
+process, writing "normality.csv" to the output directory.
+"""
+import argparse
 import logging
+import logging.config
+from pathlib import Path
 
-import matplotlib.pyplot as plt
-import pandas as pd
-import scipy.stats as stats
-import statsmodels.api as sm
-from matplotlib.pyplot import text
-
-from src.data.subgroup import get_healthy
-
-
-df = pd.read_csv(sys.stdin)
-df_healthy = get_healthy(df)
-df_unhealthy = df[(df.GOLD_stage != "0") & (df.copd_diagnosis == 1) &
-                  (df.asthma_diagnosis == 1)]
-df_male_h = df_healthy[df_healthy.sex == "Male"]
-df_female_h = df_healthy[df_healthy.sex == "Female"]
-df_male_u = df_unhealthy[df_unhealthy.sex == "Male"]
-df_female_u = df_unhealthy[df_unhealthy.sex == "Female"]
-
-
-def run_test(data, male: bool = True, healthy: bool = True):
-    sex_title = "Male" if male else "Female"
-    health_title = "Healthy" if healthy else "Non-Healthy"
-    var_name = data.columns[0].replace("_", " ").title()
-    var_name += f" {health_title} {sex_title}"
-    logging.info(f"Testing normality for {var_name}")
-
-    fig, axs = plt.subplots(2, 2, figsize=(12, 8))
-    fig.suptitle(var_name)
-    # histogram
-    axs[0, 0].hist(data.iloc[:, 0],
-                   bins=30,
-                   density=True,
-                   alpha=0.6,
-                   color='b')
-    axs[0, 0].set_title('Histogram')
-    axs[0, 0].set_xlabel('Data')
-    axs[0, 0].set_ylabel('Frequency')
-
-    # Q-Q plot
-    sm.qqplot(data.iloc[:, 0], line='s', ax=axs[0, 1])
-    axs[0, 1].set_title("Q-Q plot")
-
-    # Anderson-Darling test
-    result = stats.anderson(data.iloc[:, 0])
-    axs[1, 0].text(0.5,
-                   0.7,
-                   'Anderson-Darling test:',
-                   fontsize=12,
-                   ha='center',
-                   va='center',
-                   weight='bold')
-    axs[1, 0].text(
-        0.5,
-        0.4,
-        'Statistic: %.3f\n' % result.statistic + '\n'.join([
-            f'{sl} : {cv}, data ' +
-            ('does not look normal (reject H0)' if result.statistic > cv else
-             'looks normal (fail to reject H0)') for sl, cv in zip(
-                 result.significance_level, result.critical_values)
-        ]),
-        fontsize=12,
-        ha='center',
-        va='center')
-    axs[1, 0].axis('off')
-
-    # Shapiro-Wilk test
-    result = stats.shapiro(data.iloc[:, 0])
-    text(0.5,
-         0.6,
-         'Shapiro-Wilk test:',
-         fontsize=12,
-         ha='center',
-         va='center',
-         transform=axs[1, 1].transAxes,
-         weight='bold')
-    text(0.5,
-         0.5,
-         'Statistics=%.3f, p=%.3f' % (result),
-         fontsize=12,
-         ha='center',
-         va='center',
-         transform=axs[1, 1].transAxes)
-    axs[1, 1].axis('off')
-
-    # Kolmogorov-Smirnov test
-    result = stats.kstest(data.iloc[:, 0], 'norm')
-    text(0.5,
-         0.4,
-         'Kolmogorov-Smirnov test:',
-         fontsize=12,
-         ha='center',
-         va='center',
-         fontweight='bold',
-         transform=axs[1, 1].transAxes)
-    text(0.5,
-         0.3,
-         'Statistics=%.3f, p=%.3f' % (result),
-         fontsize=12,
-         ha='center',
-         va='center',
-         transform=axs[1, 1].transAxes)
-    axs[1, 1].axis('off')
-
-    plt.subplots_adjust(hspace=0.4)
-    plt.savefig(str(output_dir / f'{var_name}_norm_test.png'), dpi=300)
-    plt.close()
-    logging.info("Done testing normality")
-
-
-run_test(df_male_h, True, True)
-run_test(df_female_h, False, True)
-run_test(df_male_u, True, False)
-run_test(df_female_u, False, False)
+from data.util.dataframe import get_group
+from data.util.schema import widen_floats
+from data.util.store import read_frame
+from features.descriptive import normality
+
+GROUP_COLUMNS = [
+    "sex", "GOLD_stage", "copd_diagnosis", "asthma_diagnosis", "cancer_type"
+]
+
+src_dir = Path(__file__).resolve().parents[2]
+logging.config.fileConfig(src_dir / "logging.conf")
+logger = logging.getLogger("BronchialParameters")
+
+
+def main(args):
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    params = args.param_list.split(",")
+    columns = GROUP_COLUMNS + [col for col in params if col not in
+                               GROUP_COLUMNS]
+    data = widen_floats(read_frame(args.in_file, columns=columns,
+                                   index_col=0))
+    logger.info(f"Loaded {len(data)} participants")
+    data = get_group(data, "all")
+    normality.test(data, params, Path(args.out_directory), plots=args.plots)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Test the parameters for normality.")
+    parser.add_argument("in_file",
+                        type=str,
+                        help="Input database (.parquet, .feather or .csv).")
+    parser.add_argument("out_directory",
+                        type=str,
+                        help="Output report destination.")
+    parser.add_argument(
+        "--param_list",
+        type=str,
+        default="bp_pi10,bp_wt_avg,bp_la_avg,bp_wap_avg",
+        help="Comma separated list of params to test.",
+    )
+    parser.add_argument("--plots",
+                        action="store_true",
+                        help="Also draw the histogram and Q-Q plot of "
+                        "every test.")
+    parser.add_argument("--debug", action="store_true", help="Debug mode.")
+    args = parser.parse_args()
+    main(args)
@@ -2,17 +2,19 @@ SHELL := bash
 .ONESHELL:
 .SHELLFLAGS := -eu -o pipefail -c
 
-.PHONY: all clean
+.PHONY: all table hist
 
-comma:=,
-P_LIST := $(subst $(comma), , $(PARAMS)) pack_years
+P_LIST := $(PARAMS),pack_years
+NORM_REPORTS := ./reports/normality
 # CONDA_ACTIVATE=source $$(conda info --base)/etc/profile.d/conda.sh ; conda activate ; conda activate
 
 all: hist
 
+## Test all parameters, in one process loading the dataset once
+table: $(BP_FINAL)
+	./src/features/descriptive/test_normality.py $< $(NORM_REPORTS) --param_list $(P_LIST)
+
+## Also draw the histogram and Q-Q plot of every test
 hist: $(BP_FINAL)
 	# $(CONDA_ACTIVATE) stats
-	for col in $(P_LIST); do \
-		echo $$col
-		csvcut -c "$$col,sex,GOLD_stage,copd_diagnosis,asthma_diagnosis,cancer_type" $< | python ./src/features/descriptive/test_normality.py ; \
-	done
+	./src/features/descriptive/test_normality.py $< $(NORM_REPORTS) --param_list $(P_LIST) --plots
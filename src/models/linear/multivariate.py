@@ -2,70 +2,59 @@
 
 import logging
 import pandas as pd
-import statsmodels.api as sm
+
+from data.util.dataframe import min_max_scale
+from models.linear import ols
 
 logger = logging.getLogger("BronchialParameters")
 
 
 def fit_analyse(data, bps, out_path, min_max_params=False):
+    # Relabel in a shallow copy, the caller's data is shared
+    data = data.copy(deep=False)
     data["pack_year_categories"] = data["pack_year_categories"].replace(
         "0", "0 pack-years"
     )
     spirometry = ["fev1", "fev1_pp", "fev1_fvc", "fvc"]
+    # Extract independent variables
+    independent_vars = [
+        "sex",
+        "age",
+        "height",
+        "weight",
+        "pack_year_categories"
+    ]
+
+    # Normalising the data
+    if min_max_params:
+        numeric = [
+            var for var in independent_vars
+            if data[var].dtype == int or data[var].dtype == float
+        ]
+        data = min_max_scale(data, numeric + spirometry)
+
+    # Fit the models without and with each parameter for every spirometry
+    # outcome, sharing the covariate design between all of them
+    design = ols.base_design(data, independent_vars)
+    fits = ols.fit_nested(data, design, spirometry, bps, summaries=True)
 
     results = {}
-
-    # Perform multivariate linear regression for each dependent variable
-    for param in bps:
-        for func in spirometry:
-            # Extract independent variables
-            independent_vars = [
-                "sex",
-                "age",
-                "height",
-                "weight",
-                "pack_year_categories"
-            ]
-
-            # Normalising the data
-            if min_max_params:
-                for var in independent_vars:
-                    if data[var].dtype == int or data[var].dtype == float:
-                        data[var] = (data[var] - data[var].min()) / (
-                            data[var].max() - data[var].min()
-                        )
-                data[func] = (data[func] - data[func].min()) / (
-                    data[func].max() - data[func].min()
-                )
-                output_file = out_path / f"multivariate_report_{param}_{func}_normalised.txt"
-            else:
-                output_file = out_path / f"multivariate_report_{param}_{func}.txt"
-
-            # Create formula for the model
-            formula = func + " ~ " + " + ".join(independent_vars)
-
-            # Fit the model and print the results
-            model_init = sm.formula.ols(formula=formula, data=data).fit()
-            logger.debug(model_init.summary())
-            formula = func + " ~ " + " + ".join(independent_vars + [param])
-            model = sm.formula.ols(formula=formula, data=data).fit()
-            logger.debug(model.summary())
-
-            # Add the change in R2, AIC and BIC to the dataframe
-            rsq_change = model.rsquared_adj - model_init.rsquared_adj
-            aic_change = model.aic - model_init.aic
-            bic_change = model.bic - model_init.bic
-
-            # Save the results to a dictionary
-            results[(param, func)] = {
-                "rsq_change": rsq_change,
-                "aic_change": aic_change,
-                "bic_change": bic_change,
-            }
-
-            # Save the results to a text file
-            with open(output_file, "w") as f:
-                f.write(str(model.summary()))
+    for (param, func), fit in fits.iterrows():
+        # Add the change in R2, AIC and BIC to the dataframe
+        results[(param, func)] = {
+            "rsq_change": fit.rsquared_adj - fit.rsquared_adj_base,
+            "aic_change": fit.aic - fit.aic_base,
+            "bic_change": fit.bic - fit.bic_base,
+        }
+
+        # Save the results to a text file
+        if min_max_params:
+            output_file = out_path / f"multivariate_report_{param}_{func}_normalised.txt"
+        else:
+            output_file = out_path / f"multivariate_report_{param}_{func}.txt"
+        logger.debug(fit.summary)
+        with open(output_file, "w") as f:
+            f.write(fit.summary)
 
     df_results = pd.DataFrame(results)
     df_results.round(4)
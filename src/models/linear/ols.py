@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Batched ordinary least squares.
+
+``simple_fits`` regresses every column of a frame on one variable at once
+from closed forms, and ``masked_simple_fits`` does so on many subsets of the
+rows, from sums over all the subsets taken in one matrix product.
+
+``fit_nested`` fits, for every outcome, a base model on a fixed set of
+covariates and, for every parameter, the full model with that parameter
+added, giving the same statistics as fitting each pair with
+``sm.formula.ols``. The covariate design matrix is built once. Models fitted
+on the same rows share one QR factorisation of it: the outcomes and
+parameters are projected onto its orthogonal complement together, and each
+full model is the rank-one column update of its base model by the residual
+of the parameter.
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+import patsy
+import statsmodels.api as sm
+from scipy import stats
+from scipy.linalg import solve_triangular
+from statsmodels.regression.linear_model import (OLSResults,
+                                                 RegressionResultsWrapper)
+
+logger = logging.getLogger("BronchialParameters")
+
+STATS = ["nobs", "rsquared", "rsquared_adj", "aic", "bic"]
+
+
+def simple_fits(x: pd.Series,
+                Y: pd.DataFrame,
+                block: int = 256) -> pd.DataFrame:
+    """
+    Regress every column of ``Y`` on ``x``, with an intercept.
+
+    Each column is fitted on the rows where both it and ``x`` are present,
+    as ``sm.OLS`` after dropping missing values, using the closed forms of
+    simple regression on centred sums. Columns are processed in blocks of
+    ``block`` to bound the memory of the masked copies.
+
+    Parameters:
+    x (pd.Series): The independent variable.
+    Y (pd.DataFrame): The dependent variables, indexed like ``x``.
+    block (int): Columns per block.
+
+    Returns:
+    pd.DataFrame: Indexed by the columns of ``Y``, the "nobs", "pearson"
+        correlation, "intercept", "slope", "rsquared", "fvalue",
+        "f_pvalue" and slope "pvalue" of each fit.
+    """
+    x = x.to_numpy(dtype=float)
+    blocks = []
+    for start in range(0, Y.shape[1], block):
+        y = Y.iloc[:, start:start + block].to_numpy(dtype=float)
+        mask = ~np.isnan(y) & ~np.isnan(x)[:, None]
+        nobs = mask.sum(axis=0)
+        xs = np.where(mask, x[:, None], 0.0)
+        ys = np.where(mask, y, 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_mean = xs.sum(axis=0) / nobs
+            y_mean = ys.sum(axis=0) / nobs
+            xs = np.where(mask, xs - x_mean, 0.0)
+            ys = np.where(mask, ys - y_mean, 0.0)
+            sxx = np.einsum("ij,ij->j", xs, xs)
+            syy = np.einsum("ij,ij->j", ys, ys)
+            sxy = np.einsum("ij,ij->j", xs, ys)
+        blocks.append(
+            pd.DataFrame(_simple_stats(nobs, x_mean, y_mean, sxx, syy, sxy),
+                         index=Y.columns[start:start + block]))
+    return pd.concat(blocks)
+
+
+def _simple_stats(nobs, x_mean, y_mean, sxx, syy, sxy) -> dict:
+    """
+    The statistics of simple regressions from their means and centred sums
+    of squares and products.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = sxy / sxx
+        ssr = syy - slope * sxy
+        df_resid = nobs - 2
+        fvalue = (syy - ssr) / (ssr / df_resid)
+        tvalue = slope / np.sqrt(ssr / df_resid / sxx)
+        return {
+            "nobs": nobs,
+            "pearson": np.clip(sxy / np.sqrt(sxx * syy), -1, 1),
+            "intercept": y_mean - slope * x_mean,
+            "slope": slope,
+            "rsquared": 1 - ssr / syy,
+            "fvalue": fvalue,
+            "f_pvalue": stats.f.sf(fvalue, 1, df_resid),
+            "pvalue": 2 * stats.t.sf(np.abs(tvalue), df_resid),
+        }
+
+
+def masked_simple_fits(x: pd.Series, Y: pd.DataFrame,
+                       masks: pd.DataFrame) -> pd.DataFrame:
+    """
+    Regress every column of ``Y`` on ``x`` within every subset of the rows,
+    as ``simple_fits`` on each subset.
+
+    The sufficient statistics of all fits, the counts, sums, sums of squares
+    and products of the present pairs, are the products of the masks with
+    the values, so all subsets share one pass over the data. The values are
+    shifted by their means first, which keeps the sums well conditioned.
+
+    Parameters:
+    x (pd.Series): The independent variable.
+    Y (pd.DataFrame): The dependent variables, indexed like ``x``.
+    masks (pd.DataFrame): Boolean columns selecting the rows of each
+        subset, indexed like ``x``.
+
+    Returns:
+    pd.DataFrame: Indexed by the mask columns and the columns of ``Y``, the
+        statistics of ``simple_fits``.
+    """
+    x = x.to_numpy(dtype=float)
+    y = Y.to_numpy(dtype=float)
+    present = ~np.isnan(y) & ~np.isnan(x)[:, None]
+    x_shift, y_shift = np.nanmean(x), np.nanmean(y, axis=0)
+    xs = np.where(present, x[:, None] - x_shift, 0.0)
+    ys = np.where(present, y - y_shift, 0.0)
+    M = masks.to_numpy(dtype=float).T
+    k = y.shape[1]
+    sums = M @ np.hstack([present, xs, ys, xs * xs, ys * ys, xs * ys])
+    nobs, sx, sy, sxx, syy, sxy = (sums[:, i * k:(i + 1) * k]
+                                   for i in range(6))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_mean, y_mean = sx / nobs, sy / nobs
+        fits = _simple_stats(nobs.astype(int), x_mean + x_shift,
+                             y_mean + y_shift, sxx - sx * x_mean,
+                             syy - sy * y_mean, sxy - sx * y_mean)
+    index = pd.MultiIndex.from_tuples(
+        [(*(mask if isinstance(mask, tuple) else (mask, )), col)
+         for mask in masks.columns for col in Y.columns],
+        names=[*masks.columns.names, *Y.columns.names])
+    return pd.DataFrame({name: np.ravel(value)
+                         for name, value in fits.items()},
+                        index=index)
+
+
+def base_design(data: pd.DataFrame, covariates: list) -> pd.DataFrame:
+    """
+    Build the design matrix of the covariates, with an intercept.
+
+    The columns and their names are those statsmodels formulas produce, the
+    rows with a missing covariate are kept as NaN so the design can be
+    reused with the missing values of each model.
+
+    Parameters:
+    data (pd.DataFrame): The data to model.
+    covariates (list): The covariates of every model.
+
+    Returns:
+    pd.DataFrame: The design matrix, indexed like ``data``.
+    """
+    design = patsy.dmatrix(" + ".join(covariates),
+                           data,
+                           NA_action="drop",
+                           return_type="dataframe")
+    return design.reindex(data.index)
+
+
+def _stats(ssr: float, y: np.ndarray, rank: int) -> dict:
+    """The statistics of an OLS fit with an intercept, as in statsmodels."""
+    nobs = len(y)
+    rsquared = 1 - ssr / np.sum((y - y.mean())**2)
+    llf = -nobs / 2 * (np.log(2 * np.pi) + np.log(ssr / nobs) + 1)
+    return {
+        "nobs": nobs,
+        "rsquared": rsquared,
+        "rsquared_adj": 1 - (nobs - 1) / (nobs - rank) * (1 - rsquared),
+        "aic": -2 * llf + 2 * rank,
+        "bic": -2 * llf + np.log(nobs) * rank,
+    }
+
+
+def _factorise(X: np.ndarray):
+    """
+    QR factorisation of a design, None if it is not of full column rank.
+
+    The rank tolerance is that of ``np.linalg.matrix_rank``.
+    """
+    Q, R = np.linalg.qr(X)
+    diag = np.abs(np.diag(R))
+    if diag.min() <= diag.max() * max(X.shape) * np.finfo(float).eps:
+        return None
+    return Q, R
+
+
+def _fallback(y: pd.Series, Z: pd.DataFrame):
+    """Fit one model with statsmodels, which handles rank deficiency."""
+    logger.debug(f"Rank deficient design for {y.name}, fitting with pinv")
+    return sm.OLS(y, Z).fit()
+
+
+def _results(y: pd.Series, Z: pd.DataFrame, params: np.ndarray,
+             R: np.ndarray):
+    """
+    Wrap a fit as statsmodels results, e.g. for its summary.
+
+    ``R`` is the triangular factor of ``Z``, giving the covariance of the
+    parameters without refitting.
+    """
+    model = sm.OLS(y, Z)
+    model.rank = Z.shape[1]
+    R_inv = solve_triangular(R, np.eye(len(R)))
+    results = OLSResults(model,
+                         pd.Series(params, index=Z.columns),
+                         normalized_cov_params=pd.DataFrame(
+                             R_inv @ R_inv.T,
+                             index=Z.columns,
+                             columns=Z.columns))
+    return RegressionResultsWrapper(results)
+
+
+def _groups(masks: dict) -> list:
+    """Group the keys of boolean row masks by identical masks."""
+    groups = {}
+    for key, mask in masks.items():
+        groups.setdefault(mask.tobytes(), (mask, []))[1].append(key)
+    return list(groups.values())
+
+
+def fit_nested(data: pd.DataFrame,
+               design: pd.DataFrame,
+               outcomes: list,
+               params: list,
+               summaries: bool = False) -> pd.DataFrame:
+    """
+    Fit the base and full models of every (param, outcome) pair.
+
+    As with ``sm.formula.ols``, each model drops the rows missing any of its
+    variables, so the base model of an outcome and its full models with the
+    different parameters may be fitted on different participants.
+
+    Parameters:
+    data (pd.DataFrame): The outcomes and parameters.
+    design (pd.DataFrame): The covariates, from ``base_design``.
+    outcomes (list): The dependent variables.
+    params (list): The parameters added in turn to the base models.
+    summaries (bool): Add the statsmodels summary of each full model.
+
+    Returns:
+    pd.DataFrame: Indexed by (param, outcome), the ``STATS`` of the full
+        models, the same suffixed with "_base" for the base models, and the
+        "summary" text if requested.
+    """
+    X_all = design.to_numpy()
+    complete = ~np.isnan(X_all).any(axis=1)
+    Y_all = data[outcomes].to_numpy(dtype=float)
+    P_all = data[params].to_numpy(dtype=float)
+    k = X_all.shape[1]
+    columns = list(design.columns)
+
+    # Base models, one factorisation per distinct set of rows
+    base = {}
+    base_masks = {
+        j: complete & ~np.isnan(Y_all[:, j])
+        for j in range(len(outcomes))
+    }
+    for mask, js in _groups(base_masks):
+        X = X_all[mask]
+        factors = _factorise(X)
+        for j in js:
+            y = Y_all[mask, j]
+            if factors is None:
+                fit = _fallback(pd.Series(y, name=outcomes[j]),
+                                pd.DataFrame(X, columns=columns))
+                base[j] = _stats(fit.ssr, y, fit.model.rank)
+            else:
+                Q, _ = factors
+                resid = y - Q @ (Q.T @ y)
+                base[j] = _stats(resid @ resid, y, k)
+
+    # Full models, grouped by rows. The outcomes and parameters are
+    # residualised on the covariates once per group, each pair then only
+    # needs the rank-one update of its base model.
+    full = {}
+    pair_masks = {(i, j): base_masks[j] & ~np.isnan(P_all[:, i])
+                  for i in range(len(params))
+                  for j in range(len(outcomes))}
+    for mask, pairs in _groups(pair_masks):
+        X = X_all[mask]
+        factors = _factorise(X)
+        i_s = sorted({i for i, _ in pairs})
+        j_s = sorted({j for _, j in pairs})
+        if factors is not None:
+            Q, R = factors
+            Y, P = Y_all[mask][:, j_s], P_all[mask][:, i_s]
+            QtY, QtP = Q.T @ Y, Q.T @ P
+            resid_Y, resid_P = Y - Q @ QtY, P - Q @ QtP
+        for i, j in pairs:
+            y, p = Y_all[mask, j], P_all[mask, i]
+            Z = pd.DataFrame(np.column_stack([X, p]),
+                             columns=columns + [params[i]])
+            y_named = pd.Series(y, name=outcomes[j])
+            ii, jj = i_s.index(i), j_s.index(j)
+            norm = (np.linalg.norm(resid_P[:, ii])
+                    if factors is not None else 0)
+            if norm <= np.linalg.norm(p) * len(p) * np.finfo(float).eps:
+                fit = _fallback(y_named, Z)
+                full[(i, j)] = _stats(fit.ssr, y, fit.model.rank)
+                if summaries:
+                    full[(i, j)]["summary"] = str(fit.summary())
+                continue
+
+            # Coefficient of the parameter from the residuals, then the
+            # covariates' from the base factorisation
+            coef = (resid_P[:, ii] @ resid_Y[:, jj]) / norm**2
+            resid = resid_Y[:, jj] - coef * resid_P[:, ii]
+            full[(i, j)] = _stats(resid @ resid, y, k + 1)
+            if summaries:
+                beta = solve_triangular(R, QtY[:, jj] - coef * QtP[:, ii])
+                R_full = np.zeros((k + 1, k + 1))
+                R_full[:k, :k] = R
+                R_full[:k, k] = QtP[:, ii]
+                R_full[k, k] = norm
+                fit = _results(y_named, Z, np.append(beta, coef), R_full)
+                full[(i, j)]["summary"] = str(fit.summary())
+
+    rows = []
+    for i, param in enumerate(params):
+        for j, outcome in enumerate(outcomes):
+            row = {"param": param, "outcome": outcome, **full[(i, j)]}
+            row.update({f"{s}_base": base[j][s] for s in STATS})
+            rows.append(row)
+    return pd.DataFrame(rows).set_index(["param", "outcome"])
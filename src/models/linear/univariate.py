@@ -3,9 +3,9 @@
 import logging
 from pathlib import Path
 import pandas as pd
-from scipy.stats import pearsonr
-import statsmodels.api as sm
+from data.util import bootstrap
 from data.util.dataframe import min_max_scale
+from models.linear import ols
 
 
 logger = logging.getLogger("BronchialParameters")
@@ -14,7 +14,8 @@ def fit_analyse(data: pd.DataFrame,
                 bps: list,
                 i_var: str,
                 out_path: Path,
-                min_max_params: bool = False):
+                min_max_params: bool = False,
+                n_boot: int = bootstrap.N_BOOT):
     """
     This function performs univariate analysis on a given data frame.
 
@@ -23,6 +24,7 @@ def fit_analyse(data: pd.DataFrame,
     bps (list): A list of parameters to loop through and calculate Pearson's cc and R-squared.
     i_var (str): The independent variable to calculate correlation against.
     out_path (Path): The output file path where the results will be saved in CSV format.
+    n_boot (int): Resamples of the bootstrap interval of the slopes, 0 leaves it out.
 
     Returns:
     None
@@ -37,29 +39,38 @@ def fit_analyse(data: pd.DataFrame,
         data = min_max_scale(data, [i_var] + bps)
 
     for sex in ["Male", "Female"]:
-        sex_data = data[data["sex"] == sex].copy()
+        sex_data = data[data["sex"] == sex]
 
-        # Loop parameters and calculate Pearson's cc and R-squared
-        for param in bps:
-            data_param = sex_data.dropna(subset=[param, i_var])
-            logger.debug(f"Calculating {param} wrt {i_var} for {sex}")
-            X = data_param[i_var].to_numpy()
-            y = data_param[param].to_numpy()
-            pearson, _ = pearsonr(X, y)
-            model = sm.OLS(y, sm.add_constant(X)).fit()
-            rsquared = model.rsquared
-            pval = round(model.pvalues[1], 4)
+        # Pearson's cc and the regression of every parameter at once, each
+        # on its own non-missing rows
+        logger.debug(f"Calculating {bps} wrt {i_var} for {sex}")
+        fits = ols.simple_fits(sex_data[i_var], sex_data[bps])
+        if n_boot:
+            lines = bootstrap.bootstrap(
+                len(sex_data), {
+                    "line":
+                    bootstrap.line(sex_data[i_var].to_numpy(dtype=float),
+                                   sex_data[bps].to_numpy(dtype=float))
+                }, n_boot)["line"]
+            fits["slope_low"], fits["slope_high"] = bootstrap.interval(
+                lines[:, 1])
+        for param, fit in fits.iterrows():
+            pval = round(fit.pvalue, 4)
 
             # Create a dictionary to store results
             result = {
                 "Group": f"{sex}",
                 "Parameter": param,
-                "Pearson Correlation": pearson.round(2),
-                "Intercept": model.params[0].round(2),
-                "Slope": model.params[1].round(4),
-                "R-squared": rsquared.round(2),
-                "F-statistic": model.fvalue.round(2),
-                "F p-value": model.f_pvalue.round(4),
+                "Pearson Correlation": fit.pearson.round(2),
+                "Intercept": fit.intercept.round(2),
+                "Slope": fit.slope.round(4),
+                **({
+                    "Slope CI Low": fit.slope_low.round(4),
+                    "Slope CI High": fit.slope_high.round(4),
+                } if n_boot else {}),
+                "R-squared": fit.rsquared.round(2),
+                "F-statistic": fit.fvalue.round(2),
+                "F p-value": fit.f_pvalue.round(4),
                 "P-value": pval.round(2),
             }
             results.append(result)
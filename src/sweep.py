@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Sweep the regression and comparative analyses over a grid of health status
+groups and pack-year thresholds, in one process.
+
+The data is loaded once, at the lowest threshold, and every cell of the grid
+is a boolean mask of its rows, from the health status masks of ``get_group``
+and the thresholds. The cells then share the precomputation:
+
+- the univariate regressions of all cells and sexes come from the sums of
+  one matrix product of the masks with the data, see
+  ``ols.masked_simple_fits``;
+- the covariate design of the multivariate and cessation models is built
+  once, and sliced per cell.
+
+Each analysis writes one tidy table, indexed by the grid cell.
+"""
+import argparse
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from analyse import get_columns, i_vars, load_data, logger, runs
+from data.util.dataframe import healthy_mask
+from models.linear import ols
+
+HEALTH_STATS = ["healthy", "unhealthy", "all"]
+SEXES = ["Male", "Female"]
+SPIROMETRY = ["fev1", "fev1_pp", "fev1_fvc", "fvc"]
+COVARIATES = ["sex", "age", "height", "weight", "pack_year_categories"]
+CELL = ["health_stat", "pack_years"]
+CHANGES = {
+    "rsquared_adj": "rsq_change",
+    "aic": "aic_change",
+    "bic": "bic_change"
+}
+
+
+def cell_masks(data: pd.DataFrame, health_stats: list,
+               thresholds: list) -> pd.DataFrame:
+    """
+    The rows of every (health status, pack-year threshold) cell, selected
+    as ``analyse.select_group`` and ``analyse.load_data`` do.
+
+    Parameters:
+    data (pd.DataFrame): The participants, loaded at the lowest threshold.
+    health_stats (list): "healthy", "unhealthy" or "all" (without asthma).
+    thresholds (list): The minimum pack years.
+
+    Returns:
+    pd.DataFrame: A boolean column per cell, named by ``CELL``.
+    """
+    healthy = healthy_mask(data).to_numpy()
+    groups = {
+        "healthy": healthy,
+        "unhealthy": ~healthy,
+        "all": (data["asthma_diagnosis"] == False).fillna(False).to_numpy(
+            dtype=bool)
+    }
+    pack_years = data["pack_years"].to_numpy(dtype=float)
+    masks = pd.DataFrame(
+        {(health_stat, threshold): groups[health_stat] &
+         (pack_years >= threshold)
+         for health_stat in health_stats for threshold in thresholds},
+        index=data.index)
+    masks.columns.names = CELL
+    return masks
+
+
+def _changes(fits: pd.DataFrame) -> pd.DataFrame:
+    """The changes of the fit statistics when adding the parameter."""
+    return pd.DataFrame({
+        "nobs": fits["nobs"],
+        **{
+            change: fits[stat] - fits[f"{stat}_base"]
+            for stat, change in CHANGES.items()
+        }
+    })
+
+
+def _design(design: pd.DataFrame, rows: np.ndarray) -> pd.DataFrame:
+    """
+    The design of some rows, without the columns of levels absent from
+    them, which the design of the rows alone would not have.
+    """
+    design = design[rows]
+    return design.loc[:, design.fillna(0).ne(0).any()]
+
+
+def sweep_univariate(data: pd.DataFrame, masks: pd.DataFrame,
+                     bps: list) -> pd.DataFrame:
+    """
+    Univariate regressions of every parameter on every independent
+    variable, per cell and sex.
+
+    Returns:
+    pd.DataFrame: Indexed by (*CELL, "sex", "i_var", "param"), the
+        statistics of ``ols.simple_fits``.
+    """
+    cells = masks.columns
+    sex = data["sex"].to_numpy()
+    masks = pd.concat({s: masks & (sex == s)[:, None]
+                       for s in SEXES}, axis=1, names=["sex"])
+    masks = masks.reorder_levels([*CELL, "sex"], axis=1)
+    fits = pd.concat(
+        {
+            i_var: ols.masked_simple_fits(data[i_var], data[bps], masks)
+            for i_var in i_vars
+        },
+        names=["i_var"])
+    fits.index = fits.index.set_names("param", level=-1)
+    # In the order of the grid, as the other tables
+    return pd.concat({cell: fits.xs(cell, level=CELL) for cell in cells},
+                     names=CELL).reorder_levels(
+                         [*CELL, "sex", "i_var", "param"])
+
+
+def sweep_multivariate(data: pd.DataFrame, masks: pd.DataFrame,
+                       design: pd.DataFrame, bps: list) -> pd.DataFrame:
+    """
+    Changes of the spirometry models over the covariates when adding each
+    parameter, per cell, as ``multivariate.fit_analyse``.
+
+    Returns:
+    pd.DataFrame: Indexed by (*CELL, "param", "outcome"), the "nobs" and
+        changes of the adjusted R-squared, AIC and BIC.
+    """
+    results = {}
+    for cell, rows in masks.items():
+        rows = rows.to_numpy()
+        if rows.sum() <= design.shape[1] + 1:
+            logger.warning(f"Skipping {cell}, too few participants")
+            continue
+        results[cell] = _changes(
+            ols.fit_nested(data[rows], _design(design, rows), SPIROMETRY,
+                           bps))
+    return pd.concat(results, names=CELL)
+
+
+def sweep_cessation(data: pd.DataFrame, masks: pd.DataFrame,
+                    design: pd.DataFrame, bps: list) -> pd.DataFrame:
+    """
+    Changes of the models of every parameter over the covariates when
+    adding the smoking cessation duration, per cell and health status, as
+    ``cessation.analyse``.
+
+    Returns:
+    pd.DataFrame: Indexed by (*CELL, "health_status", "param"), the "nobs"
+        and changes of the adjusted R-squared, AIC and BIC.
+    """
+    # The models are fitted on the participants who quit
+    quit = data["smoking_cessation_duration"].notna().to_numpy()
+    healthy = healthy_mask(data).to_numpy()
+    statuses = {"healthy": healthy, "unhealthy": ~healthy}
+    results = {}
+    for cell, rows in masks.items():
+        for status, status_rows in statuses.items():
+            rows_status = rows.to_numpy() & status_rows & quit
+            if rows_status.sum() <= design.shape[1] + 1:
+                continue
+            fits = ols.fit_nested(data[rows_status],
+                                  _design(design, rows_status), bps,
+                                  ["smoking_cessation_duration"])
+            results[(*cell, status)] = _changes(
+                fits.droplevel("param").rename_axis("param"))
+    return pd.concat(results, names=[*CELL, "health_status"])
+
+
+def main(args):
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    bps = args.param_list.split(",")
+    out_path = Path(args.out_directory) / "sweep"
+    out_path.mkdir(parents=True, exist_ok=True)
+    thresholds = sorted(args.pack_years)
+
+    start = time.perf_counter()
+    data = load_data(args.in_file, get_columns([runs[1], runs[2]], bps),
+                     thresholds[0])
+    masks = cell_masks(data, args.health_stats, thresholds)
+    masks.sum().rename("participants").to_csv(out_path / "cells.csv")
+    design = ols.base_design(data, COVARIATES)
+    logger.info(f"Loaded {len(data)} participants, {masks.shape[1]} cells "
+                f"in {time.perf_counter() - start:.1f} s")
+
+    def write(name: str, sweep, *inputs):
+        start = time.perf_counter()
+        sweep(data, masks, *inputs).to_csv(out_path / f"{name}.csv")
+        logger.info(f"Swept the {name} analysis in "
+                    f"{time.perf_counter() - start:.1f} s")
+
+    write("univariate", sweep_univariate, bps)
+    write("multivariate", sweep_multivariate, design, bps)
+    write("cessation", sweep_cessation, design, bps)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sweep the analyses over health statuses and pack-year "
+        "thresholds.")
+    parser.add_argument("in_file",
+                        type=str,
+                        help="Input database (.parquet, .feather or .csv).")
+    parser.add_argument("out_directory",
+                        type=str,
+                        help="Output report destination.")
+    parser.add_argument(
+        "--param_list",
+        type=str,
+        default="bp_pi10,bp_wt_avg,bp_la_avg,bp_wap_avg",
+        help="Comma separated list of params to process.",
+    )
+    parser.add_argument("--health_stats",
+                        default=HEALTH_STATS,
+                        nargs="+",
+                        choices=HEALTH_STATS,
+                        help="Health statuses of the grid.")
+    parser.add_argument("--pack_years",
+                        type=float,
+                        default=[0.0, 10.0, 20.0],
+                        nargs="+",
+                        help="Pack-year thresholds of the grid.")
+    parser.add_argument("--debug", action="store_true", help="Debug mode.")
+    args = parser.parse_args()
+    main(args)
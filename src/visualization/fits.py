@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Regression lines of the figures, fitted in batches ahead of drawing.
+
+``group_fits`` fits the OLS or robust line of every parameter on every
+variable, per hue group, and ``group_bands`` bootstraps the confidence bands
+of the OLS lines. The groups are split into NaN-masked columns, so all the
+lines on one variable are fitted at once. The figures then draw the fitted
+lines with matplotlib, instead of seaborn refitting, and bootstrapping,
+every line it plots.
+
+The robust lines are the Huber M-estimates of ``sm.RLM`` with its defaults,
+as ``sns.regplot(robust=True)`` fits them: iteratively reweighted least
+squares with the MAD scale of the residuals, until the deviance changes by
+less than ``TOL``. All columns are iterated together, each stopping when it
+converges.
+"""
+
+import logging
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from data.util import bootstrap
+from data.util.cache import cached_frame, imported_sources, stage_key
+from models.linear import ols
+
+logger = logging.getLogger("BronchialParameters")
+
+# Huber's t and the IRLS stopping rule of sm.RLM
+HUBER_T = 1.345
+TOL = 1e-8
+MAX_ITER = 50
+# Width of the confidence bands and their bootstrap resamples, as seaborn's
+CI = 95
+N_BOOT = 1000
+# Points of the band grids, as seaborn's
+POINTS = 100
+
+# Stage cache of the fits, set by the CLI. None refits every time.
+cache_dir = None
+
+
+def _weighted_lines(x: np.ndarray, Y: np.ndarray, W: np.ndarray):
+    """Weighted least squares lines of the columns of ``Y`` on ``x``."""
+    sw = W.sum(axis=0)
+    x_mean = (W * x[:, None]).sum(axis=0) / sw
+    y_mean = (W * Y).sum(axis=0) / sw
+    xc = x[:, None] - x_mean
+    slope = (W * xc * (Y - y_mean)).sum(axis=0) / (W * xc**2).sum(axis=0)
+    return y_mean - slope * x_mean, slope
+
+
+def _huber(z: np.ndarray) -> np.ndarray:
+    return np.where(
+        np.abs(z) <= HUBER_T, 0.5 * z**2,
+        np.abs(z) * HUBER_T - 0.5 * HUBER_T**2)
+
+
+def _irls_step(x, Y, present, W, nobs):
+    """
+    One weighted fit of the IRLS, with its residuals and the deviance
+    ``sm.RLM`` checks convergence on.
+    """
+    intercept, slope = _weighted_lines(x, Y, W)
+    resid = np.where(present, Y - intercept - slope * x[:, None], np.nan)
+    # Scaled by the residual variance of the weighted fit, as in sm.RLM
+    wscale = np.nansum(W * resid**2, axis=0) / (nobs - 2)
+    return intercept, slope, resid, np.nansum(_huber(resid / wscale), axis=0)
+
+
+def robust_fits(x: pd.Series, Y: pd.DataFrame) -> pd.DataFrame:
+    """
+    Regress every column of ``Y`` on ``x`` with Huber's robust line.
+
+    Each column is fitted on the rows where both it and ``x`` are present.
+
+    Parameters:
+    x (pd.Series): The independent variable.
+    Y (pd.DataFrame): The dependent variables, indexed like ``x``.
+
+    Returns:
+    pd.DataFrame: Indexed by the columns of ``Y``, the "nobs",
+        "intercept", "slope", MAD "scale" and IRLS "iterations" of each fit.
+    """
+    x = x.to_numpy(dtype=float)
+    values = Y.to_numpy(dtype=float)
+    present = ~np.isnan(values) & ~np.isnan(x)[:, None]
+    nobs = present.sum(axis=0)
+    # Missing values get zero weight, zeros keep them out of the sums
+    x_values = np.where(np.isnan(x), 0.0, x)
+    Y_values = np.where(present, values, 0.0)
+    mad = stats.norm.ppf(0.75)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        intercept, slope, resid, deviance = _irls_step(
+            x_values, Y_values, present, present.astype(float), nobs)
+        scale = np.full(len(nobs), np.nan)
+        fitted = nobs > 2
+        scale[fitted] = np.nanmedian(np.abs(resid[:, fitted]), axis=0) / mad
+        iterations = np.ones(len(nobs), dtype=int)
+        active = fitted & (scale > 0)
+        while active.any():
+            cols = np.flatnonzero(active)
+            W = np.where(present[:, cols],
+                         np.minimum(1, HUBER_T * scale[cols] /
+                                    np.abs(resid[:, cols])), 0.0)
+            (intercept[cols], slope[cols], resid[:, cols],
+             step_deviance) = _irls_step(x_values, Y_values[:, cols],
+                                         present[:, cols], W, nobs[cols])
+            scale[cols] = np.nanmedian(np.abs(resid[:, cols]), axis=0) / mad
+            iterations[cols] += 1
+            converged = ((np.abs(step_deviance - deviance[cols]) <= TOL)
+                         | (iterations[cols] >= MAX_ITER)
+                         | (scale[cols] == 0))
+            deviance[cols] = step_deviance
+            active[cols[converged]] = False
+    return pd.DataFrame(
+        {
+            "nobs": nobs,
+            "intercept": intercept,
+            "slope": slope,
+            "scale": scale,
+            "iterations": iterations
+        },
+        index=Y.columns)
+
+
+def bootstrap_bands(x: pd.Series,
+                    Y: pd.DataFrame,
+                    grid: np.ndarray,
+                    n_boot: int = N_BOOT,
+                    ci: float = CI,
+                    seed: int = 0) -> pd.DataFrame:
+    """
+    Bootstrap the confidence bands of the OLS lines of ``Y`` on ``x``.
+
+    Like seaborn, the rows of each fit are resampled ``n_boot`` times and
+    the band is the percentile interval of the resampled lines on ``grid``.
+    Columns present on the same rows share their resamples.
+
+    Parameters:
+    x (pd.Series): The independent variable.
+    Y (pd.DataFrame): The dependent variables, indexed like ``x``.
+    grid (np.ndarray): The values of ``x`` to evaluate the lines at.
+    n_boot (int): Resamples.
+    ci (float): Width of the bands, in percent.
+    seed (int): Seed of the resampling.
+
+    Returns:
+    pd.DataFrame: Indexed by the columns of ``Y`` and the grid "point", the
+        "x" value and the "lower" and "upper" bounds of each band.
+    """
+    x = x.to_numpy(dtype=float)
+    values = Y.to_numpy(dtype=float)
+    present = ~np.isnan(values) & ~np.isnan(x)[:, None]
+    bounds = np.full((2, len(grid), values.shape[1]), np.nan)
+
+    groups = {}
+    for j in range(values.shape[1]):
+        groups.setdefault(present[:, j].tobytes(), []).append(j)
+    seeds = np.random.SeedSequence(seed).spawn(len(groups))
+    for cols, group_seed in zip(groups.values(), seeds):
+        rows = present[:, cols[0]]
+        if rows.sum() < 2:
+            continue
+        statistic = bootstrap.line(x[rows], values[rows][:, cols])
+        lines = bootstrap.bootstrap(rows.sum(), {"line": statistic}, n_boot,
+                                    group_seed)["line"]
+        bounds[:, :, cols] = bootstrap.interval(
+            lines[:, None, 0] + lines[:, None, 1] * grid[None, :, None],
+            ci / 100)
+
+    index = pd.MultiIndex.from_tuples(
+        [(*(col if isinstance(col, tuple) else (col, )), point)
+         for col in Y.columns for point in range(len(grid))],
+        names=[*Y.columns.names, "point"])
+    return pd.DataFrame(
+        {
+            "x": np.tile(grid, values.shape[1]),
+            "lower": bounds[0].T.ravel(),
+            "upper": bounds[1].T.ravel()
+        },
+        index=index)
+
+
+def _by_hue(data: pd.DataFrame, params: list, hue: list) -> pd.DataFrame:
+    """
+    The parameters of every hue group as their own columns, NaN outside
+    the group's rows.
+    """
+    # Grouping by a list of one key warns, its scalar groups become tuples
+    groups = data.groupby(hue if len(hue) > 1 else hue[0], observed=True)
+    return pd.concat(
+        {
+            group if isinstance(group, tuple) else (group, ):
+            rows[params]
+            for group, rows in groups
+        },
+        axis=1,
+        names=hue + ["param"]).reindex(data.index)
+
+
+def group_fits(data: pd.DataFrame,
+               variables: list,
+               params: list,
+               hue: list,
+               robust: bool = False) -> pd.DataFrame:
+    """
+    Fit the line of every parameter on every variable, per hue group.
+
+    Parameters:
+    data (pd.DataFrame): The variables, parameters and hue columns.
+    variables (list): The independent variables.
+    params (list): The dependent variables.
+    hue (list): The columns grouping the rows into separate lines.
+    robust (bool): Fit Huber's robust lines instead of OLS.
+
+    Returns:
+    pd.DataFrame: Indexed by ("variable", *hue, "param"), the statistics of
+        ``robust_fits`` or ``ols.simple_fits``, and the "x_min" and "x_max"
+        of the variable over all groups, which the lines span.
+    """
+    Y = _by_hue(data, params, hue)
+    fits = {}
+    for var in variables:
+        fit = robust_fits(data[var], Y) if robust else ols.simple_fits(
+            data[var], Y)
+        fits[var] = fit.assign(x_min=data[var].min(), x_max=data[var].max())
+    return pd.concat(fits, names=["variable"])
+
+
+def group_bands(data: pd.DataFrame,
+                variables: list,
+                params: list,
+                hue: list,
+                n_boot: int = N_BOOT,
+                ci: float = CI,
+                seed: int = 0) -> pd.DataFrame:
+    """
+    Bootstrap the OLS bands of every parameter on every variable, per hue
+    group, over ``POINTS`` points spanning the variable.
+
+    Returns:
+    pd.DataFrame: Indexed by ("variable", *hue, "param", "point"), as
+        ``bootstrap_bands``.
+    """
+    Y = _by_hue(data, params, hue)
+    bands = {}
+    for var in variables:
+        grid = np.linspace(data[var].min(), data[var].max(), POINTS)
+        bands[var] = bootstrap_bands(data[var], Y, grid, n_boot, ci, seed)
+    return pd.concat(bands, names=["variable"])
+
+
+def cached(func, data: pd.DataFrame, **kwargs) -> pd.DataFrame:
+    """
+    ``func(data, **kwargs)`` through the stage cache, keyed by the values
+    of ``data``, the arguments and this module with the project modules it
+    imports, which fit the lines and bands.
+    """
+    stage = func.__name__
+    key = stage_key(stage,
+                    inputs=[data],
+                    code=imported_sources(sys.modules[__name__]),
+                    params=kwargs)
+    return cached_frame(stage, key, lambda: func(data, **kwargs), cache_dir)
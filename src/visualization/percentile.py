@@ -6,9 +6,15 @@ import pandas as pd
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
-from tqdm import tqdm
 
+from data.util.quantiles import group_quantiles
+from . import fits
 from .prettifiers import prettify_axes
+from .render import render
+
+QUANTILES = [0.1, 0.3, 0.5, 0.7, 0.9]
+SEXES = ["Male", "Female"]
+SMOKING_STATUSES = ["never_smoker", "ex_smoker", "current_smoker"]
 
 logger = logging.getLogger("BronchialParameters")
 
@@ -48,61 +54,91 @@ def make_plots(data, bps, out_path):
     age_cut_2 = np.linspace(40, 88, 23)
     age_cut_2 = np.append(age_cut_2, 100)
 
+    # Derived columns go to a shallow copy, the caller's data is shared
+    data = data.copy(deep=False)
     data["age_2yr"] = pd.cut(data["age"],
                              bins=age_cut_2,
                              labels=age_label_2,
                              right=False)
+    # Statuses or sexes pruned from the categories, e.g. never smokers above
+    # a pack-year threshold, still get their (empty) plots
+    data["smoking_status"] = data["smoking_status"].astype(
+        pd.CategoricalDtype(SMOKING_STATUSES))
+    data["sex"] = data["sex"].astype(pd.CategoricalDtype(SEXES))
 
     sns.set_theme(style="whitegrid")
 
     age_dict = {"45-50": 47.5, "50-55": 52.5, "55-60": 57.5, "60-65": 62.5, "65-70": 67.5, "70-75": 72.5, "75-80": 77.5, "80+": 85}
-    data.replace({"age_5yr": age_dict}, inplace=True)
-
-    for param in tqdm(bps):
-        for sex in ["Male", "Female"]:
-            ylims = [data[data.sex == sex][param].quantile(0.025), data[data.sex == sex][param].quantile(0.975)]
-            for sm_stat in ["never_smoker", "ex_smoker", "current_smoker"]:
-                percentiles = (data[(data["smoking_status"] == sm_stat)
-                                    & (data["sex"] == sex)].groupby(
-                                        "age_5yr")[param].quantile(
-                                            [0.1, 0.3, 0.5, 0.7,
-                                             0.9]).reset_index())
-                percentiles = percentiles.rename(
-                    columns={"level_1": "Percentile"})
-                percentiles.Percentile = percentiles["Percentile"].apply(
-                    lambda x: f"{x * 100:.0f}%")
-
-                fig = sns.lmplot(
-                    data=percentiles,
-                    x="age_5yr",
-                    y=param,
-                    hue="Percentile",
-                    scatter=False,
-                    truncate=False,
-                    palette=sns.color_palette([
-                        "deepskyblue", "mediumseagreen", "green", "orange",
-                        "red"
-                    ]),
-                    ci=None,
-                    # order=2,
-                    robust=True,
-                    line_kws={"alpha": 0.5},
-                )
-
-                prettify_axes(fig)
-
-                sns.move_legend(fig,
-                                "lower center",
-                                bbox_to_anchor=(0.5, 1.0),
-                                ncol=5,
-                                title=None,
-                                frameon=False)
-
-                # Additional customization of the x-axis
-                fig.set(ylim=ylims, xlim=[45, 85])
-                plt.xlabel("Age")
-                plt.title(f"{sex.title()} {sm_stat.replace('_', ' ').title()}")
-                plt.tight_layout()
-                fig.savefig(f"{str(out_path / param)}_{sex}_{sm_stat}.png",
-                            dpi=300)
-                plt.close()
+
+    # Sort every (smoking status, sex, age band) group once, the y-limits per
+    # sex are merged from the same sorts
+    group_percentiles = group_quantiles(
+        data, bps, ["smoking_status", "sex", "age_5yr"],
+        QUANTILES).rename(index=age_dict, level="age_5yr").sort_index()
+    sex_ranges = group_quantiles(data, bps, ["sex"], [0.025, 0.975])
+
+    # The robust lines of every status, sex, percentile and parameter, at
+    # once
+    lines = fits.cached(fits.group_fits,
+                        group_percentiles.rename_axis(
+                            ["smoking_status", "sex", "age_5yr",
+                             "Percentile"]).reset_index(),
+                        variables=["age_5yr"],
+                        params=bps,
+                        hue=["smoking_status", "sex", "Percentile"],
+                        robust=True).droplevel("variable")
+    lines.to_csv(out_path / "percentile_fits.csv")
+
+    def jobs():
+        for param in bps:
+            for sex in SEXES:
+                ylims = [sex_ranges.loc[(sex, 0.025), param], sex_ranges.loc[(sex, 0.975), param]]
+                for sm_stat in SMOKING_STATUSES:
+                    yield (out_path / f"{param}_{sex}_{sm_stat}.png",
+                           plot_percentiles,
+                           (percentile_lines(lines, sm_stat, sex, param),
+                            param, sex, sm_stat, ylims))
+
+    render(jobs(),
+           total=len(bps) * len(SEXES) * len(SMOKING_STATUSES),
+           desc="percentile")
+
+
+def percentile_lines(lines, sm_stat, sex, param):
+    """
+    The lines of one plot, indexed by percentile. Pruned statuses have
+    none.
+    """
+    mask = ((lines.index.get_level_values("smoking_status") == sm_stat)
+            & (lines.index.get_level_values("sex") == sex)
+            & (lines.index.get_level_values("param") == param))
+    return lines[mask].droplevel(["smoking_status", "sex", "param"])
+
+
+def plot_percentiles(lines, param, sex, sm_stat, ylims, path):
+    fig, ax = plt.subplots(figsize=(5, 5))
+    colors = ["deepskyblue", "mediumseagreen", "green", "orange", "red"]
+    # The lines span the axis, as seaborn's untruncated ones
+    x = np.array([45, 85])
+    for (percentile, fit), color in zip(lines.iterrows(), colors):
+        ax.plot(x,
+                fit.intercept + fit.slope * x,
+                color=color,
+                alpha=0.5,
+                label=f"{percentile * 100:.0f}%")
+    ax.set(xlabel="age_5yr", ylabel=param)
+    prettify_axes(ax)
+
+    fig.legend(loc="lower center",
+               bbox_to_anchor=(0.5, 1.0),
+               ncol=5,
+               title=None,
+               frameon=False)
+
+    # Additional customization of the x-axis
+    ax.set(ylim=ylims, xlim=[45, 85])
+    ax.set_xlabel("Age")
+    ax.set_title(f"{sex.title()} {sm_stat.replace('_', ' ').title()}")
+    fig.tight_layout()
+    fig.savefig(path, dpi=300, bbox_inches="tight")
+    plt.close(fig)
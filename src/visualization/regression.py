@@ -5,29 +5,39 @@ import logging
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-import scipy.stats as stats
-from tqdm import tqdm
 
 from data.util.dataframe import min_max_scale
+from . import fits
 from .prettifiers import prettify_axes
+from .render import render
 
 logger = logging.getLogger("BronchialParameters")
 debug = (logger.level == logging.DEBUG)
 
+VARIABLES = [
+    "age", "height", "weight", "fev1_fvc", "fev1_pp",
+    "smoking_cessation_duration"
+]
+
 def make_plots(data: pd.DataFrame,
                bps: list,
                out_path: Path,
-               min_max_params: bool = False):
+               min_max_params: bool = False,
+               n_boot: int = fits.N_BOOT):
     """
     Creates scatter plots with linear regression fits to visualize the relationship between bronchial parameters (bp) and
     various demographic and anthropometric factors such as age, length, weight, and bmi. The plots are saved in a given
     output directory.
 
+    The lines of all plots and their bootstrapped confidence bands are fitted beforehand, and the coefficients are
+    written to "regression_fits.csv" next to the plots.
+
     Args:
         data (pd.DataFrame): A pandas dataframe with columns for age, height, weight, bmi, bp,
         smoking_status, and sex.
         bps (list): A list of strings containing the names of the bronchial parameters columns to be plotted.
         out_path (Path): A Path object pointing to the directory where the output plots will be saved.
+        n_boot (int): Bootstrap resamples of the confidence bands, 0 draws the lines only.
 
     Returns:
         None
@@ -43,28 +53,81 @@ def make_plots(data: pd.DataFrame,
 
     if min_max_params:
         data = min_max_scale(data, ["age", "height", "weight", "bmi"] + bps)
+    data = data[VARIABLES + bps + ["smoking_status", "sex"]].dropna(
+        subset=["smoking_status", "sex"])
+
+    lines = fits.cached(fits.group_fits,
+                        data,
+                        variables=VARIABLES,
+                        params=bps,
+                        hue=["sex"])
+    lines.to_csv(out_path / "regression_fits.csv")
+    bands = fits.cached(fits.group_bands,
+                        data,
+                        variables=VARIABLES,
+                        params=bps,
+                        hue=["sex"],
+                        n_boot=n_boot) if n_boot else None
+
+    def jobs():
+        for param in bps:
+            for var in VARIABLES:
+                # The rows the lines were fitted on
+                data_reg = data[[var, param, "sex"]].dropna()
+                ylims = ((0, 1) if min_max_params else tuple(
+                    data_reg[param].quantile([0.1, 0.9])))
+                yield (out_path / f"{param}_{var}_regression.png",
+                       plot_regression,
+                       (lines.xs((var, param), level=["variable", "param"]),
+                        None if bands is None else bands.xs(
+                            (var, param), level=["variable", "param"]),
+                        data_reg if debug else None, var, param, ylims))
+
+    render(jobs(), total=len(bps) * len(VARIABLES), desc="regression")
 
-    for param in tqdm(bps):
-
-        for var in ["age", "height", "weight", "fev1_fvc", "fev1_pp", "smoking_cessation_duration"]:
-            data_reg = data[[var, param, "smoking_status", "sex"]].dropna()
-            r, p = stats.pearsonr(data_reg[var], data_reg[param])
-
-            fig = sns.lmplot(
-                data=data_reg,
-                x=var,
-                y=param,
-                hue="sex",
-                truncate=False,
-                scatter=debug,
-                scatter_kws={"alpha": 0.3},
-            )
-            fig.set(ylim = (data_reg[param].quantile(0.1), data_reg[param].quantile(0.9)))
-            logger.debug("Pearson for {} and {}: {}".format(var, param, r))
-            sns.despine(left=True)
-            if min_max_params:
-                fig.set(ylim=(0, 1))
-            prettify_axes(fig)
-            fig.fig.savefig(f"{str(out_path / param)}_{var}_regression.png",
-                            dpi=300)
-            plt.close()
+
+def plot_regression(lines: pd.DataFrame, bands: pd.DataFrame,
+                    data_reg: pd.DataFrame, var: str, param: str,
+                    ylims: tuple, path: Path):
+    """
+    Plot the regression lines of a parameter on a variable, per sex.
+
+    Parameters:
+    lines (pd.DataFrame): The fits of ``fits.group_fits``, indexed by sex.
+    bands (pd.DataFrame): The bands of ``fits.group_bands``, indexed by sex
+        and point, or None.
+    data_reg (pd.DataFrame): The rows to scatter, or None.
+    var (str): The x-axis variable.
+    param (str): The bronchial parameter.
+    ylims (tuple): The y-axis limits.
+    path (Path): The figure file.
+    """
+    fig, ax = plt.subplots(figsize=(6, 5))
+    colors = sns.color_palette(n_colors=len(lines))
+    for (sex, fit), color in zip(lines.iterrows(), colors):
+        logger.debug("Pearson for {} and {} ({}): {}".format(
+            var, param, sex, fit.pearson))
+        if data_reg is not None:
+            rows = data_reg[data_reg["sex"] == sex]
+            ax.scatter(rows[var], rows[param], color=color, alpha=0.3, s=10)
+        x = [fit.x_min, fit.x_max]
+        ax.plot(x, [fit.intercept + fit.slope * value for value in x],
+                color=color,
+                label=sex)
+        if bands is not None and sex in bands.index:
+            band = bands.loc[sex]
+            ax.fill_between(band.x,
+                            band.lower,
+                            band.upper,
+                            color=color,
+                            alpha=0.15,
+                            linewidth=0)
+    ax.set(xlabel=var, ylabel=param, ylim=ylims)
+    ax.legend(title="sex",
+              loc="center left",
+              bbox_to_anchor=(1, 0.5),
+              frameon=False)
+    sns.despine(ax=ax, left=True)
+    prettify_axes(ax)
+    fig.savefig(path, dpi=300, bbox_inches="tight")
+    plt.close(fig)
@@ -0,0 +1,171 @@
+"""
+Render independent figures, in parallel on a pool of processes if one is
+open, skipping the figures whose inputs did not change.
+
+A figure job is the file to draw, a module level function drawing and
+saving it and the function's arguments, including the slice of the data it
+plots, so a job is cheap to send to a worker. The workers start with the Agg
+backend and the seaborn theme already set up, and the progress of all of
+them is shown on one bar.
+
+Every output directory has a manifest of the key each figure was drawn
+with: the hash of its data slices, its other arguments and the code drawing
+it. Figures whose key is unchanged are not drawn again unless ``force`` is
+set.
+"""
+
+import json
+import logging
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+
+import matplotlib
+import pandas as pd
+import seaborn as sns
+from tqdm import tqdm
+
+from data.util.cache import imported_sources, stage_key
+
+logger = logging.getLogger("BronchialParameters")
+
+THEME = {"style": "whitegrid"}
+MANIFEST = "figures.json"
+# Figures also change with the plotting libraries
+VERSIONS = {"matplotlib": matplotlib.__version__, "seaborn": sns.__version__}
+
+# Redraw every figure, even if its key is unchanged
+force = False
+
+# The pool of the enclosing ``pool()`` block and its size, None renders in
+# process
+_pool = None
+_workers = 1
+
+
+def init_worker():
+    """Set up a rendering process once, instead of per figure."""
+    matplotlib.use("Agg")
+    sns.set_theme(**THEME)
+
+
+@contextmanager
+def pool(workers: int):
+    """
+    Render the figures of ``render`` calls within the block on ``workers``
+    processes. With one worker, or within a worker, they are rendered in
+    process.
+    """
+    global _pool, _workers
+    if workers <= 1 or _pool is not None:
+        yield
+        return
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker) as executor:
+        _pool, _workers = executor, workers
+        try:
+            yield
+        finally:
+            _pool, _workers = None, 1
+
+
+def figure_key(func, args: tuple) -> str:
+    """
+    Key of a figure: its data slices by value, its other arguments and the
+    module drawing it with the project modules it imports. Paths only
+    locate the outputs and are left out.
+    """
+    frames = [arg for arg in args if isinstance(arg, pd.DataFrame)]
+    params = [
+        arg for arg in args if not isinstance(arg, (pd.DataFrame, Path))
+    ]
+    return stage_key("figure",
+                     inputs=frames,
+                     code=imported_sources(sys.modules[func.__module__]),
+                     params={
+                         "args": params,
+                         "versions": VERSIONS
+                     })
+
+
+@contextmanager
+def manifests():
+    """
+    The figure keys of the output directories, loaded on first use and
+    saved when the block exits, also on errors.
+    """
+    loaded = {}
+
+    def manifest(directory: Path) -> dict:
+        if directory not in loaded:
+            path = directory / MANIFEST
+            loaded[directory] = (json.loads(path.read_text())
+                                 if path.exists() else {})
+        return loaded[directory]
+
+    try:
+        yield manifest
+    finally:
+        for directory, keys in loaded.items():
+            # Replaced at once, an interrupted write keeps the old manifest
+            tmp = directory / f".{MANIFEST}.tmp"
+            tmp.write_text(json.dumps(keys, indent=1, sort_keys=True))
+            os.replace(tmp, directory / MANIFEST)
+
+
+def render(jobs, total: int = None, desc: str = None):
+    """
+    Render figure jobs, in the pool of the enclosing ``pool()`` if any.
+
+    Jobs are taken from ``jobs`` as workers free up, so a generator only
+    slices the data of the figures in flight. Figures drawn before from the
+    same key are skipped.
+
+    Parameters:
+    jobs (iterable): ``(path, func, args)`` tuples, ``func(*args, path)``
+        draws the figure and saves it to ``path``.
+    total (int): Number of jobs, for the progress bar.
+    desc (str): Label of the progress bar.
+    """
+    skipped = 0
+    with tqdm(total=total, desc=desc) as progress, manifests() as manifest:
+
+        def changed():
+            nonlocal skipped
+            for path, func, args in jobs:
+                path = Path(path)
+                key = figure_key(func, args)
+                if (not force and path.exists()
+                        and manifest(path.parent).get(path.name) == key):
+                    skipped += 1
+                    progress.update()
+                    continue
+                yield path, key, func, args
+
+        def drawn(path: Path, key: str):
+            manifest(path.parent)[path.name] = key
+            progress.update()
+
+        todo = changed()
+        if _pool is None:
+            for path, key, func, args in todo:
+                func(*args, path)
+                drawn(path, key)
+        else:
+            pending = {}
+            while True:
+                for path, key, func, args in islice(
+                        todo, 2 * _workers - len(pending)):
+                    pending[_pool.submit(func, *args, path)] = (path, key)
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    # Re-raises the exception of a failed figure
+                    future.result()
+                    drawn(*pending.pop(future))
+    if skipped:
+        logger.info(f"Skipped {skipped} unchanged {desc or ''} figures")
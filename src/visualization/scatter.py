@@ -4,6 +4,7 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 
 from .prettifiers import prettify_axes
+from .render import render
 
 
 def make_plots(data, params, out_path):
@@ -11,6 +12,7 @@ def make_plots(data, params, out_path):
     if len(params) != 2:
         raise ValueError("params must be a list of length 2")
 
+    data = data.copy(deep=False)
     data["pack_years"] = data["pack_years"].astype(float)
 
     data = data[data.pack_years >= 1]
@@ -19,6 +21,12 @@ def make_plots(data, params, out_path):
     out_path.mkdir(parents=True, exist_ok=True)
 
     sns.set_theme(style="whitegrid")
+    render([(out_path / "scatter.png", plot_scatter, (data[params], params))],
+           total=1,
+           desc="scatter")
+
+
+def plot_scatter(data, params, path):
     fig = sns.jointplot(
         data=data,
         x=params[0],
@@ -32,5 +40,5 @@ def make_plots(data, params, out_path):
     # fig.plot_marginals(sns.histplot, kde=True, alpha=0.5, binwidth=2)
     sns.despine(left=True)
     # prettify_axes(fig)
-    fig.savefig(f"{str(out_path)}/scatter.png", dpi=300)
+    fig.savefig(path, dpi=300)
     plt.close()
@@ -4,6 +4,7 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 
 from .prettifiers import prettify_axes
+from .render import render
 
 
 def make_plots(data, bps, out_path):
@@ -11,19 +12,24 @@ def make_plots(data, bps, out_path):
     out_path.mkdir(parents=True, exist_ok=True)
 
     sns.set_theme(style="whitegrid")
-    for param in bps:
-        fig = sns.violinplot(data=data,
-                             x="smoking_status",
-                             y=param,
-                             hue="sex",
-                             split=True,
-                             inner="quart",
-                             linewidth=1.5,
-                             palette={
-                                 "Male": "b",
-                                 "Female": "salmon"
-                             })
-        sns.despine(left=True)
-        prettify_axes(fig)
-        fig.get_figure().savefig(f"{str(out_path / param)}_violin.png", dpi=300)
-        plt.close()
+    jobs = ((out_path / f"{param}_violin.png", plot_violin,
+             (data[["smoking_status", "sex", param]], param)) for param in bps)
+    render(jobs, total=len(bps), desc="violin")
+
+
+def plot_violin(data, param, path):
+    fig = sns.violinplot(data=data,
+                         x="smoking_status",
+                         y=param,
+                         hue="sex",
+                         split=True,
+                         inner="quart",
+                         linewidth=1.5,
+                         palette={
+                             "Male": "b",
+                             "Female": "salmon"
+                         })
+    sns.despine(left=True)
+    prettify_axes(fig)
+    fig.get_figure().savefig(path, dpi=300)
+    plt.close()
@@ -0,0 +1,66 @@
+import dis
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+# Runs the imports of a unit in a fresh interpreter and lists the files of
+# the modules they loaded
+PROBE = """
+import importlib, json, sys
+for name, fromlist in json.loads(sys.argv[1]):
+    module = importlib.import_module(name)
+    for attr in fromlist:
+        if not hasattr(module, attr):
+            importlib.import_module(f"{name}.{attr}")
+print(json.dumps([getattr(m, "__file__", None) for m in sys.modules.values()]))
+"""
+
+
+def unit_imports(func) -> list:
+    """The (module, names) of the import statements of a function."""
+    instructions = list(dis.get_instructions(func))
+    return [(ins.argval, list(instructions[i - 1].argval or ()))
+            for i, ins in enumerate(instructions)
+            if ins.opname == "IMPORT_NAME"]
+
+
+def loaded_sources(imports: list) -> set:
+    """The project source files loaded by running some imports."""
+    out = subprocess.run([sys.executable, "-c", PROBE, json.dumps(imports)],
+                         cwd=SRC_DIR,
+                         env={"PYTHONPATH": str(SRC_DIR)},
+                         capture_output=True,
+                         text=True,
+                         check=True).stdout
+    files = {Path(path).resolve() for path in json.loads(out) if path}
+    return {path for path in files if SRC_DIR in path.parents}
+
+
+def main():
+    import analyse
+    from data.util.cache import imported_sources
+
+    missing = {}
+    for run, units in analyse.run_units.items():
+        for name, func in units.items():
+            func = getattr(func, "func", func)
+            keyed = set(imported_sources(func))
+            loaded = loaded_sources(unit_imports(func))
+            if loaded - keyed:
+                missing[f"{run}/{name}"] = sorted(
+                    str(path.relative_to(SRC_DIR))
+                    for path in loaded - keyed)
+
+    if missing:
+        raise AssertionError(
+            "Modules imported by units but missing from their cache keys: "
+            f"{json.dumps(missing, indent=2)}")
+    print(">>> The cache keys of all units cover their imports!")
+
+
+if __name__ == '__main__':
+    main()